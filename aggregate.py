@@ -0,0 +1,96 @@
+import datetime
+import math
+from dataclasses import dataclass
+
+
+PERIODS = ("day", "week", "month", "year", "all")
+
+
+@dataclass
+class PeriodStats:
+    period: str
+    start: datetime.date
+    activities: int
+    total_time: float
+    distance: float
+    calories: int
+    max_speed: float
+    max_heartrate: int
+    average_heartrate: float
+
+
+def period_key(date, period):
+    """Returns (label, first day) of the period a date falls in, weeks are ISO weeks"""
+    if period == "day":
+        return date.isoformat(), date
+    if period == "week":
+        year, week, weekday = date.isocalendar()
+        return f"{year}-W{week:02d}", date - datetime.timedelta(days=weekday - 1)
+    if period == "month":
+        return f"{date.year}-{date.month:02d}", date.replace(day=1)
+    if period == "year":
+        return str(date.year), date.replace(month=1, day=1)
+    if period == "all":
+        return "all", None
+    raise ValueError(f"Unknown period '{period}', expected one of {PERIODS}")
+
+
+def _date(value):
+    return value if isinstance(value, datetime.date) else datetime.date.fromisoformat(value)
+
+
+def aggregate(rows, period="week"):
+    """
+    Totals per day/week/month/year over a set of activity summaries
+    rows are ActivityCatalog rows or any mapping with date, duration, distance,
+    calories, average_heartrate, max_heartrate and max_speed, so no TCX is parsed
+    The average heart rate is weighted by the duration of each activity
+    Returns a list of PeriodStats in date order
+    """
+    groups = {}
+    for row in rows:
+        label, start = period_key(_date(row["date"]), period)
+        group = groups.get(label)
+        if group is None:
+            group = groups[label] = {"start": start, "activities": 0, "total_time": 0.0, "distance": 0.0,
+                                     "calories": 0, "max_speed": 0.0, "max_heartrate": 0,
+                                     "heartrate_time": 0.0, "weighted_heartrate": 0.0}
+        duration = row["duration"] or 0.0
+        group["activities"] += 1
+        group["total_time"] += duration
+        group["distance"] += row["distance"] or 0.0
+        group["calories"] += row["calories"] or 0
+        group["max_speed"] = max(group["max_speed"], row["max_speed"] or 0.0)
+        group["max_heartrate"] = max(group["max_heartrate"], row["max_heartrate"] or 0)
+        # activities without heart rate are NULL in the catalog, or NaN in a Track's totals
+        if row["average_heartrate"] and not math.isnan(row["average_heartrate"]):
+            group["heartrate_time"] += duration
+            group["weighted_heartrate"] += row["average_heartrate"] * duration
+
+    stats = []
+    for label, group in groups.items():
+        heartrate_time = group.pop("heartrate_time")
+        weighted_heartrate = group.pop("weighted_heartrate")
+        average_heartrate = weighted_heartrate / heartrate_time if heartrate_time else None
+        stats.append(PeriodStats(period=label, average_heartrate=average_heartrate, **group))
+    return sorted(stats, key=lambda s: s.period)
+
+
+def totals(rows):
+    """PeriodStats over every row together, or None if there are no rows"""
+    stats = aggregate(rows, "all")
+    return stats[0] if stats else None
+
+
+def format_duration(seconds):
+    seconds = int(round(seconds))
+    return f"{seconds // 3600}:{seconds % 3600 // 60:02d}:{seconds % 60:02d}"
+
+
+def format_stats(stats):
+    """One line summary of a PeriodStats for display"""
+    text = (f"{stats.activities} activities, {stats.distance / 1000:.1f} km, "
+            f"{format_duration(stats.total_time)}, {stats.calories} kcal")
+    if stats.average_heartrate:
+        text += f", avg HR {stats.average_heartrate:.0f}, max HR {stats.max_heartrate}"
+    return text
@@ -0,0 +1,171 @@
+"""
+Deterministic generator of realistic TCX files for benchmarks
+
+    python benchmarks/generate_tcx.py out.tcx --laps 10 --points_per_lap 1000 --no_gps
+"""
+import argparse
+import datetime
+import math
+import random
+
+
+TCX_HEADER = """<?xml version="1.0" encoding="UTF-8"?>
+<TrainingCenterDatabase xsi:schemaLocation="http://www.garmin.com/xmlschemas/TrainingCenterDatabase/v2 http://www.garmin.com/xmlschemas/TrainingCenterDatabasev2.xsd" xmlns:ns5="http://www.garmin.com/xmlschemas/ActivityGoals/v1" xmlns:ns3="http://www.garmin.com/xmlschemas/ActivityExtension/v2" xmlns:ns2="http://www.garmin.com/xmlschemas/UserProfile/v2" xmlns="http://www.garmin.com/xmlschemas/TrainingCenterDatabase/v2" xmlns:xsi="http://www.w3.org/2001/XMLSchema-instance" xmlns:ns4="http://www.garmin.com/xmlschemas/ProfileExtension/v1">
+  <Activities>
+    <Activity Sport="{sport}">
+      <Id>{start}</Id>
+"""
+
+TCX_FOOTER = """      <Creator xsi:type="Device_t">
+        <Name>Synthetic</Name>
+        <UnitId>0</UnitId>
+        <ProductID>0</ProductID>
+      </Creator>
+    </Activity>
+  </Activities>
+</TrainingCenterDatabase>
+"""
+
+START_TIME = datetime.datetime(2024, 1, 5, 21, 50, tzinfo=datetime.timezone.utc)
+# metres per degree of latitude
+METRES_PER_DEGREE = 111320.0
+
+
+def format_time(t):
+    return t.strftime("%Y-%m-%dT%H:%M:%S.000Z")
+
+
+def _trackpoint(t, point, heartrate, gps, cadence, speed, sport):
+    lines = ["          <Trackpoint>", f"            <Time>{format_time(t)}</Time>"]
+    if gps:
+        lines += ["            <Position>",
+                  f"              <LatitudeDegrees>{point['latitude']:.10f}</LatitudeDegrees>",
+                  f"              <LongitudeDegrees>{point['longitude']:.10f}</LongitudeDegrees>",
+                  "            </Position>",
+                  f"            <AltitudeMeters>{point['altitude']:.1f}</AltitudeMeters>"]
+    lines.append(f"            <DistanceMeters>{point['distance']:.2f}</DistanceMeters>")
+    if heartrate:
+        lines.append(f"            <HeartRateBpm><Value>{point['heartrate']}</Value></HeartRateBpm>")
+    # like Garmin devices, bike cadence goes in the core schema and run cadence in the extension
+    run_cadence = cadence and sport == "Running"
+    if cadence and not run_cadence:
+        lines.append(f"            <Cadence>{point['cadence']}</Cadence>")
+    if speed or run_cadence:
+        lines += ["            <Extensions>", "              <ns3:TPX>"]
+        if speed:
+            lines.append(f"                <ns3:Speed>{point['speed']:.3f}</ns3:Speed>")
+        if run_cadence:
+            lines.append(f"                <ns3:RunCadence>{point['cadence']}</ns3:RunCadence>")
+        lines += ["              </ns3:TPX>", "            </Extensions>"]
+    lines.append("          </Trackpoint>")
+    return "\n".join(lines) + "\n"
+
+
+def _lap(start, points, heartrate):
+    """Lap element up to the opening Track tag, with totals worked out from its points"""
+    duration = len(points)
+    distance = points[-1]["distance"] - points[0]["distance"] + points[0]["step"]
+    lines = [f'        <Lap StartTime="{format_time(start)}">',
+             f"          <TotalTimeSeconds>{duration:.1f}</TotalTimeSeconds>",
+             f"          <DistanceMeters>{distance:.2f}</DistanceMeters>",
+             f"          <MaximumSpeed>{max(p['speed'] for p in points):.3f}</MaximumSpeed>",
+             f"          <Calories>{int(distance / 1000 * 65)}</Calories>"]
+    if heartrate:
+        average = round(sum(p["heartrate"] for p in points) / len(points))
+        lines += [f"          <AverageHeartRateBpm><Value>{average}</Value></AverageHeartRateBpm>",
+                  f"          <MaximumHeartRateBpm><Value>{max(p['heartrate'] for p in points)}</Value></MaximumHeartRateBpm>"]
+    lines += ["          <Intensity>Active</Intensity>",
+              "          <TriggerMethod>Distance</TriggerMethod>",
+              "          <Track>"]
+    return "\n".join(lines) + "\n"
+
+
+def _lap_end(points, speed, cadence, sport):
+    run_cadence = cadence and sport == "Running"
+    lines = ["          </Track>"]
+    if speed or run_cadence:
+        lines += ["          <Extensions>", "            <ns3:LX>"]
+        if speed:
+            lines.append(f"              <ns3:AvgSpeed>{sum(p['speed'] for p in points) / len(points):.3f}</ns3:AvgSpeed>")
+        if run_cadence:
+            lines.append(f"              <ns3:AvgRunCadence>{round(sum(p['cadence'] for p in points) / len(points))}</ns3:AvgRunCadence>")
+            lines.append(f"              <ns3:MaxRunCadence>{max(p['cadence'] for p in points)}</ns3:MaxRunCadence>")
+        lines += ["            </ns3:LX>", "          </Extensions>"]
+    lines.append("        </Lap>")
+    return "\n".join(lines) + "\n"
+
+
+def generate_tcx(path, laps=5, points_per_lap=1000, heartrate=True, gps=True, cadence=True, speed=True,
+                 seed=0, start_time=START_TIME, sport="Running"):
+    """
+    Write a TCX activity with laps * points_per_lap Trackpoints one second apart
+    Pace, heart rate, cadence and altitude drift smoothly with some noise and the route
+    wanders from a fixed start, the same seed always gives the same file
+    Laps are written one at a time, so files of millions of points don't need the memory
+    Returns the number of Trackpoints written
+    """
+    rng = random.Random(seed)
+    latitude, longitude, altitude = 45.5, 7.2, 350.0
+    heading = rng.uniform(0, 2 * math.pi)
+    distance = 0.0
+    t = start_time
+    i = 0
+
+    with open(path, "w", encoding="utf-8", newline="\n") as f:
+        f.write(TCX_HEADER.format(sport=sport, start=format_time(start_time)))
+        for lap in range(laps):
+            points = []
+            lap_start = t
+            for _ in range(points_per_lap):
+                pace = 3.2 + 0.6 * math.sin(i / 600) + rng.gauss(0, 0.08)
+                pace = max(0.5, pace)
+                heading += rng.gauss(0, 0.05)
+                distance += pace
+                latitude += pace * math.cos(heading) / METRES_PER_DEGREE
+                longitude += pace * math.sin(heading) / (METRES_PER_DEGREE * math.cos(math.radians(latitude)))
+                altitude += 0.3 * math.sin(i / 240) + rng.gauss(0, 0.05)
+                points.append({
+                    "step": pace,
+                    "distance": distance,
+                    "latitude": latitude,
+                    "longitude": longitude,
+                    "altitude": altitude,
+                    "speed": pace,
+                    "heartrate": int(125 + 20 * (pace - 2.6) + 15 * min(1.0, i / 1800) + rng.gauss(0, 2)),
+                    "cadence": int(78 + 4 * (pace - 3.2) + rng.gauss(0, 1)),
+                })
+                i += 1
+
+            f.write(_lap(lap_start, points, heartrate))
+            for offset, point in enumerate(points):
+                f.write(_trackpoint(lap_start + datetime.timedelta(seconds=offset), point,
+                                    heartrate, gps, cadence, speed, sport))
+            f.write(_lap_end(points, speed, cadence, sport))
+            t = lap_start + datetime.timedelta(seconds=len(points))
+        f.write(TCX_FOOTER)
+    return i
+
+
+def get_args():
+    parser = argparse.ArgumentParser(description="Write a synthetic TCX activity")
+    parser.add_argument('path')
+    parser.add_argument('--laps', dest="laps", action='store', type=int, default=5, required=False)
+    parser.add_argument('--points_per_lap', dest="points_per_lap", action='store', type=int, default=1000, required=False)
+    parser.add_argument('--seed', dest="seed", action='store', type=int, default=0, required=False)
+    parser.add_argument('--sport', dest="sport", action='store', default="Running", required=False)
+    parser.add_argument('--no_heartrate', dest="heartrate", action='store_false', required=False)
+    parser.add_argument('--no_gps', dest="gps", action='store_false', required=False)
+    parser.add_argument('--no_cadence', dest="cadence", action='store_false', required=False)
+    parser.add_argument('--no_speed', dest="speed", action='store_false', required=False)
+    return parser.parse_args()
+
+
+def main():
+    args = get_args()
+    count = generate_tcx(args.path, args.laps, args.points_per_lap, args.heartrate, args.gps, args.cadence,
+                         args.speed, args.seed, sport=args.sport)
+    print(f"Wrote {count} points to {args.path}")
+
+
+if __name__ == "__main__":
+    main()
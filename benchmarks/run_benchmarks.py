@@ -0,0 +1,280 @@
+"""
+Time and memory benchmarks of the parser, search, export and plotting on synthetic TCX files
+
+    python benchmarks/run_benchmarks.py --sizes 1k,10k --output before.json
+    python benchmarks/run_benchmarks.py --sizes 1k,10k --compare before.json
+
+Every benchmark runs in a fresh interpreter so peak memory isn't polluted by earlier runs
+Results are written as JSON, --compare reports the benchmarks that got slower than a baseline
+"""
+import argparse
+import datetime
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+BENCHMARKS_FOLDER = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(BENCHMARKS_FOLDER))
+
+from generate_tcx import generate_tcx
+
+
+DATA_FOLDER = os.path.join(BENCHMARKS_FOLDER, "data")
+RESULTS_FOLDER = os.path.join(BENCHMARKS_FOLDER, "results")
+SIZES = {"1k": 1000, "10k": 10000, "100k": 100000, "1M": 1000000}
+LAPS = 10
+# modules a plain "import garmin" must not load, see the import benchmark
+HEAVY_MODULES = ("pandas", "matplotlib", "tkinter", "garminconnect", "requests", "dateutil")
+
+
+# Each benchmark is setup(path) -> state and run(state), only run is timed
+
+def _activity(path):
+    import tcx_parser
+    activity = tcx_parser.Activity(path)
+    activity.track
+    return activity.totals
+
+
+def _read_track_columns(path):
+    import tcx_parser
+    return tcx_parser.read_track(path, columns=("time", "heartrate"))
+
+
+def _get_all_data_points(path):
+    import tcx_parser
+    return tcx_parser.get_all_data_points(path)
+
+
+def _search_setup(path):
+    import tcx_parser
+    times = tcx_parser.create_list_of_point_times(tcx_parser.get_all_data_points(path))
+    return times, times[len(times) // 3]
+
+
+def _search_closest_time(state):
+    import tcx_parser
+    times, target = state
+    return tcx_parser.search_closest_time(times, target)
+
+
+def _export(fmt):
+    def run(path):
+        import export
+        with tempfile.TemporaryDirectory() as folder:
+            return export.export_activities([path], os.path.join(folder, f"export.{fmt}"), fmt)
+    return run
+
+
+def _graph_map_setup(path):
+    import matplotlib
+    matplotlib.use("Agg")
+    import tcx_parser
+    activity = tcx_parser.Activity(path)
+    activity.track
+    return activity
+
+
+def _graph_map(activity):
+    import matplotlib.pyplot as plt
+    fig = activity.graph_map(show=False)
+    fig.canvas.draw()
+    plt.close(fig)
+
+
+BENCHMARKS = {
+    "activity": (None, _activity),
+    "read_track_columns": (None, _read_track_columns),
+    "get_all_data_points": (None, _get_all_data_points),
+    "search_closest_time": (_search_setup, _search_closest_time),
+    "export_csv": (None, _export("csv")),
+    "export_parquet": (None, _export("parquet")),
+    "graph_map": (_graph_map_setup, _graph_map),
+}
+
+
+def run_case(name, path, repeat):
+    """Run one benchmark in this process, returns its timings and memory use"""
+    setup, run = BENCHMARKS[name]
+    state = setup(path) if setup else path
+
+    # the first run is traced for its peak allocation, tracing is too slow to time it as well
+    tracemalloc.start()
+    run(state)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        run(state)
+        times.append(time.perf_counter() - start)
+
+    return {"times": times, "peak_traced_bytes": peak, "max_rss_bytes": _max_rss()}
+
+
+def _max_rss():
+    try:
+        import resource
+    except ImportError:
+        return None
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes on Linux, bytes on macOS
+    return rss if sys.platform == "darwin" else rss * 1024
+
+
+def measure_import():
+    """Time a cold "import garmin" and list the heavy modules it pulled in"""
+    code = ("import sys, time, json\n"
+            "start = time.perf_counter()\n"
+            "import garmin\n"
+            "seconds = time.perf_counter() - start\n"
+            f"heavy = [m for m in {HEAVY_MODULES!r} if m in sys.modules]\n"
+            "print(json.dumps({'seconds': seconds, 'heavy_modules': heavy}))\n")
+    timings = []
+    for _ in range(3):
+        out = subprocess.run([sys.executable, "-c", code], cwd=os.path.dirname(BENCHMARKS_FOLDER),
+                             capture_output=True, text=True, check=True)
+        timings.append(json.loads(out.stdout.strip().splitlines()[-1]))
+    return {"seconds": min(t["seconds"] for t in timings), "heavy_modules": timings[0]["heavy_modules"]}
+
+
+def synthetic_file(points):
+    """The generated file with the given number of points, written on first use"""
+    os.makedirs(DATA_FOLDER, exist_ok=True)
+    path = os.path.join(DATA_FOLDER, f"synthetic_{points}.tcx")
+    if not os.path.isfile(path):
+        print(f"Generating {path}")
+        generate_tcx(path + ".part", laps=LAPS, points_per_lap=max(1, points // LAPS))
+        os.replace(path + ".part", path)
+    return path
+
+
+def run_suite(sizes, names, repeat, timeout):
+    results = []
+    for size in sizes:
+        points = SIZES[size]
+        path = synthetic_file(points)
+        for name in names:
+            entry = {"benchmark": name, "size": size, "points": points}
+            try:
+                out = subprocess.run([sys.executable, os.path.abspath(__file__), "--case", name, "--path", path,
+                                      "--repeat", str(repeat)], capture_output=True, text=True, timeout=timeout)
+            except subprocess.TimeoutExpired:
+                entry["error"] = f"timed out after {timeout}s"
+            else:
+                if out.returncode == 0:
+                    case = json.loads(out.stdout.strip().splitlines()[-1])
+                    entry.update(min=min(case["times"]), median=statistics.median(case["times"]),
+                                 peak_traced_bytes=case["peak_traced_bytes"], max_rss_bytes=case["max_rss_bytes"])
+                else:
+                    entry["error"] = (out.stderr.strip().splitlines() or ["failed"])[-1]
+            results.append(entry)
+            print(format_result(entry))
+    return results
+
+
+def format_result(entry):
+    label = f"{entry['benchmark']:>20} {entry['size']:>5}"
+    if "error" in entry:
+        return f"{label}: {entry['error']}"
+    return (f"{label}: {entry['min'] * 1000:10.1f} ms min, {entry['median'] * 1000:10.1f} ms median, "
+            f"{entry['peak_traced_bytes'] / 2**20:8.1f} MB peak")
+
+
+def compare(results, baseline, threshold):
+    """Print each benchmark against the baseline, returns the ones slower by more than threshold"""
+    old = {(r["benchmark"], r["size"]): r for r in baseline["results"] if "error" not in r}
+    regressions = []
+    for entry in results:
+        before = old.get((entry["benchmark"], entry["size"]))
+        if before is None or "error" in entry:
+            continue
+        ratio = entry["min"] / before["min"]
+        flag = ""
+        if ratio > threshold:
+            flag = "  REGRESSION"
+            regressions.append(entry)
+        print(f"{entry['benchmark']:>20} {entry['size']:>5}: {ratio:5.2f}x time, "
+              f"{entry['peak_traced_bytes'] / max(1, before['peak_traced_bytes']):5.2f}x memory{flag}")
+    return regressions
+
+
+def _git_commit():
+    try:
+        out = subprocess.run(["git", "rev-parse", "HEAD"], cwd=BENCHMARKS_FOLDER, capture_output=True, text=True)
+    except OSError:
+        return None
+    return out.stdout.strip() or None
+
+
+def get_args():
+    parser = argparse.ArgumentParser(description="Benchmark tcx-utilities on synthetic TCX files")
+    parser.add_argument('--sizes', dest="sizes", action='store', default=",".join(SIZES), required=False)
+    parser.add_argument('--benchmarks', dest="benchmarks", action='store', default=",".join(BENCHMARKS), required=False)
+    parser.add_argument('--repeat', dest="repeat", action='store', type=int, default=3, required=False)
+    parser.add_argument('--timeout', dest="timeout", action='store', type=int, default=1800, required=False)
+    parser.add_argument('--output', dest="output", action='store', default=None, required=False)
+    parser.add_argument('--compare', dest="compare", action='store', default=None, required=False)
+    parser.add_argument('--threshold', dest="threshold", action='store', type=float, default=1.2, required=False)
+    # used internally to run a single benchmark in a child process
+    parser.add_argument('--case', dest="case", action='store', default=None, required=False)
+    parser.add_argument('--path', dest="path", action='store', default=None, required=False)
+    return parser.parse_args()
+
+
+def main():
+    args = get_args()
+
+    if args.case:
+        print(json.dumps(run_case(args.case, args.path, args.repeat)))
+        return 0
+
+    sizes = args.sizes.split(",")
+    names = args.benchmarks.split(",")
+    for name in names:
+        if name not in BENCHMARKS:
+            raise SystemExit(f"Unknown benchmark '{name}', expected one of {list(BENCHMARKS)}")
+    for size in sizes:
+        if size not in SIZES:
+            raise SystemExit(f"Unknown size '{size}', expected one of {list(SIZES)}")
+
+    import_time = measure_import()
+    print(f"{'import garmin':>26}: {import_time['seconds'] * 1000:10.1f} ms")
+    if import_time["heavy_modules"]:
+        print(f"import garmin loaded {', '.join(import_time['heavy_modules'])}")
+
+    report = {
+        "meta": {
+            "date": datetime.datetime.now().isoformat(timespec="seconds"),
+            "commit": _git_commit(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "repeat": args.repeat,
+        },
+        "import": import_time,
+        "results": run_suite(sizes, names, args.repeat, args.timeout),
+    }
+
+    output = args.output or os.path.join(RESULTS_FOLDER, datetime.datetime.now().strftime("%Y%m%d-%H%M%S.json"))
+    if os.path.dirname(output):
+        os.makedirs(os.path.dirname(output), exist_ok=True)
+    with open(output, "w") as f:
+        json.dump(report, f, indent=1)
+    print(f"Results written to {output}")
+
+    failed = bool(import_time["heavy_modules"])
+    if args.compare:
+        with open(args.compare) as f:
+            failed |= bool(compare(report["results"], json.load(f), args.threshold))
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,203 @@
+import json
+import os
+from dataclasses import dataclass, asdict
+
+import numpy as np
+
+import ingest
+from cache import file_fingerprint
+from downloader import write_atomic
+
+
+DISTANCES = (1000, 5000, 10000, 21097.5, 42195)
+DURATIONS = (60, 300, 600, 1200, 3600)
+RECORDS_PATH = os.path.join(ingest.ACTIVITIES_FOLDER, "records.json")
+# the only Track columns the efforts need, nothing else is parsed
+COLUMNS = ('time', 'distance')
+
+
+@dataclass
+class Effort:
+    target: float
+    distance: float
+    duration: float
+    start_time: str
+    start_index: int
+    end_index: int
+    path: str = None
+
+
+def _clean_columns(track):
+    """Times in seconds and a non-decreasing distance for the points that have a distance"""
+    has_distance = ~np.isnan(track.distance)
+    times = track.time_ns()[has_distance]
+    seconds = (times - times[0]) / 1e9 if len(times) else times.astype('float64')
+    distance = np.maximum.accumulate(track.distance[has_distance]) if has_distance.any() else track.distance[:0]
+    indices = np.flatnonzero(has_distance)
+    return times, seconds, distance, indices
+
+
+def _effort(target, times, seconds, distance, indices, start, end):
+    return Effort(target=target,
+                  distance=float(distance[end] - distance[start]),
+                  duration=float(seconds[end] - seconds[start]),
+                  start_time=str(times[start].astype('datetime64[ns]').astype('datetime64[s]')) + "Z",
+                  start_index=int(indices[start]),
+                  end_index=int(indices[end]))
+
+
+def _shortest_window(seconds, distance, target):
+    """
+    Two-pointer sweep for the quickest stretch covering target metres
+    The end pointer only ever moves forward, so each target costs one pass over the track
+    Returns (start, end) or None when the track is shorter than target
+    """
+    best = None
+    best_duration = None
+    end = 0
+    count = len(distance)
+    for start in range(count):
+        goal = distance[start] + target
+        while end < count and distance[end] < goal:
+            end += 1
+        if end == count:
+            break
+        duration = seconds[end] - seconds[start]
+        if best_duration is None or duration < best_duration:
+            best, best_duration = (start, end), duration
+    return best
+
+
+def best_distance_efforts(track, distances=DISTANCES):
+    """
+    Fastest time over each target distance in metres
+    Returns {distance: Effort}, targets longer than the activity are left out
+    """
+    times, seconds, distance, indices = _clean_columns(track)
+    seconds_list, distance_list = seconds.tolist(), distance.tolist()
+    efforts = {}
+    for target in distances:
+        window = _shortest_window(seconds_list, distance_list, target)
+        if window is not None:
+            efforts[target] = _effort(target, times, seconds, distance, indices, *window)
+    return efforts
+
+
+def _longest_window(seconds, distance, target):
+    """
+    Two-pointer sweep for the most distance covered within target seconds
+    The end pointer is the last point inside the window and only ever moves forward
+    """
+    best = None
+    best_covered = None
+    end = 0
+    count = len(seconds)
+    for start in range(count):
+        limit = seconds[start] + target
+        while end + 1 < count and seconds[end + 1] <= limit:
+            end += 1
+        covered = distance[end] - distance[start]
+        if best_covered is None or covered > best_covered:
+            best, best_covered = (start, end), covered
+    return best
+
+
+def best_duration_efforts(track, durations=DURATIONS):
+    """
+    Longest distance covered within each target duration in seconds
+    Returns {duration: Effort}, targets longer than the activity are left out
+    """
+    times, seconds, distance, indices = _clean_columns(track)
+    if len(seconds) == 0:
+        return {}
+    seconds_list, distance_list = seconds.tolist(), distance.tolist()
+    efforts = {}
+    for target in durations:
+        if seconds[-1] < target:
+            continue
+        window = _longest_window(seconds_list, distance_list, target)
+        efforts[target] = _effort(target, times, seconds, distance, indices, *window)
+    return efforts
+
+
+class RecordBook():
+    """
+    Personal records over the whole archive, kept in activities/records.json
+    Every file's fingerprint is remembered so update only looks at new or changed files
+    """
+
+    def __init__(self, path=RECORDS_PATH, distances=DISTANCES, durations=DURATIONS):
+        self.path = path
+        self.distances = distances
+        self.durations = durations
+        self.processed = {}
+        self.distance_records = {}
+        self.duration_records = {}
+        if os.path.isfile(path):
+            with open(path) as f:
+                data = json.load(f)
+            self.processed = data.get("processed", {})
+            self.distance_records = {float(k): Effort(**v) for k, v in data.get("distance", {}).items()}
+            self.duration_records = {float(k): Effort(**v) for k, v in data.get("duration", {}).items()}
+
+    def is_current(self, path):
+        return self.processed.get(path) == list(file_fingerprint(path))
+
+    def add(self, path, track):
+        """Check one activity against the records, returns the records it set"""
+        improved = []
+        for target, effort in best_distance_efforts(track, self.distances).items():
+            record = self.distance_records.get(float(target))
+            if record is None or effort.duration < record.duration:
+                effort.path = path
+                self.distance_records[float(target)] = effort
+                improved.append(effort)
+        for target, effort in best_duration_efforts(track, self.durations).items():
+            record = self.duration_records.get(float(target))
+            if record is None or effort.distance > record.distance:
+                effort.path = path
+                self.duration_records[float(target)] = effort
+                improved.append(effort)
+        self.processed[path] = list(file_fingerprint(path))
+        return improved
+
+    def rename(self, old_path, new_path):
+        """Move what was found in old_path to new_path, e.g. after the file was compressed"""
+        if self.processed.pop(old_path, None) is not None:
+            self.processed[new_path] = list(file_fingerprint(new_path))
+        for record in list(self.distance_records.values()) + list(self.duration_records.values()):
+            if record.path == old_path:
+                record.path = new_path
+
+    def update(self, paths, cache=None, workers=None):
+        """
+        Check every new or changed file in paths against the records and save the book
+        Records held by a file that was deleted or changed since it was checked are
+        dropped, and as runners-up are not kept every remaining file is checked again
+        Returns the records that were set
+        """
+        stale = {path for path in self.processed
+                 if not os.path.isfile(path) or not self.is_current(path)}
+        records = list(self.distance_records.values()) + list(self.duration_records.values())
+        if any(record.path in stale for record in records):
+            remaining = [path for path in self.processed if path not in stale]
+            paths = list(dict.fromkeys(list(paths) + remaining))
+            self.processed = {}
+            self.distance_records = {}
+            self.duration_records = {}
+        else:
+            for path in stale:
+                del self.processed[path]
+        pending = [path for path in paths if not self.is_current(path)]
+        improved = []
+        for result in ingest.iter_archive(pending, workers=workers, cache=cache, columns=COLUMNS):
+            if not result.error:
+                improved += self.add(result.path, result.track)
+        self.save()
+        return improved
+
+    def save(self):
+        data = {"processed": self.processed,
+                "distance": {str(k): asdict(v) for k, v in sorted(self.distance_records.items())},
+                "duration": {str(k): asdict(v) for k, v in sorted(self.duration_records.items())}}
+        write_atomic(self.path, json.dumps(data, indent=1).encode("utf-8"))
@@ -0,0 +1,165 @@
+import hashlib
+import math
+import os
+import tempfile
+from dataclasses import fields
+
+import numpy as np
+
+import profiling
+from track import Track
+
+
+CACHE_FOLDER = ".tcx_cache"
+MAX_CACHE_BYTES = 1024 * 1024 * 1024
+
+
+def file_fingerprint(path):
+    """(size, mtime in ns) of a file, any change to the file changes this"""
+    stat = os.stat(path)
+    return stat.st_size, stat.st_mtime_ns
+
+
+class ActivityCache():
+    """
+    On disk cache of parsed Tracks stored as uncompressed .npz sidecars
+    Entries are keyed by the absolute path of the TCX file and hold the file's
+    size and mtime, so they are invalidated as soon as the TCX changes
+    Once the cache grows over max_bytes the least recently used entries are removed
+    The size of the folder is only scanned once, after that put() keeps a running total
+    and only evicts when it goes over budget
+    """
+
+    def __init__(self, folder=CACHE_FOLDER, max_bytes=MAX_CACHE_BYTES, evict_on_put=True):
+        self.folder = folder
+        self.max_bytes = max_bytes
+        self.evict_on_put = evict_on_put
+        self.total_bytes = None
+
+    def deferred(self):
+        """
+        The same cache for worker processes: entries are added but never evicted, the
+        parent calls evict() once the batch is done so workers don't delete each
+        other's entries
+        """
+        return ActivityCache(self.folder, self.max_bytes, evict_on_put=False)
+
+    def entry_path(self, path):
+        key = hashlib.sha1(os.path.abspath(path).encode("utf-8")).hexdigest()
+        return os.path.join(self.folder, f"{key}.npz")
+
+    def get(self, path, columns=None):
+        """
+        Returns the cached Track for path or None if it is missing or stale
+        With columns only those arrays (and lap) are read from the entry, if the entry
+        doesn't have them all the whole Track is returned so the caller can tell
+        """
+        entry = self.entry_path(path)
+        try:
+            with profiling.span("cache_load", file=path), np.load(entry) as data:
+                if tuple(data["fingerprint"].tolist()) != file_fingerprint(path):
+                    os.remove(entry)
+                    profiling.count("cache_misses")
+                    return None
+                track = _track_from_arrays(data, columns)
+        except (OSError, KeyError, ValueError):
+            profiling.count("cache_misses")
+            return None
+        profiling.count("cache_hits")
+
+        # mark as recently used for the LRU eviction
+        os.utime(entry)
+        return track
+
+    def put(self, path, track):
+        os.makedirs(self.folder, exist_ok=True)
+        arrays = _track_to_arrays(track)
+        arrays["fingerprint"] = np.array(file_fingerprint(path), dtype="int64")
+
+        # write to a temporary file first so readers never see half an entry
+        entry = self.entry_path(path)
+        fd, tmp_path = tempfile.mkstemp(dir=self.folder, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as fb:
+                np.savez(fb, **arrays)
+            size = os.path.getsize(tmp_path)
+            replaced = _size(entry)
+            os.replace(tmp_path, entry)
+        except BaseException:
+            os.remove(tmp_path)
+            raise
+
+        if not self.evict_on_put:
+            return
+        if self.total_bytes is None:
+            self.evict()
+        else:
+            self.total_bytes += size - replaced
+            if self.total_bytes > self.max_bytes:
+                self.evict()
+
+    def evict(self):
+        """Remove the least recently used entries until the cache fits in max_bytes"""
+        entries = []
+        if os.path.isdir(self.folder):
+            with os.scandir(self.folder) as it:
+                for entry in it:
+                    if entry.name.endswith(".npz"):
+                        try:
+                            stat = entry.stat()
+                        except FileNotFoundError:
+                            # removed by another process since the scan
+                            continue
+                        entries.append((stat.st_mtime_ns, stat.st_size, entry.path))
+
+        total = sum(size for _, size, _ in entries)
+        for _, size, entry_path in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(entry_path)
+            except FileNotFoundError:
+                pass
+            total -= size
+        self.total_bytes = total
+
+    def clear(self):
+        if os.path.isdir(self.folder):
+            for name in os.listdir(self.folder):
+                if name.endswith(".npz"):
+                    os.remove(os.path.join(self.folder, name))
+        self.total_bytes = 0
+
+
+def _size(path):
+    try:
+        return os.path.getsize(path)
+    except FileNotFoundError:
+        return 0
+
+
+def _track_to_arrays(track):
+    from tcx_parser import LapStats
+    arrays = {f"point_{name}": track[name] for name in track.column_names}
+    for field in fields(LapStats):
+        arrays[f"lap_{field.name}"] = np.array([getattr(lap, field.name) for lap in track.laps])
+    return arrays
+
+
+def _lap_value(value, kind):
+    """An int lap column with a missing (NaN) heart rate is stored as floats, the others go back to ints"""
+    if kind is int and isinstance(value, float) and not math.isnan(value):
+        return int(value)
+    return value
+
+
+def _track_from_arrays(data, names=None):
+    from tcx_parser import LapStats
+    stored = [name[len("point_"):] for name in data.files if name.startswith("point_")]
+    if names is not None and all(name in stored for name in names):
+        stored = [name for name in stored if name in names or name == "lap"]
+    columns = {name: data[f"point_{name}"] for name in stored}
+    lap_columns = {field.name: [_lap_value(value, field.type) for value in data[f"lap_{field.name}"].tolist()]
+                   for field in fields(LapStats)}
+    laps = [LapStats(**dict(zip(lap_columns, values))) for values in zip(*lap_columns.values())]
+    return Track(columns, laps)
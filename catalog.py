@@ -0,0 +1,251 @@
+import datetime
+import os
+import sqlite3
+import threading
+from concurrent.futures import ProcessPoolExecutor
+
+import tcx_parser
+from ingest import ACTIVITIES_FOLDER, find_activity_files, parse_activity_path
+
+
+CATALOG_PATH = os.path.join(ACTIVITIES_FOLDER, "catalog.db")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS activities (
+    id INTEGER PRIMARY KEY,
+    date TEXT NOT NULL,
+    start_time TEXT,
+    sport TEXT,
+    distance REAL,
+    duration REAL,
+    calories INTEGER,
+    average_heartrate REAL,
+    max_heartrate INTEGER,
+    max_speed REAL,
+    path TEXT NOT NULL UNIQUE,
+    size INTEGER,
+    mtime_ns INTEGER
+);
+CREATE INDEX IF NOT EXISTS activities_date ON activities (date);
+"""
+
+
+class ActivityCatalog():
+    """
+    SQLite catalog with one row per downloaded activity
+    date is the local date from the activities/<year>/<month>/<day>-<id>.tcx layout
+    and is indexed so date range lookups never have to walk the folders
+    The connection can be shared between threads, every call holds a lock
+    """
+
+    def __init__(self, path=CATALOG_PATH):
+        self.path = path
+        folder = os.path.dirname(path)
+        if folder:
+            os.makedirs(folder, exist_ok=True)
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        self.lock = threading.RLock()
+        self.connection.row_factory = sqlite3.Row
+        self.connection.executescript(SCHEMA)
+
+    def close(self):
+        with self.lock:
+            self.connection.close()
+
+    def __len__(self):
+        with self.lock:
+            return self.connection.execute("SELECT COUNT(*) FROM activities").fetchone()[0]
+
+    def add_file(self, path, summary=None):
+        """Add or update the row for a TCX file, the file is summarized unless a summary is given"""
+        if summary is None:
+            summary = tcx_parser.read_summary(path)
+        with self.lock, self.connection:
+            self._upsert(path, summary)
+
+    def _upsert(self, path, summary):
+        date, activity_id = parse_activity_path(path)
+        if date is None:
+            if summary.start_time is None:
+                raise ValueError(f"Can't work out the date of {path}")
+            date = summary.start_time.date()
+
+        totals = summary.totals
+        stat = os.stat(path)
+        # the path is the key, so a file that moved or lost its id is replaced
+        self.connection.execute("DELETE FROM activities WHERE path = ? OR id = ?", (path, activity_id))
+        self.connection.execute(
+            "INSERT INTO activities (id, date, start_time, sport, distance, duration, calories,"
+            " average_heartrate, max_heartrate, max_speed, path, size, mtime_ns)"
+            " VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            (activity_id, date.isoformat(),
+             summary.start_time.isoformat() if summary.start_time else None,
+             summary.sport,
+             totals.distance if totals else None,
+             totals.total_time if totals else None,
+             totals.calories if totals else None,
+             totals.average_heartrate if totals else None,
+             totals.max_heartrate if totals else None,
+             totals.max_speed if totals else None,
+             path, stat.st_size, stat.st_mtime_ns))
+
+    def rename(self, old_path, new_path):
+        """Move a row to a new path without summarizing the file again, e.g. after it was compressed"""
+        stat = os.stat(new_path)
+        with self.lock, self.connection:
+            self.connection.execute("UPDATE activities SET path = ?, size = ?, mtime_ns = ? WHERE path = ?",
+                                    (new_path, stat.st_size, stat.st_mtime_ns, old_path))
+
+    def remove(self, path):
+        with self.lock, self.connection:
+            self.connection.execute("DELETE FROM activities WHERE path = ?", (path,))
+
+    def find(self, start_date, end_date):
+        """Returns the rows of every activity from start_date to end_date inclusive"""
+        with self.lock:
+            return self.connection.execute(
+                "SELECT * FROM activities WHERE date BETWEEN ? AND ? ORDER BY date, start_time",
+                (start_date.isoformat(), end_date.isoformat())).fetchall()
+
+    def get(self, activity_id):
+        with self.lock:
+            return self.connection.execute("SELECT * FROM activities WHERE id = ?", (activity_id,)).fetchone()
+
+    def rescan(self, folder=ACTIVITIES_FOLDER, workers=None, progress=None):
+        """
+        Bring the catalog in line with the files under folder
+        Only new or changed files are summarized, rows of deleted files are removed
+        Returns the number of files that were (re)added
+        """
+        with self.lock:
+            return self._rescan(folder, workers, progress)
+
+    def _rescan(self, folder, workers, progress):
+        known = {row["path"]: (row["size"], row["mtime_ns"])
+                 for row in self.connection.execute("SELECT path, size, mtime_ns FROM activities")}
+        paths = find_activity_files(folder)
+
+        changed = []
+        for path in paths:
+            stat = os.stat(path)
+            if known.get(path) != (stat.st_size, stat.st_mtime_ns):
+                changed.append(path)
+
+        with self.connection:
+            for path in set(known) - set(paths):
+                self.connection.execute("DELETE FROM activities WHERE path = ?", (path,))
+
+        added = 0
+        with self.connection:
+            summaries = _summarize(changed, workers)
+            for done, (path, summary) in enumerate(zip(changed, summaries), start=1):
+                error = summary if isinstance(summary, Exception) else None
+                if error is None:
+                    try:
+                        self._upsert(path, summary)
+                        added += 1
+                    except (OSError, ValueError) as err:
+                        error = err
+                if progress:
+                    progress(done, len(changed), path, error)
+        return added
+
+
+class DateRangeCache():
+    """
+    In-memory cache of catalog rows for the date ranges already looked up
+    A range that overlaps ones seen before only queries the days that are missing,
+    invalidate drops single days (e.g. when a download lands) or everything
+    """
+
+    def __init__(self, catalog):
+        self.catalog = catalog
+        self.lock = threading.Lock()
+        self.rows = {}
+        # sorted, non-overlapping (start, end) date ranges that are in rows
+        self.covered = []
+
+    def missing(self, start_date, end_date):
+        """The parts of start_date..end_date that aren't cached yet as (start, end) ranges"""
+        gaps = []
+        day = start_date
+        with self.lock:
+            for start, end in self.covered:
+                if end < day:
+                    continue
+                if start > end_date:
+                    break
+                if start > day:
+                    gaps.append((day, start - datetime.timedelta(days=1)))
+                day = max(day, end + datetime.timedelta(days=1))
+        if day <= end_date:
+            gaps.append((day, end_date))
+        return gaps
+
+    def is_cached(self, start_date, end_date):
+        return not self.missing(start_date, end_date)
+
+    def find(self, start_date, end_date):
+        """Same rows as ActivityCatalog.find, only the missing days go to the database"""
+        for start, end in self.missing(start_date, end_date):
+            rows = self.catalog.find(start, end)
+            with self.lock:
+                for row in rows:
+                    self.rows.setdefault(datetime.date.fromisoformat(row["date"]), []).append(row)
+                self._cover(start, end)
+
+        with self.lock:
+            found = []
+            day = start_date
+            while day <= end_date:
+                found += self.rows.get(day, [])
+                day += datetime.timedelta(days=1)
+            return found
+
+    def _cover(self, start, end):
+        ranges = sorted(self.covered + [(start, end)])
+        merged = [ranges[0]]
+        for start, end in ranges[1:]:
+            if start <= merged[-1][1] + datetime.timedelta(days=1):
+                merged[-1] = (merged[-1][0], max(merged[-1][1], end))
+            else:
+                merged.append((start, end))
+        self.covered = merged
+
+    def invalidate(self, date=None):
+        """Forget one day, or everything when date is None"""
+        with self.lock:
+            if date is None:
+                self.rows = {}
+                self.covered = []
+                return
+            self.rows.pop(date, None)
+            covered = []
+            for start, end in self.covered:
+                if start <= date <= end:
+                    if start < date:
+                        covered.append((start, date - datetime.timedelta(days=1)))
+                    if date < end:
+                        covered.append((date + datetime.timedelta(days=1), end))
+                else:
+                    covered.append((start, end))
+            self.covered = covered
+
+
+def _summarize(paths, workers=None):
+    """Summarize files across a pool of processes, yielding a summary or the error per path"""
+    workers = workers or os.cpu_count() or 1
+    if workers == 1 or len(paths) < 2:
+        yield from map(_safe_read_summary, paths)
+        return
+
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        yield from executor.map(_safe_read_summary, paths, chunksize=max(1, len(paths) // (workers * 8)))
+
+
+def _safe_read_summary(path):
+    try:
+        return tcx_parser.read_summary(path)
+    except Exception as err:
+        return err
+
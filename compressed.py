@@ -0,0 +1,147 @@
+import gzip
+import os
+import shutil
+import tempfile
+from contextlib import contextmanager
+
+
+TCX_SUFFIXES = (".tcx", ".tcx.gz", ".tcx.zst")
+COMPRESSIONS = ("gz", "zst")
+
+GZIP_MAGIC = b"\x1f\x8b"
+ZSTD_MAGIC = b"\x28\xb5\x2f\xfd"
+
+
+def _zstandard():
+    try:
+        import zstandard
+    except ImportError:
+        raise ImportError("Reading or writing .tcx.zst files needs the zstandard package (pip install zstandard)")
+    return zstandard
+
+
+def is_tcx_file(path):
+    return path.lower().endswith(TCX_SUFFIXES)
+
+
+def tcx_variants(path):
+    """Every name a TCX file can be stored under: plain, gzip and zstd"""
+    base = strip_compression(path)
+    return [base] + [f"{base}.{compression}" for compression in COMPRESSIONS]
+
+
+def strip_compression(path):
+    for compression in COMPRESSIONS:
+        if path.lower().endswith(f".{compression}"):
+            return path[:-len(compression) - 1]
+    return path
+
+
+def find_existing(path):
+    """Returns the stored file for path, compressed or not, or None"""
+    for variant in tcx_variants(path):
+        if os.path.isfile(variant):
+            return variant
+    return None
+
+
+def open_tcx(fname):
+    """
+    Open a TCX file for reading as bytes, transparently decompressing .gz and .zst
+    The format is detected from the first bytes rather than the extension
+    Open file objects are returned unchanged
+    """
+    if not isinstance(fname, (str, bytes, os.PathLike)):
+        return fname
+
+    fb = open(fname, "rb")
+    try:
+        magic = fb.read(4)
+        fb.seek(0)
+        if magic.startswith(GZIP_MAGIC):
+            # GzipFile(fileobj=fb) would leave fb open when it is closed
+            fb.close()
+            return gzip.open(fname, "rb")
+        if magic == ZSTD_MAGIC:
+            return _zstandard().ZstdDecompressor().stream_reader(fb, closefd=True)
+        return fb
+    except BaseException:
+        fb.close()
+        raise
+
+
+@contextmanager
+def write_tcx(path):
+    """
+    Open path for writing a TCX file as bytes, compressed when it ends in .gz or .zst
+    Everything goes to a temporary file first that only replaces path once it is complete
+    """
+    compression = next((c for c in COMPRESSIONS if path.lower().endswith(f".{c}")), None)
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path) or ".", suffix=".part")
+    try:
+        with os.fdopen(fd, "wb") as fb:
+            if compression == "gz":
+                with gzip.GzipFile(fileobj=fb, mode="wb") as writer:
+                    yield writer
+            elif compression == "zst":
+                with _zstandard().ZstdCompressor(level=10).stream_writer(fb, closefd=False) as writer:
+                    yield writer
+            else:
+                yield fb
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.remove(tmp_path)
+        raise
+
+
+def compress_bytes(data, compression):
+    if compression is None:
+        return data
+    if compression == "gz":
+        return gzip.compress(data)
+    if compression == "zst":
+        return _zstandard().ZstdCompressor(level=10).compress(data)
+    raise ValueError(f"Unknown compression '{compression}', expected one of {COMPRESSIONS}")
+
+
+def compress_file(path, compression):
+    """
+    Compress a plain .tcx file next to itself and remove the original
+    The data is streamed so the file never has to fit in memory
+    Returns the path of the compressed file
+    """
+    if compression not in COMPRESSIONS:
+        raise ValueError(f"Unknown compression '{compression}', expected one of {COMPRESSIONS}")
+
+    new_path = f"{path}.{compression}"
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path) or ".", suffix=".part")
+    try:
+        with open(path, "rb") as src, os.fdopen(fd, "wb") as dst:
+            if compression == "gz":
+                with gzip.GzipFile(fileobj=dst, mode="wb") as writer:
+                    shutil.copyfileobj(src, writer, 1024 * 1024)
+            else:
+                with _zstandard().ZstdCompressor(level=10).stream_writer(dst, closefd=False) as writer:
+                    shutil.copyfileobj(src, writer, 1024 * 1024)
+        shutil.copystat(path, tmp_path)
+        os.replace(tmp_path, new_path)
+    except BaseException:
+        os.remove(tmp_path)
+        raise
+    os.remove(path)
+    return new_path
+
+
+def compress_archive(paths, compression, progress=None):
+    """
+    Compress every plain TCX file in paths in place
+    Returns a list of (old path, new path), progress(done, total, old, new) is called per file
+    """
+    paths = [path for path in paths if path.lower().endswith(".tcx")]
+    moved = []
+    for done, path in enumerate(paths, start=1):
+        new_path = compress_file(path, compression)
+        moved.append((path, new_path))
+        if progress:
+            progress(done, len(paths), path, new_path)
+    return moved
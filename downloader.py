@@ -0,0 +1,202 @@
+import hashlib
+import logging
+import os
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from dataclasses import dataclass
+
+import profiling
+from compressed import compress_bytes, find_existing
+from ingest import ACTIVITIES_FOLDER, MONTHS
+
+
+logger = logging.getLogger(__name__)
+
+def default_retry_errors():
+    """
+    Errors that are worth waiting out and trying again
+    garminconnect is imported here rather than at the top so the archive tools load without it
+    """
+    from garminconnect import GarminConnectConnectionError, GarminConnectTooManyRequestsError
+    return (GarminConnectTooManyRequestsError, GarminConnectConnectionError)
+
+
+@dataclass
+class DownloadResult:
+    activity_id: int
+    path: str
+    downloaded: bool = False
+    error: str = None
+    attempts: int = 0
+    sha256: str = None
+
+
+def get_month_name(month_num):
+    return MONTHS[int(month_num)]
+
+
+def activity_path(activity, folder=ACTIVITIES_FOLDER, compression=None):
+    """
+    Returns where an activity from get_activities_by_date is stored: <folder>/<year>/<month>/<day>-<id>.tcx
+    with a .gz or .zst suffix when it is stored compressed
+    """
+    year, month, day = activity['startTimeLocal'].split(" ")[0].split("-")
+    path = os.path.join(folder, year, get_month_name(month), f"{day}-{activity['activityId']}.tcx")
+    return f"{path}.{compression}" if compression else path
+
+
+def write_atomic(path, data):
+    """Write data to path so that the file is either complete or not there at all"""
+    folder = os.path.dirname(path)
+    os.makedirs(folder, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=folder, suffix=".part")
+    try:
+        with os.fdopen(fd, "wb") as fb:
+            fb.write(data)
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.remove(tmp_path)
+        raise
+
+
+class Backoff():
+    """
+    Pause shared by all download workers
+    Every rate limit or connection error doubles the pause, every success shrinks it again
+    """
+
+    def __init__(self, initial=1.0, maximum=60.0):
+        self.initial = initial
+        self.maximum = maximum
+        self.delay = 0.0
+        self.resume_at = 0.0
+        self.lock = threading.Lock()
+
+    def wait(self):
+        while True:
+            with self.lock:
+                remaining = self.resume_at - time.monotonic()
+            if remaining <= 0:
+                return
+            time.sleep(remaining)
+
+    def failure(self):
+        with self.lock:
+            self.delay = min(self.maximum, max(self.initial, self.delay * 2))
+            self.resume_at = max(self.resume_at, time.monotonic() + self.delay)
+            return self.delay
+
+    def success(self):
+        with self.lock:
+            self.delay = self.delay / 2 if self.delay > self.initial else 0.0
+
+
+class DownloadEngine():
+    """
+    Downloads activities as TCX with a bounded pool of worker threads
+    The api only needs get_activities_by_date, download_activity and
+    ActivityDownloadFormat, so tests can pass a local fake in place of Garmin
+    """
+
+    def __init__(self, api, folder=ACTIVITIES_FOLDER, workers=4, retries=3, overwrite=False,
+                 backoff=None, retry_errors=None, compression=None):
+        self.api = api
+        self.compression = compression
+        self.folder = folder
+        self.workers = workers
+        self.retries = retries
+        self.overwrite = overwrite
+        self.backoff = backoff or Backoff()
+        self.retry_errors = retry_errors if retry_errors is not None else default_retry_errors()
+
+    def download_one(self, activity):
+        path = activity_path(activity, self.folder, self.compression)
+        result = DownloadResult(activity_id=activity['activityId'], path=path)
+        existing = find_existing(path)
+        if not self.overwrite and existing:
+            result.path = existing
+            return result
+
+        while True:
+            self.backoff.wait()
+            result.attempts += 1
+            try:
+                with profiling.span("download_activity", activity_id=result.activity_id, attempt=result.attempts):
+                    data = self.api.download_activity(result.activity_id, dl_fmt=self.api.ActivityDownloadFormat.TCX)
+            except self.retry_errors as err:
+                profiling.count("download_retries")
+                if result.attempts > self.retries:
+                    result.error = f"{type(err).__name__}: {err}"
+                    return result
+                delay = self.backoff.failure()
+                logger.warning(f"Download of {result.activity_id} failed ({err}), retrying in {delay:.1f}s")
+                continue
+            except Exception as err:
+                result.error = f"{type(err).__name__}: {err}"
+                return result
+
+            self.backoff.success()
+            profiling.count("bytes_downloaded", len(data))
+            data = compress_bytes(data, self.compression)
+            try:
+                write_atomic(path, data)
+                result.downloaded = True
+                result.sha256 = hashlib.sha256(data).hexdigest()
+            except OSError as err:
+                result.error = f"{type(err).__name__}: {err}"
+            return result
+
+    def download(self, activities, progress=None, cancel=None):
+        """
+        Download a list of activities from get_activities_by_date
+        Returns a DownloadResult per activity, progress(done, total, result) is called as each finishes
+        Once the cancel event is set no new downloads are started and the finished ones are returned
+        """
+        def start(activity):
+            # a queued download can already be running when the futures are cancelled
+            if cancel is not None and cancel.is_set():
+                return None
+            return self.download_one(activity)
+
+        results = []
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            futures = [executor.submit(start, activity) for activity in activities]
+            for future in as_completed(futures):
+                if future.cancelled():
+                    continue
+                result = future.result()
+                if result is None:
+                    continue
+                results.append(result)
+                if progress:
+                    progress(len(results), len(futures), result)
+                if cancel is not None and cancel.is_set():
+                    for pending in futures:
+                        pending.cancel()
+        return results
+
+
+def download_activities(api, start_date, end_date, overwrite, catalog=None, workers=4, progress=None, compression=None,
+                        cancel=None):
+    """
+    Download every activity between start_date and end_date into the activities folder
+    Files are added to the catalog, if one is given, as they arrive
+    compression can be "gz" or "zst" to store the files compressed
+    cancel is an optional threading.Event that stops the download early
+    """
+    with profiling.span("list_activities", start=start_date, end=end_date):
+        activities = api.get_activities_by_date(start_date, end_date)
+    engine = DownloadEngine(api, workers=workers, overwrite=overwrite, compression=compression)
+
+    def on_result(done, total, result):
+        if result.downloaded and catalog is not None:
+            try:
+                catalog.add_file(result.path)
+            except Exception as err:
+                logger.error(f"Could not add {result.path} to the catalog: {err}")
+        if progress:
+            progress(done, total, result)
+
+    return engine.download(activities, progress=on_result, cancel=cancel)
@@ -0,0 +1,90 @@
+import numpy as np
+
+
+def axes_pixel_width(ax):
+    """Width of a matplotlib Axes in pixels, which is as many points as a line on it can show"""
+    return max(1, int(ax.get_window_extent().width))
+
+
+def minmax_indices(y, n_buckets):
+    """
+    Split y into n_buckets and keep the minimum and maximum of each
+    Every peak and dip survives, so this is the safe choice for heart rate and speed
+    Returns the sorted indices to keep
+    """
+    y = np.asarray(y, dtype='float64')
+    n = len(y)
+    if n <= 2 * n_buckets:
+        return np.arange(n)
+
+    bucket = -(-n // n_buckets)
+    padded = np.full(bucket * n_buckets, np.nan)
+    padded[:n] = y
+    rows = padded.reshape(n_buckets, bucket)
+    nan = np.isnan(rows)
+    offsets = np.arange(n_buckets) * bucket
+    maxima = offsets + np.argmax(np.where(nan, -np.inf, rows), axis=1)
+    minima = offsets + np.argmin(np.where(nan, np.inf, rows), axis=1)
+
+    indices = np.concatenate(([0, n - 1], maxima, minima))
+    return np.unique(indices[indices < n])
+
+
+def lttb_indices(x, y, n_out):
+    """
+    Largest-Triangle-Three-Buckets: keep n_out points that best preserve the visual shape
+    x must be increasing, returns the sorted indices to keep
+    """
+    x = np.asarray(x, dtype='float64')
+    y = np.asarray(y, dtype='float64')
+    n = len(x)
+    if n_out >= n or n_out < 3:
+        return np.arange(n)
+
+    # the first and last points are always kept, the rest is split into n_out - 2 buckets
+    every = (n - 2) / (n_out - 2)
+    indices = np.empty(n_out, dtype='int64')
+    indices[0] = 0
+    indices[-1] = n - 1
+
+    a = 0
+    for i in range(n_out - 2):
+        start = int(i * every) + 1
+        end = int((i + 1) * every) + 1
+        # the point picked is the one making the largest triangle with the last
+        # point picked and the average of the next bucket
+        if i == n_out - 3:
+            next_start, next_end = n - 1, n
+        else:
+            next_start, next_end = end, min(int((i + 2) * every) + 1, n)
+        avg_x = x[next_start:next_end].mean()
+        next_y = y[next_start:next_end]
+        next_y = next_y[~np.isnan(next_y)]
+        avg_y = next_y.mean() if len(next_y) else y[a]
+
+        area = np.abs((x[a] - avg_x) * (y[start:end] - y[a]) - (x[a] - x[start:end]) * (avg_y - y[a]))
+        a = start + int(np.argmax(np.nan_to_num(area, nan=-1.0)))
+        indices[i + 1] = a
+    return indices
+
+
+def downsample(x, y, n_out, method='minmax'):
+    """
+    Reduce x, y to about n_out points for plotting while keeping the shape of the series
+    method is 'minmax' (keeps every extreme) or 'lttb' (smoother, fewer points)
+    x can be numbers or datetime64 values, returns the reduced (x, y)
+    """
+    x = np.asarray(x)
+    y = np.asarray(y)
+    if len(y) <= n_out:
+        return x, y
+
+    if method == 'minmax':
+        indices = minmax_indices(y, max(1, n_out // 2))
+    elif method == 'lttb':
+        numeric_x = x.astype('datetime64[ns]').view('int64') if x.dtype.kind == 'M' else x
+        numeric_x = np.asarray(numeric_x, dtype='float64')
+        indices = lttb_indices(numeric_x - numeric_x[0], y, n_out)
+    else:
+        raise ValueError(f"Unknown downsampling method '{method}'")
+    return x[indices], y[indices]
@@ -0,0 +1,117 @@
+import os
+
+import ingest
+import profiling
+
+
+def _pyarrow():
+    try:
+        import pyarrow
+    except ImportError:
+        raise ImportError("Parquet and Arrow export need the pyarrow package (pip install pyarrow)")
+    return pyarrow
+
+
+class CsvWriter():
+    """Appends activities to one CSV file, the header is written once"""
+
+    def __init__(self, path):
+        self.file = open(path, "w", newline="")
+        self.header = True
+
+    def write(self, track, activity):
+        df = track.to_dataframe()
+        df.insert(0, "activity", activity)
+        df.to_csv(self.file, header=self.header, index=False, date_format="%Y-%m-%dT%H:%M:%S.%fZ")
+        self.header = False
+
+    def close(self):
+        self.file.close()
+
+
+class _ArrowTableWriter():
+    """Base for the pyarrow writers, every activity becomes one record batch / row group"""
+
+    def __init__(self, path):
+        self.path = path
+        self.writer = None
+
+    def table(self, track, activity):
+        pa = _pyarrow()
+        columns = {"activity": pa.repeat(pa.scalar(activity), len(track))}
+        for name in track.column_names:
+            if name == "time":
+                columns[name] = pa.array(track.time_ns(), type=pa.timestamp("ns", tz="UTC"))
+            else:
+                columns[name] = pa.array(track[name])
+        return pa.table(columns)
+
+    def write(self, track, activity):
+        table = self.table(track, activity)
+        if self.writer is None:
+            self.writer = self.open_writer(table.schema)
+        self.writer.write_table(table)
+
+    def close(self):
+        if self.writer is not None:
+            self.writer.close()
+
+
+class ParquetWriter(_ArrowTableWriter):
+
+    def open_writer(self, schema):
+        import pyarrow.parquet
+        return pyarrow.parquet.ParquetWriter(self.path, schema)
+
+
+class ArrowWriter(_ArrowTableWriter):
+    """Arrow IPC file format (.arrow / .feather v2)"""
+
+    def open_writer(self, schema):
+        import pyarrow.ipc
+        return pyarrow.ipc.new_file(self.path, schema)
+
+
+WRITERS = {
+    "csv": CsvWriter,
+    "parquet": ParquetWriter,
+    "arrow": ArrowWriter,
+}
+
+
+def register_writer(name, writer_class):
+    """
+    Add an export format, writer_class(path) needs write(track, activity) and close()
+    """
+    WRITERS[name] = writer_class
+
+
+def export_activities(paths, out_path, fmt, cache=None, workers=1, progress=None, columns=None):
+    """
+    Write the Trackpoints of many activities into a single file
+    Activities are parsed and written one at a time, so they never all have to be in memory
+    Every row gets an activity column with the file it came from
+    Returns the number of activities written, progress(done, total, result) is called per file
+    columns limits the export to those Track columns, see tcx_parser.read_track
+    """
+    if fmt not in WRITERS:
+        raise ValueError(f"Unknown export format '{fmt}', expected one of {list(WRITERS)}")
+
+    folder = os.path.dirname(out_path)
+    if folder:
+        os.makedirs(folder, exist_ok=True)
+
+    written = 0
+    writer = WRITERS[fmt](out_path)
+    try:
+        for done, result in enumerate(ingest.iter_archive(paths, workers=workers, cache=cache, columns=columns), start=1):
+            if not result.error:
+                with profiling.span("export_write", file=result.path, format=fmt):
+                    writer.write(result.track, result.path)
+                profiling.count("rows_exported", len(result.track))
+                written += 1
+            if progress:
+                progress(done, len(paths), result)
+    finally:
+        writer.close()
+    return written
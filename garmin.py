@@ -2,27 +2,22 @@ import argparse
 import datetime
 import logging
 import os
+import time
 from getpass import getpass
-import requests
-from garth.exc import GarthHTTPError
-import tkinter
-from tkinter import ttk
-import sv_ttk
-
-from garminconnect import (
-    Garmin,
-    GarminConnectAuthenticationError,
-    GarminConnectConnectionError,
-    GarminConnectTooManyRequestsError,
-)
 
+import aggregate
+import best_efforts
+import compressed
+import downloader
+import export
+import ingest
+import profiling
+import sync
 import tcx_parser
-
-
-# setup tkinter
-root = tkinter.Tk()
-sv_ttk.use_dark_theme()
-#sv_ttk.use_light_theme()
+import tcx_writer
+import training_load
+from cache import ActivityCache
+from catalog import ActivityCatalog
 
 
 # setup logger
@@ -30,50 +25,182 @@ logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
     
 
-def get_month_name(month_num):
-    months = ["", "January", "Febuary", "March", "April", "May", "June", "July", "August", "September", "October", "November", "December"]
-    return months[int(month_num)]
+def download_activities(api, start_date, end_date, overwrite, catalog=None, workers=4, compression=None):
+    def progress(done, total, result):
+        if result.error:
+            logger.error(f"Failed to download activity {result.activity_id}: {result.error}")
+        elif result.downloaded:
+            print(f"Downloaded activity: {result.path}")
+
+    results = downloader.download_activities(api, start_date, end_date, overwrite, catalog=catalog,
+                                             workers=workers, progress=progress, compression=compression)
+    process_downloads(ingest.ACTIVITIES_FOLDER, [result.path for result in results if result.downloaded])
+    return results
+
+
+def synchronize_activities(api, start_date, end_date, folder, workers=4, compression=None):
+    """Download only the activities that have not been synchronized before"""
+    def progress(done, total, result):
+        if result.error:
+            logger.error(f"Failed to download activity {result.activity_id}: {result.error}")
+        elif result.downloaded:
+            print(f"Downloaded activity: {result.path}")
+
+    catalog = ActivityCatalog(os.path.join(folder, "catalog.db"))
+    results = sync.synchronize(api, start_date, end_date, catalog=catalog, folder=folder,
+                               workers=workers, progress=progress, compression=compression)
+    print(f"Synchronized {sum(1 for result in results if result.downloaded)} new activities")
+    catalog.close()
+    process_downloads(folder, [result.path for result in results if result.downloaded])
+    return results
+
+
+def process_downloads(folder, paths):
+    """Update the records and training load kept in folder with downloaded paths and print what changed"""
+    improved, days = sync.process_downloads(paths, folder, cache=ActivityCache())
+    print_new_records(improved)
+    if days:
+        print(f"Updated training load for {len(days)} days from {days[0]}")
+
+
+def update_records(folder, paths, workers=None):
+    """Check paths against the personal records kept in folder and print any new ones"""
+    if not paths:
+        return []
+    records = best_efforts.RecordBook(os.path.join(folder, "records.json"))
+    improved = records.update(paths, cache=ActivityCache(), workers=workers)
+    print_new_records(improved)
+    return improved
+
+
+def print_new_records(improved):
+    for effort in improved:
+        print(f"New record for {effort.target:g}: {effort.distance:.0f} m in {effort.duration:.0f}s ({effort.path})")
+
+
+def print_records(folder, workers=None):
+    """Bring the personal records up to date with the whole archive and print them"""
+    update_records(folder, ingest.find_activity_files(folder), workers)
+    records = best_efforts.RecordBook(os.path.join(folder, "records.json"))
+    for target, effort in sorted(records.distance_records.items()):
+        print(f"Fastest {target / 1000:g} km: {aggregate.format_duration(effort.duration)} on {effort.start_time} ({effort.path})")
+    for target, effort in sorted(records.duration_records.items()):
+        print(f"Best {target / 60:g} min: {effort.distance:.0f} m on {effort.start_time} ({effort.path})")
+
+
+def update_training_load(folder, paths, workers=None, max_heartrate=None, rest_heartrate=None):
+    """Add paths to the training load log kept in folder, returns the log"""
+    log = training_load.TrainingLog(os.path.join(folder, "training.json"), max_heartrate, rest_heartrate)
+    if paths:
+        days = log.update(paths, cache=ActivityCache(), workers=workers)
+        if days:
+            print(f"Updated training load for {len(days)} days from {days[0]}")
+    return log
+
+
+def print_training_load(folder, days=42, workers=None, max_heartrate=None, rest_heartrate=None):
+    """Bring the training load up to date with the whole archive and print the last days of it"""
+    log = update_training_load(folder, ingest.find_activity_files(folder), workers, max_heartrate, rest_heartrate)
+    daily = log.daily()[-days:]
+    for day in daily:
+        print(f"{day.date}: TRIMP {day.trimp:6.1f}  ATL {day.atl:6.1f}  CTL {day.ctl:6.1f}  TSB {day.tsb:6.1f}")
+    if daily:
+        zones = log.zone_totals(daily[0].date)
+        print("Time in zone: " + ", ".join(f"Z{i} {aggregate.format_duration(s)}" for i, s in enumerate(zones)))
 
 
-def download_activities(api, start_date, end_date, overwrite):
-    activities = api.get_activities_by_date(start_date, end_date)
-    for activity in activities:
-        start_time = activity['startTimeLocal']
-        start_time = start_time.split(" ")[0]
-        start_time = start_time.split("-")
-        year = start_time[0]
-        month = start_time[1]
-        month = get_month_name(month)
-        day = start_time[2]
+def tcx(filename):
+    points_data = tcx_parser.get_all_data_points(filename)
+    #print(points_data)
+
+    index, offset = tcx_parser.search_point_time(points_data)
+    print(f"Closest point: {index} ({offset:+.1f}s)")
 
-        id = activity['activityId']
+    #time = tcx_parser.get_total_time(points_data)
+    #print(time)
 
-        if not os.path.exists(f"activities\\{year}\\{month}"):
-            os.makedirs(f"activities\\{year}\\{month}")
+    # times = tcx_parser.create_list_of_point_times(points_data)
+    # print(times)
 
-        data = api.download_activity(id, dl_fmt=api.ActivityDownloadFormat.TCX)
 
-        file_path = f"activities\\{year}\\{month}\\{day}-{id}.tcx"
+def ingest_activities(folder, workers, cache):
+    """Parse every activity under folder in parallel and report on the results"""
+    start = time.perf_counter()
+    paths = ingest.find_activity_files(folder)
+    print(f"Parsing {len(paths)} activities from '{folder}'")
 
-        if not overwrite and os.path.isfile(file_path):
-            pass
+    def progress(done, total, result):
+        if result.error:
+            logger.error(f"{result.path}: {result.error}")
         else:
-            with open(file_path, "wb") as fb:
-                fb.write(data)
-                print(f"Downloaded activity: {file_path}")
+            print(f"[{done}/{total}] {result.path} ({len(result.track)} points)")
 
+    results = ingest.load_archive(paths, workers=workers, progress=progress, cache=cache)
 
-def tcx(filename):
-    points_data = tcx_parser.get_all_data_points(filename)
-    #print(points_data)
+    errors = sum(1 for result in results if result.error)
+    points = sum(len(result.track) for result in results if not result.error)
+    print(f"Parsed {len(results) - errors} activities ({points} points) in {time.perf_counter() - start:.1f}s, {errors} errors")
+    return results
 
-    tcx_parser.search_point_time(points_data)
 
-    #time = tcx_parser.get_total_time(points_data)
-    #print(time)
+def rescan_catalog(folder, workers):
+    """Backfill the activity catalog from the files under folder"""
+    catalog = ActivityCatalog(os.path.join(folder, "catalog.db"))
 
-    # times = tcx_parser.create_list_of_point_times(points_data)
-    # print(times)
+    def progress(done, total, path, error):
+        if error:
+            logger.error(f"{path}: {error}")
+        else:
+            print(f"[{done}/{total}] {path}")
+
+    added = catalog.rescan(folder, workers=workers, progress=progress)
+    print(f"Catalog updated with {added} activities, {len(catalog)} in total")
+    catalog.close()
+
+
+def compress_activities(folder, compression):
+    """
+    Compress every plain .tcx file under folder in place, keeping the catalog, sync manifest,
+    records and training log in step
+    """
+    catalog = ActivityCatalog(os.path.join(folder, "catalog.db"))
+    manifest = sync.SyncManifest(os.path.join(folder, "sync_manifest.json"))
+    records = best_efforts.RecordBook(os.path.join(folder, "records.json"))
+    log = training_load.TrainingLog(os.path.join(folder, "training.json"))
+
+    def progress(done, total, old_path, new_path):
+        catalog.rename(old_path, new_path)
+        manifest.rename(old_path, new_path)
+        records.rename(old_path, new_path)
+        log.rename(old_path, new_path)
+        print(f"[{done}/{total}] {new_path}")
+
+    moved = compressed.compress_archive(ingest.find_activity_files(folder), compression, progress=progress)
+    manifest.save()
+    for book in (records, log):
+        if os.path.isfile(book.path):
+            book.save()
+    catalog.close()
+    print(f"Compressed {len(moved)} activities")
+
+
+def export_activities(folder, fmt, output, start_date=None, end_date=None, workers=1):
+    """Export every activity under folder, or those from start_date to end_date, into one file"""
+    if start_date:
+        catalog = ActivityCatalog(os.path.join(folder, "catalog.db"))
+        paths = [row["path"] for row in catalog.find(start_date, end_date)]
+        catalog.close()
+    else:
+        paths = ingest.find_activity_files(folder)
+
+    def progress(done, total, result):
+        if result.error:
+            logger.error(f"{result.path}: {result.error}")
+        else:
+            print(f"[{done}/{total}] {result.path}")
+
+    written = export.export_activities(paths, output, fmt, cache=ActivityCache(), workers=workers, progress=progress)
+    print(f"Exported {written} activities to {output}")
 
 
 def get_args():
@@ -88,6 +215,29 @@ def get_args():
     parser.add_argument('--overwrite', dest="overwrite", action='store_true', required=False)
     parser.add_argument('--synchronize', dest="synchronize", action='store_true', default=False, required=False)
     parser.add_argument('--tcx', dest="tcx", action='store_true', required=False)
+    parser.add_argument('--ingest', dest="ingest", action='store_true', required=False)
+    parser.add_argument('--folder', dest="folder", action='store', default=ingest.ACTIVITIES_FOLDER, required=False)
+    parser.add_argument('--workers', dest="workers", action='store', type=int, default=None, required=False)
+    parser.add_argument('--no_cache', dest="no_cache", action='store_true', required=False)
+    parser.add_argument('--rescan', dest="rescan", action='store_true', required=False)
+    parser.add_argument('--download_workers', dest="download_workers", action='store', type=int, default=4, required=False)
+    parser.add_argument('--compression', dest="compression", action='store', choices=compressed.COMPRESSIONS, default=None, required=False)
+    parser.add_argument('--compress_archive', dest="compress_archive", action='store_true', required=False)
+    parser.add_argument('--export', dest="export", action='store', choices=list(export.WRITERS), default=None, required=False)
+    parser.add_argument('--output', dest="output", action='store', default=None, required=False)
+    parser.add_argument('--records', dest="records", action='store_true', required=False)
+    parser.add_argument('--training_load', dest="training_load", action='store', type=int, nargs='?', const=42, default=None, required=False)
+    parser.add_argument('--max_hr', dest="max_hr", action='store', type=int, default=None, required=False)
+    parser.add_argument('--rest_hr', dest="rest_hr", action='store', type=int, default=None, required=False)
+    parser.add_argument('--trim', dest="trim", action='store', default=None, required=False)
+    parser.add_argument('--split', dest="split", action='store', default=None, required=False)
+    parser.add_argument('--merge', dest="merge", action='store', nargs='+', default=None, required=False)
+    parser.add_argument('--from_time', dest="from_time", action='store', default=None, required=False)
+    parser.add_argument('--to_time', dest="to_time", action='store', default=None, required=False)
+    parser.add_argument('--at_time', dest="at_time", action='store', default=None, required=False)
+    parser.add_argument('--at_lap', dest="at_lap", action='store', type=int, default=None, required=False)
+    parser.add_argument('--profile', dest="profile", action='store', nargs='?', const="profile.json", default=None, required=False)
+    parser.add_argument('--cprofile', dest="cprofile", action='store', default=None, required=False)
     args = parser.parse_args()
     return args
 
@@ -103,6 +253,10 @@ def get_credentials():
 
 def init_api(email, password, tokenstore, tokenstore_base64):
     """Initialize Garmin API with your credentials."""
+    # the Garmin Connect client is only loaded when we log in, the offline commands don't need it
+    import requests
+    from garth.exc import GarthHTTPError
+    from garminconnect import Garmin, GarminConnectAuthenticationError
 
     try:
         # Using Oauth1 and OAuth2 token files from directory
@@ -146,7 +300,65 @@ def init_api(email, password, tokenstore, tokenstore_base64):
     return garmin
 
 
+def _output_name(path, suffix):
+    """run.tcx.gz -> run_<suffix>.tcx.gz"""
+    base = compressed.strip_compression(path)
+    root, extension = os.path.splitext(base)
+    return f"{root}_{suffix}{extension}{path[len(base):]}"
+
+
+def trim_activity(path, output, start_time=None, end_time=None):
+    output = output or _output_name(path, "trimmed")
+    written = tcx_writer.trim_activity(path, output, start_time, end_time)
+    print(f"Wrote {written} points to {output}")
+
+
+def split_activity(path, output, at_time=None, at_lap=None):
+    first, second = _output_name(output or path, "1"), _output_name(output or path, "2")
+    written = tcx_writer.split_activity(path, first, second, time=at_time, lap=at_lap)
+    print(f"Wrote {written[0]} points to {first} and {written[1]} points to {second}")
+
+
+def merge_activities(paths, output):
+    output = output or _output_name(paths[0], "merged")
+    written = tcx_writer.merge_activities(paths, output)
+    print(f"Merged {len(paths)} activities ({written} points) into {output}")
+
+
 def main():
+    args = get_args()
+    if not args.profile and not args.cprofile:
+        run(args)
+        return
+
+    # neither profiler sees into ingest's worker processes, so parse in this one
+    if args.workers is None:
+        args.workers = 1
+    elif args.workers != 1:
+        print(f"Parsing in {args.workers} worker processes is not profiled, use --workers 1 to include it")
+
+    profiler = None
+    if args.profile:
+        profiling.enable()
+    if args.cprofile:
+        import cProfile
+        profiler = cProfile.Profile()
+        profiler.enable()
+    try:
+        run(args)
+    finally:
+        if profiler is not None:
+            profiler.disable()
+            profiler.dump_stats(args.cprofile)
+            print(f"cProfile stats written to {args.cprofile}")
+        if args.profile:
+            profiling.disable()
+            profiling.write_report(args.profile)
+            print(profiling.format_summary())
+            print(f"Profile written to {args.profile}")
+
+
+def run(args):
 
     email = os.getenv("EMAIL")
     password = os.getenv("PASSWORD")
@@ -154,19 +366,56 @@ def main():
     tokenstore_base64 = os.getenv("GARMINTOKENS_BASE64") or "~/.garminconnect_base64"
     api = None
 
-    args = get_args()
+    if args.ingest:
+        ingest_activities(args.folder, args.workers, None if args.no_cache else ActivityCache())
+        return
+
+    if args.rescan:
+        rescan_catalog(args.folder, args.workers)
+        return
 
-    api = init_api(email, password, tokenstore, tokenstore_base64)
+    if args.compress_archive:
+        compress_activities(args.folder, args.compression or "gz")
+        return
+
+    if args.training_load:
+        print_training_load(args.folder, args.training_load, args.workers, args.max_hr, args.rest_hr)
+        return
+
+    if args.records:
+        print_records(args.folder, args.workers)
+        return
+
+    if args.export:
+        start_date = datetime.date.fromisoformat(args.start_date) if args.start_date else None
+        end_date = datetime.date.fromisoformat(args.end_date)
+        output = args.output or f"export.{args.export}"
+        export_activities(args.folder, args.export, output, start_date, end_date, args.workers or 1)
+        return
+
+    if args.trim:
+        trim_activity(args.trim, args.output, args.from_time, args.to_time)
+        return
+
+    if args.split:
+        split_activity(args.split, args.output, args.at_time, args.at_lap)
+        return
+
+    if args.merge:
+        merge_activities(args.merge, args.output)
+        return
+
+    with profiling.span("login"):
+        api = init_api(email, password, tokenstore, tokenstore_base64)
     if not api:
         return
 
 
     if args.download_activities:
-        if not args.start_date:
-            today = datetime.datetime.now()
-            args.start_date = today - datetime.timedelta(days = 14)
-        print(f"Downloading activities from {args.start_date} to {args.end_date}")
-        download_activities(api, args.start_date, args.end_date, args.overwrite)
+        # a local default, --synchronize below still needs to know no start date was given
+        start_date = args.start_date or (datetime.date.today() - datetime.timedelta(days=14)).isoformat()
+        print(f"Downloading activities from {start_date} to {args.end_date}")
+        download_activities(api, start_date, args.end_date, args.overwrite, ActivityCatalog(), args.download_workers, args.compression)
     
 
     # if args.list_activities:
@@ -178,19 +427,16 @@ def main():
     #         print(a["activityId"])
     
 
-    # if args.synchronize:
-    #     today = datetime.datetime.now()
-    #     look_back = today - datetime.timedelta(days = 14)
-    #     activities = api.get_activities_by_date(look_back, today)
-    #     for a in activities:
-    #         print(a["activityId"])
+    if args.synchronize:
+        start_date = datetime.date.fromisoformat(args.start_date) if args.start_date else None
+        end_date = datetime.date.fromisoformat(args.end_date)
+        synchronize_activities(api, start_date, end_date, args.folder, args.download_workers, args.compression)
 
     
 
     if args.tcx:
         tcx("activities/2024/January/test1.tcx")
 
-    #root.mainloop()
 
 
 
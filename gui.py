@@ -1,11 +1,13 @@
 from datetime import timedelta
 import tkinter as tk
-from tkinter import ttk
+from tkinter import ttk, filedialog
 from tkcalendar import Calendar
 import datetime
 from matplotlib.backends.backend_tkagg import FigureCanvasTkAgg
 import matplotlib.pyplot as plt
+import difflib
 import os
+import threading
 
 import requests
 from garth.exc import GarthHTTPError
@@ -16,6 +18,18 @@ from garminconnect import (
     GarminConnectTooManyRequestsError,
 )
 
+import aggregate
+import downloader
+import export
+import sync
+from cache import ActivityCache
+from catalog import ActivityCatalog, DateRangeCache
+from ingest import parse_activity_path
+from tasks import TaskRunner
+
+
+# how long the Analyze inputs have to be still before the activities are looked up
+LOOKUP_DELAY_MS = 300
 
 
 class TCXUtilitiesApp(tk.Tk):
@@ -28,6 +42,14 @@ class TCXUtilitiesApp(tk.Tk):
 
         self.logged_in = False
         self.api = None
+        self.catalog = None
+        self.catalog_lock = threading.Lock()
+        self.runner = TaskRunner(self)
+        self.lookup_task = None
+        self.lookup_after = None
+        self.activity_cache = None
+        self.download_task = None
+        self.protocol("WM_DELETE_WINDOW", self.on_close)
 
         self.pages = {}
         self.current_page = tk.StringVar()
@@ -44,6 +66,10 @@ class TCXUtilitiesApp(tk.Tk):
         #self.create_analyze_page()
         #self.create_synchronize_page()
 
+    def on_close(self):
+        self.runner.shutdown()
+        self.destroy()
+
     def create_sidebar_buttons(self):
         buttons = [
             ("Welcome", "icons/welcome-icon.png", 7, self.create_welcome_page),
@@ -71,8 +97,79 @@ class TCXUtilitiesApp(tk.Tk):
         self.pages["Welcome"].pack(pady=50)
     
     def create_export_page(self):
-        self.pages["Export"] = tk.Label(self.content, text="Export Page", font=("Helvetica", 24))
-        self.pages["Export"].pack(pady=50)
+        self.pages["Export"] = tk.Frame(self.content)
+        self.pages["Export"].pack(fill="both", expand=True)
+
+        self.export_calendar = Calendar(self.pages["Export"])
+        self.export_calendar.grid(row=0, column=0, rowspan=6, padx=(50, 20), pady=(30, 0), sticky="nw")
+
+        export_days_label = tk.Label(self.pages["Export"], text="Days:")
+        export_days_label.grid(row=0, column=1, padx=(0, 10), pady=(30, 10), sticky="e")
+
+        self.export_days_var = tk.StringVar(value="7")
+        self.export_days_entry = tk.Entry(self.pages["Export"], textvariable=self.export_days_var)
+        self.export_days_entry.grid(row=0, column=2, pady=(30, 10), sticky="w")
+
+        export_format_label = tk.Label(self.pages["Export"], text="Format:")
+        export_format_label.grid(row=1, column=1, padx=(0, 10), pady=10, sticky="e")
+
+        self.export_format_var = tk.StringVar(value="csv")
+        self.export_format_dropdown = ttk.Combobox(self.pages["Export"], textvariable=self.export_format_var,
+                                                   values=list(export.WRITERS), state="readonly")
+        self.export_format_dropdown.grid(row=1, column=2, pady=10, sticky="w")
+
+        export_output_label = tk.Label(self.pages["Export"], text="Output file:")
+        export_output_label.grid(row=2, column=1, padx=(0, 10), pady=10, sticky="e")
+
+        self.export_output_var = tk.StringVar()
+        self.export_output_entry = tk.Entry(self.pages["Export"], textvariable=self.export_output_var)
+        self.export_output_entry.grid(row=2, column=2, pady=10, sticky="w")
+
+        self.export_browse_button = ttk.Button(self.pages["Export"], text="Browse", command=self.browse_export_output)
+        self.export_browse_button.grid(row=3, column=2, pady=10, sticky="w")
+
+        self.export_button = ttk.Button(self.pages["Export"], text="Export", command=self.export)
+        self.export_button.grid(row=4, column=2, pady=10, sticky="w")
+
+        self.export_status_label = tk.Label(self.pages["Export"])
+        self.export_status_label.grid(row=5, column=1, columnspan=2, pady=10, sticky="w")
+
+    def browse_export_output(self):
+        fmt = self.export_format_var.get()
+        path = filedialog.asksaveasfilename(defaultextension=f".{fmt}", initialfile=f"export.{fmt}")
+        if path:
+            self.export_output_var.set(path)
+
+    def export(self):
+        num_days = self.export_days_var.get()
+        start_date = self.export_calendar.selection_get()
+        if not num_days.isdigit() or start_date is None:
+            self.export_status_label.config(text="Select a start date and number of days")
+            return
+
+        fmt = self.export_format_var.get()
+        output = self.export_output_var.get() or f"export.{fmt}"
+        end_date = start_date + datetime.timedelta(days = (int(num_days)-1))
+
+        def run(task):
+            paths = [row["path"] for row in self.get_catalog().find(start_date, end_date)]
+            return export.export_activities(paths, output, fmt, cache=ActivityCache(),
+                                            progress=lambda done, total, result: task.progress(done, total))
+
+        def on_progress(done, total):
+            self.export_status_label.config(text=f"Exporting {done}/{total}")
+
+        def on_done(written):
+            self.export_button.config(state="normal")
+            self.export_status_label.config(text=f"Exported {written} activities to {output}")
+
+        def on_error(err):
+            self.export_button.config(state="normal")
+            self.export_status_label.config(text=str(err))
+
+        self.export_button.config(state="disabled")
+        self.export_status_label.config(text="Exporting...")
+        self.runner.submit(run, on_done=on_done, on_progress=on_progress, on_error=on_error)
 
     def create_settings_page(self):
         self.pages["Settings"] = tk.Label(self.content, text="Settings Page", font=("Helvetica", 24))
@@ -150,9 +247,13 @@ class TCXUtilitiesApp(tk.Tk):
         self.select_all_button = tk.Button(self.pages["Analyze"], text="Select All", command=self.select_all)
         self.select_all_button.pack(side="top", padx=(0, 0), pady=(20, 0))
 
-        self.stats_button = tk.Button(self.pages["Analyze"], text="View Stats", command=self.select_all)
+        self.stats_button = tk.Button(self.pages["Analyze"], text="View Stats", command=self.view_stats)
         self.stats_button.pack(side="top", padx=(0, 0), pady=(20, 0))
 
+        self.stats_label = tk.Label(self.pages["Analyze"], justify="left")
+        self.stats_label.pack(side="top", padx=(0, 0), pady=(20, 0))
+        self.activity_rows = []
+
         # time = "3/1/2024 - 3/3/2024"
 
         # # Label for time range
@@ -178,41 +279,49 @@ class TCXUtilitiesApp(tk.Tk):
             self.listbox.select_set(0, tk.END)  # Select all items
 
 
-    def get_month_num(self, month_name):
-        months = ["", "January", "Febuary", "March", "April", "May", "June", "July", "August", "September", "October", "November", "December"]
-        return int(months.index(month_name))
-    
+    def get_catalog(self):
+        """
+        Open the activity catalog and bring it in line with the activities folder
+        Files on disk the catalog doesn't have yet, e.g. ones downloaded from the command
+        line, are added. Known files only cost a stat, but new ones are parsed, so call
+        this from a task rather than the Tk thread
+        """
+        with self.catalog_lock:
+            if self.catalog is None:
+                catalog = ActivityCatalog()
+                catalog.rescan()
+                self.catalog = catalog
+        return self.catalog
+
+    def get_activity_cache(self):
+        """Date range cache in front of the catalog, invalidated as downloads land"""
+        if self.activity_cache is None:
+            self.activity_cache = DateRangeCache(self.get_catalog())
+        return self.activity_cache
+
     def find_activity_files(self, start_date, end_date):
-        folder = "activities"
-        if not os.path.exists(folder):
+        """Returns the catalog rows of the activities from start_date to end_date"""
+        if not os.path.exists("activities"):
             return []
-        
-        all_items = os.listdir(folder)
-        
-        file_list = []
-        year_folders = [item for item in all_items if os.path.isdir(os.path.join(folder, item))]
-        for year_dirs in year_folders:
-            year = year_dirs
-            if int(year) >= start_date.year and int(year) <= end_date.year:
-                month_folders = [item for item in os.listdir(os.path.join(folder, year)) if os.path.isdir(os.path.join(folder, year, item))]
-                for month_dirs in month_folders:
-                    month = self.get_month_num(month_dirs)
-                    if month >= start_date.month and month <= end_date.month:
-                        file_paths = [item for item in os.listdir(os.path.join(folder, year, month_dirs)) if os.path.isfile(os.path.join(folder, year, month_dirs, item))]
-                        for file in file_paths:
-                            day = file.split("-")[0]
-                            if not day.isdigit():
-                                continue
-                            date = datetime.date(int(year), month, int(day))
-                            if date >= start_date and date <= end_date:
-                                file_list.append(file)
-        
-        return file_list
+
+        return self.get_activity_cache().find(start_date, end_date)
+
+    def view_stats(self):
+        """Show totals for the selected activities, or all listed ones, per week"""
+        selection = self.listbox.curselection()
+        rows = [self.activity_rows[i] for i in selection] if selection else self.activity_rows
+        self.runner.submit(lambda task: stats_text(rows), on_done=lambda text: self.stats_label.config(text=text))
 
 
-    
     def on_frequency_entry_changed(self, event):
-        # This function is called whenever the content of the frequency entry changes
+        # This function is called on every key press and calendar click, the lookup waits
+        # until the input has been still for a moment so typing "365" only looks up once
+        if self.lookup_after is not None:
+            self.after_cancel(self.lookup_after)
+        self.lookup_after = self.after(LOOKUP_DELAY_MS, self.refresh_activities)
+
+    def refresh_activities(self):
+        self.lookup_after = None
         new_value = self.frequency_var.get()
         if new_value.isdigit() == False:
             return
@@ -228,11 +337,37 @@ class TCXUtilitiesApp(tk.Tk):
 
         self.time_range_label.config(text=time_range)
 
-        activity_list = self.find_activity_files(start_date, end_date)
-        
-        self.listbox.delete(0, tk.END)
-        for activity in activity_list:
-            self.listbox.insert(tk.END, activity)
+        # only the latest lookup matters, an older one still running is dropped
+        if self.lookup_task is not None:
+            self.lookup_task.cancel()
+
+        def run(task):
+            rows = self.find_activity_files(start_date, end_date)
+            return rows, stats_text(rows)
+
+        # ranges that are already cached don't need a trip to the worker threads
+        if self.activity_cache is not None and self.activity_cache.is_cached(start_date, end_date):
+            self.lookup_task = None
+            self.show_activities(run(None))
+        else:
+            self.lookup_task = self.runner.submit(run, on_done=self.show_activities)
+
+    def show_activities(self, result):
+        """Update the listbox in place, only rows that came or went are touched so the selection is kept"""
+        rows, text = result
+        old = [row["path"] for row in self.activity_rows]
+        new = [row["path"] for row in rows]
+        opcodes = difflib.SequenceMatcher(None, old, new, autojunk=False).get_opcodes()
+        # apply from the end so the indices of the earlier opcodes stay valid
+        for tag, i1, i2, j1, j2 in reversed(opcodes):
+            if tag == "equal":
+                continue
+            if i2 > i1:
+                self.listbox.delete(i1, i2 - 1)
+            for offset, path in enumerate(new[j1:j2]):
+                self.listbox.insert(i1 + offset, os.path.basename(path.replace("\\", "/")))
+        self.activity_rows = rows
+        self.stats_label.config(text=text)
             #args.start_date = today - datetime.timedelta(days = 14)
         #print(f"Downloading activities from {args.start_date} to {args.end_date}")
         # You can perform any actions you want here based on the new value
@@ -249,19 +384,77 @@ class TCXUtilitiesApp(tk.Tk):
         self.days_entry.grid(row=0, column=1, padx=(0, 20), pady=(150,10), sticky="w")
 
         self.download_button = ttk.Button(self.pages["Synchronize2"], text="Download", command=self.download)
-        self.download_button.grid(row=1, column=1, columnspan=2, padx=0, pady=10, sticky="w")
+        self.download_button.grid(row=1, column=1, padx=0, pady=10, sticky="w")
+
+        self.cancel_button = ttk.Button(self.pages["Synchronize2"], text="Cancel", command=self.cancel_download,
+                                        state="disabled")
+        self.cancel_button.grid(row=1, column=2, padx=0, pady=10, sticky="w")
 
+        self.download_progress = ttk.Progressbar(self.pages["Synchronize2"], mode="determinate", length=300)
+        self.download_progress.grid(row=2, column=0, columnspan=3, padx=(200, 10), pady=10, sticky="w")
+
+        self.download_status_label = tk.Label(self.pages["Synchronize2"])
+        self.download_status_label.grid(row=3, column=0, columnspan=3, padx=(200, 10), pady=0, sticky="w")
+
+        self.activities_label = tk.Label(self.pages["Synchronize2"], justify="left")
+        self.activities_label.grid(row=4, column=0, columnspan=3, padx=(200, 10), pady=10, sticky="w")
 
     def download(self):
         num_days = self.days_var.get()
+        if not num_days.isdigit():
+            self.download_status_label.config(text="Enter the number of days to look back")
+            return
 
         today = datetime.datetime.now()
         start_date = today - datetime.timedelta(days = int(num_days))
         print(f"Downloading activities from {start_date} to {today}")
-        output = download_activities(self.api, start_date, today, overwrite=True)
 
-        self.activities_label = tk.Label(self.pages["Synchronize2"], text=f"Activities Downloaded: \n{output}")
-        self.activities_label.grid(row=2, column=0, columnspan=3, padx=10, pady=10, sticky="e")
+        def run(task):
+            def progress(done, total, result):
+                # invalidated here rather than in on_progress, which is dropped once the task is cancelled
+                if result.downloaded and self.activity_cache is not None:
+                    date, activity_id = parse_activity_path(result.path)
+                    self.activity_cache.invalidate(date)
+                task.progress(done, total, result)
+
+            return download_activities(self.api, start_date, today, overwrite=True, catalog=self.get_catalog(),
+                                       progress=progress, cancel=task.cancel_event)
+
+        def on_progress(done, total, result):
+            self.download_progress.config(maximum=total, value=done)
+            if result.error:
+                self.download_status_label.config(text=f"{done}/{total}: activity {result.activity_id} failed")
+            else:
+                self.download_status_label.config(text=f"{done}/{total}: {os.path.basename(result.path)}")
+
+        def on_done(output):
+            self.download_finished()
+            self.activities_label.config(text=f"Activities Downloaded: \n{output}")
+
+        def on_error(err):
+            self.download_finished()
+            self.download_status_label.config(text=f"Download failed: {err}")
+
+        self.download_button.config(state="disabled")
+        self.cancel_button.config(state="normal")
+        self.download_progress.config(value=0)
+        self.download_status_label.config(text="Looking up activities...")
+        self.activities_label.config(text="")
+        self.download_task = self.runner.submit(run, on_done=on_done, on_progress=on_progress, on_error=on_error)
+
+    def cancel_download(self):
+        """Stop starting new downloads, the ones already running finish and are kept"""
+        if self.download_task is not None:
+            # the task's own callbacks are dropped once cancelled, so tidy up here
+            self.download_task.cancel()
+            self.download_task = None
+        self.download_finished()
+        self.download_status_label.config(text="Cancelled")
+
+    def download_finished(self):
+        self.download_task = None
+        self.download_button.config(state="normal")
+        self.cancel_button.config(state="disabled")
 
 
     def create_synchronize_page(self):
@@ -300,49 +493,54 @@ class TCXUtilitiesApp(tk.Tk):
         tokenstore = os.getenv("GARMINTOKENS") or "~/.garminconnect"
         tokenstore_base64 = os.getenv("GARMINTOKENS_BASE64") or "~/.garminconnect_base64"
 
-        self.api = init_api(username, password, tokenstore, tokenstore_base64)
-
-        if self.api:
-            self.logged_in = True
-            self.change_page(self.create_synchronize_page2)
-        else:
-            print("ERROR LOGGING IN")
-
-
-def get_month_name(month_num):
-    months = ["", "January", "Febuary", "March", "April", "May", "June", "July", "August", "September", "October", "November", "December"]
-    return months[int(month_num)]
+        def on_done(api):
+            self.login_button.config(state="normal")
+            self.api = api
+            if self.api:
+                self.logged_in = True
+                self.change_page(self.create_synchronize_page2)
+            else:
+                print("ERROR LOGGING IN")
 
+        def on_error(err):
+            self.login_button.config(state="normal")
+            print(f"ERROR LOGGING IN: {err}")
 
-def download_activities(api, start_date, end_date, overwrite):
-    activities = api.get_activities_by_date(start_date, end_date)
-    output = ""
-    for activity in activities:
-        start_time = activity['startTimeLocal']
-        start_time = start_time.split(" ")[0]
-        start_time = start_time.split("-")
-        year = start_time[0]
-        month = start_time[1]
-        month = get_month_name(month)
-        day = start_time[2]
+        self.login_button.config(state="disabled")
+        self.runner.submit(lambda task: init_api(username, password, tokenstore, tokenstore_base64),
+                           on_done=on_done, on_error=on_error)
 
-        id = activity['activityId']
 
-        if not os.path.exists(f"activities\\{year}\\{month}"):
-            os.makedirs(f"activities\\{year}\\{month}")
+def stats_text(rows):
+    """Totals of the rows and, if they span more than one week, the totals per week"""
+    total = aggregate.totals(rows)
+    if total is None:
+        return "No activities"
 
-        data = api.download_activity(id, dl_fmt=api.ActivityDownloadFormat.TCX)
+    lines = [f"Total: {aggregate.format_stats(total)}"]
+    weeks = aggregate.aggregate(rows, "week")
+    if len(weeks) > 1:
+        lines += [f"{week.period}: {aggregate.format_stats(week)}" for week in weeks]
+    return "\n".join(lines)
 
-        file_path = f"activities\\{year}\\{month}\\{day}-{id}.tcx"
 
-        if not overwrite and os.path.isfile(file_path):
-            pass
-        else:
-            with open(file_path, "wb") as fb:
-                fb.write(data)
-                output += f"{file_path}\n"
-                print(f"Downloaded activity: {file_path}")
-    
+def download_activities(api, start_date, end_date, overwrite, catalog=None, progress=None, cancel=None):
+    output = ""
+    downloaded = []
+    for result in downloader.download_activities(api, start_date, end_date, overwrite, catalog=catalog,
+                                                 progress=progress, cancel=cancel):
+        if result.downloaded:
+            output += f"{result.path}\n"
+            downloaded.append(result.path)
+            print(f"Downloaded activity: {result.path}")
+        elif result.error:
+            print(f"Failed to download activity {result.activity_id}: {result.error}")
+
+    improved, days = sync.process_downloads(downloaded, cache=ActivityCache())
+    for effort in improved:
+        output += f"New record for {effort.target:g} in {effort.path}\n"
+    if days:
+        output += f"Updated training load for {len(days)} days from {days[0]}\n"
     return output
 
 
@@ -0,0 +1,138 @@
+import datetime
+import os
+import re
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass
+
+import tcx_parser
+from compressed import is_tcx_file
+from track import Track
+
+
+ACTIVITIES_FOLDER = "activities"
+# most files a worker parses per task, and tasks in flight per worker, together they bound
+# how many parsed Tracks wait in memory for a slow consumer
+MAX_BATCH = 8
+BATCHES_PER_WORKER = 2
+# month folder names written by download_activities, spelling included
+MONTHS = ["", "January", "Febuary", "March", "April", "May", "June", "July", "August", "September", "October", "November", "December"]
+
+
+@dataclass
+class IngestResult:
+    path: str
+    track: Track = None
+    error: str = None
+
+
+def find_activity_files(folder=ACTIVITIES_FOLDER):
+    """
+    Returns the path of every TCX file under folder, compressed ones included
+    Follows the activities/<year>/<month>/<day>-<id>.tcx layout but does not depend on it
+    """
+    paths = []
+    for dirpath, dirnames, filenames in os.walk(folder):
+        dirnames.sort()
+        for filename in sorted(filenames):
+            if is_tcx_file(filename):
+                paths.append(os.path.join(dirpath, filename))
+    return paths
+
+
+def parse_activity_path(path):
+    """
+    Returns (date, activity id) from a path in the <year>/<month>/<day>-<id>.tcx layout
+    Either is None if it can't be worked out from the path
+    """
+    parts = re.split(r"[\\/]", path)
+    match = re.fullmatch(r"(\d+)-(\d+)\.tcx(\.gz|\.zst)?", parts[-1], re.IGNORECASE)
+    if not match:
+        return None, None
+
+    day, activity_id = int(match.group(1)), int(match.group(2))
+    try:
+        year, month = int(parts[-3]), MONTHS.index(parts[-2])
+        return datetime.date(year, month, day), activity_id
+    except (IndexError, ValueError):
+        return None, activity_id
+
+
+def parse_activity_file(path, cache=None, columns=None):
+    """Parse one file into an IngestResult, errors are returned instead of raised"""
+    try:
+        return IngestResult(path=path, track=tcx_parser.read_track(path, cache=cache, columns=columns))
+    except Exception as err:
+        return IngestResult(path=path, error=f"{type(err).__name__}: {err}")
+
+
+def parse_activity_files(paths, cache=None, columns=None):
+    """parse_activity_file for a batch of files, one task of the worker pool"""
+    return [parse_activity_file(path, cache, columns) for path in paths]
+
+
+def iter_archive(paths=None, folder=ACTIVITIES_FOLDER, workers=None, cache=None, columns=None):
+    """
+    Parse many TCX files across a pool of processes
+    Yields an IngestResult per file in the order of paths as soon as it is ready
+    Only BATCHES_PER_WORKER batches per worker are in flight, a new one is handed out as
+    each is consumed, so a slow consumer doesn't make parsed Tracks pile up in memory
+    Tracks come back from the workers as NumPy columns rather than lists of dicts
+    Files found in the ActivityCache, if one is given, are not parsed again
+    columns limits the Tracks to those columns, see tcx_parser.read_track
+    """
+    if paths is None:
+        paths = find_activity_files(folder)
+    if not paths:
+        return
+
+    workers = workers or os.cpu_count() or 1
+    if workers == 1:
+        for path in paths:
+            yield parse_activity_file(path, cache, columns)
+        return
+
+    # workers only add to the cache, it is trimmed to size once here when they are done
+    worker_cache = cache.deferred() if cache is not None else None
+    # hand out work in batches so small files don't spend their time on IPC
+    size = max(1, min(MAX_BATCH, len(paths) // (workers * 8)))
+    batches = (paths[i:i + size] for i in range(0, len(paths), size))
+    pending = deque()
+    try:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            try:
+                for batch in batches:
+                    pending.append(executor.submit(parse_activity_files, batch, worker_cache, columns))
+                    if len(pending) >= workers * BATCHES_PER_WORKER:
+                        break
+                while pending:
+                    results = pending.popleft().result()
+                    # keep the workers busy while the consumer works through this batch
+                    batch = next(batches, None)
+                    if batch is not None:
+                        pending.append(executor.submit(parse_activity_files, batch, worker_cache, columns))
+                    yield from results
+            finally:
+                # the consumer stopped early, don't parse what it will never ask for. This has
+                # to happen before leaving the with, which waits for every queued batch
+                for future in pending:
+                    future.cancel()
+    finally:
+        if cache is not None:
+            cache.evict()
+
+
+def load_archive(paths=None, folder=ACTIVITIES_FOLDER, workers=None, progress=None, cache=None, columns=None):
+    """
+    Parse many TCX files in parallel and return a list of IngestResult
+    progress is called as progress(done, total, result) after every file
+    """
+    if paths is None:
+        paths = find_activity_files(folder)
+
+    results = []
+    for result in iter_archive(paths, workers=workers, cache=cache, columns=columns):
+        results.append(result)
+        if progress:
+            progress(len(results), len(paths), result)
+    return results
@@ -0,0 +1,129 @@
+"""
+Lightweight timing spans and counters for the sync, parse and export paths
+
+    profiling.enable()
+    with profiling.span("parse", path=fname):
+        ...
+    profiling.count("bytes_parsed", size)
+    profiling.write_report("profile.json")
+
+Everything is off by default. While disabled span() hands back one shared do-nothing
+context manager and count() returns straight away, so instrumented code costs a
+function call and a flag check
+Only the current process is recorded, parsing done by ingest worker processes shows up
+as the parent waiting, so garmin.py --profile parses in-process unless --workers is given
+"""
+import json
+import os
+import threading
+import time
+from contextlib import nullcontext
+
+
+_NULL_SPAN = nullcontext()
+
+_enabled = False
+_lock = threading.Lock()
+_start = time.perf_counter()
+_spans = []
+_counters = {}
+
+
+def enable():
+    """Start recording, anything recorded before is dropped"""
+    global _enabled, _start
+    with _lock:
+        _spans.clear()
+        _counters.clear()
+        _start = time.perf_counter()
+    _enabled = True
+
+
+def disable():
+    global _enabled
+    _enabled = False
+
+
+def is_enabled():
+    return _enabled
+
+
+class _Span():
+
+    def __init__(self, name, args):
+        self.name = name
+        self.args = args
+
+    def __enter__(self):
+        self.begin = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        end = time.perf_counter()
+        if exc_type is not None:
+            self.args["error"] = exc_type.__name__
+        with _lock:
+            _spans.append((self.name, self.begin - _start, end - self.begin, os.getpid(),
+                           threading.get_ident(), self.args))
+        return False
+
+
+def span(name, **args):
+    """Context manager timing a block as one span, args are kept with it in the trace"""
+    if not _enabled:
+        return _NULL_SPAN
+    return _Span(name, args)
+
+
+def count(name, value=1):
+    """Add value to a counter, e.g. count("bytes_downloaded", len(data))"""
+    if not _enabled:
+        return
+    with _lock:
+        _counters[name] = _counters.get(name, 0) + value
+
+
+def summary():
+    """Per span name: calls, total, mean and max seconds, plus the counters"""
+    with _lock:
+        spans = list(_spans)
+        counters = dict(_counters)
+    totals = {}
+    for name, begin, duration, pid, tid, args in spans:
+        entry = totals.setdefault(name, {"calls": 0, "total": 0.0, "max": 0.0})
+        entry["calls"] += 1
+        entry["total"] += duration
+        entry["max"] = max(entry["max"], duration)
+    for entry in totals.values():
+        entry["mean"] = entry["total"] / entry["calls"]
+    ordered = dict(sorted(totals.items(), key=lambda item: -item[1]["total"]))
+    return {"spans": ordered, "counters": counters}
+
+
+def trace_events():
+    """The spans as Chrome trace events (chrome://tracing, Perfetto), times in microseconds"""
+    with _lock:
+        spans = list(_spans)
+    return [{"name": name, "ph": "X", "ts": begin * 1e6, "dur": duration * 1e6, "pid": pid, "tid": tid,
+             "args": {k: str(v) for k, v in args.items()}}
+            for name, begin, duration, pid, tid, args in spans]
+
+
+def write_report(path):
+    """
+    Write the summary and the trace to one JSON file
+    The file is in the Chrome trace object format, so it also opens in a trace viewer
+    """
+    report = summary()
+    report["traceEvents"] = trace_events()
+    report["displayTimeUnit"] = "ms"
+    with open(path, "w") as f:
+        json.dump(report, f, indent=1)
+
+
+def format_summary():
+    report = summary()
+    lines = [f"{name:>24}: {s['calls']:6d} calls {s['total']:9.3f}s total {s['mean'] * 1000:9.2f}ms mean"
+             for name, s in report["spans"].items()]
+    lines += [f"{name:>24}: {value}" for name, value in sorted(report["counters"].items())]
+    return "\n".join(lines)
@@ -0,0 +1,167 @@
+import datetime
+import hashlib
+import json
+import logging
+import os
+
+import best_efforts
+import downloader
+import profiling
+import training_load
+from compressed import find_existing
+from ingest import ACTIVITIES_FOLDER
+
+
+logger = logging.getLogger(__name__)
+
+MANIFEST_PATH = os.path.join(ACTIVITIES_FOLDER, "sync_manifest.json")
+LOOK_BACK_DAYS = 14
+CHUNK_DAYS = 30
+
+
+def file_sha256(path):
+    sha = hashlib.sha256()
+    with open(path, "rb") as fb:
+        for block in iter(lambda: fb.read(1024 * 1024), b""):
+            sha.update(block)
+    return sha.hexdigest()
+
+
+class SyncManifest():
+    """
+    Record of everything already synchronized: the newest activity seen and
+    the path and checksum of every downloaded file, keyed by activity id
+    Activities whose download failed are kept as pending with their start time until
+    a later sync gets them
+    """
+
+    def __init__(self, path=MANIFEST_PATH):
+        self.path = path
+        self.last_activity_id = None
+        self.last_timestamp = None
+        self.files = {}
+        self.pending = {}
+        if os.path.isfile(path):
+            with open(path) as f:
+                data = json.load(f)
+            self.last_activity_id = data.get("last_activity_id")
+            self.last_timestamp = data.get("last_timestamp")
+            self.files = data.get("files", {})
+            self.pending = data.get("pending", {})
+
+    def has(self, activity_id):
+        entry = self.files.get(str(activity_id))
+        return entry is not None and os.path.isfile(entry["path"])
+
+    def add(self, activity, path, sha256):
+        self.files[str(activity["activityId"])] = {"path": path, "sha256": sha256}
+        self.pending.pop(str(activity["activityId"]), None)
+        start_time = activity["startTimeLocal"]
+        if self.last_timestamp is None or start_time >= self.last_timestamp:
+            self.last_timestamp = start_time
+            self.last_activity_id = activity["activityId"]
+
+    def add_failed(self, activity):
+        self.pending[str(activity["activityId"])] = activity["startTimeLocal"]
+
+    def resume_date(self):
+        """Day a sync without a start date lists from, None before the first sync"""
+        times = list(self.pending.values())
+        if self.last_timestamp:
+            times.append(self.last_timestamp)
+        if not times:
+            return None
+        return datetime.date.fromisoformat(min(times).split(" ")[0])
+
+    def rename(self, old_path, new_path):
+        """Point the entry for old_path at new_path, e.g. after the file was compressed"""
+        for entry in self.files.values():
+            if entry["path"] == old_path:
+                entry["path"] = new_path
+                entry["sha256"] = file_sha256(new_path)
+
+    def save(self):
+        data = {"last_activity_id": self.last_activity_id,
+                "last_timestamp": self.last_timestamp,
+                "files": self.files,
+                "pending": self.pending}
+        downloader.write_atomic(self.path, json.dumps(data, indent=1).encode("utf-8"))
+
+    def verify(self):
+        """Returns the ids whose file is missing or no longer matches its checksum"""
+        return [activity_id for activity_id, entry in self.files.items()
+                if not os.path.isfile(entry["path"]) or file_sha256(entry["path"]) != entry["sha256"]]
+
+
+def process_downloads(paths, folder=ACTIVITIES_FOLDER, cache=None, workers=None):
+    """
+    Bring the personal records and training load kept in folder up to date with newly
+    downloaded files, the command line and the GUI both call this after a download
+    Returns (the records that were set, the dates whose training load was recomputed)
+    """
+    if not paths:
+        return [], []
+    improved = best_efforts.RecordBook(os.path.join(folder, "records.json")).update(paths, cache=cache, workers=workers)
+    days = training_load.TrainingLog(os.path.join(folder, "training.json")).update(paths, cache=cache, workers=workers)
+    return improved, days
+
+
+def date_chunks(start_date, end_date, chunk_days=CHUNK_DAYS):
+    """Split start_date to end_date (inclusive) into consecutive ranges of at most chunk_days"""
+    while start_date <= end_date:
+        chunk_end = min(end_date, start_date + datetime.timedelta(days=chunk_days - 1))
+        yield start_date, chunk_end
+        start_date = chunk_end + datetime.timedelta(days=1)
+
+
+def synchronize(api, start_date=None, end_date=None, manifest=None, catalog=None, folder=ACTIVITIES_FOLDER,
+                workers=4, chunk_days=CHUNK_DAYS, progress=None, compression=None):
+    """
+    Download only the activities that are not in the manifest yet
+    Without a start_date this picks up from the last synchronized activity, or the oldest
+    one that failed to download if that is earlier, or looks back LOOK_BACK_DAYS on the
+    first run. Long ranges are listed chunk_days at a time and the
+    manifest is saved after every chunk, so an interrupted backfill resumes where it stopped
+    Returns the DownloadResults of the activities that had to be fetched
+    """
+    manifest = manifest or SyncManifest(os.path.join(folder, "sync_manifest.json"))
+    end_date = end_date or datetime.date.today()
+    if start_date is None:
+        # the day of the last sync is listed again to catch activities added later that day
+        start_date = manifest.resume_date() or end_date - datetime.timedelta(days=LOOK_BACK_DAYS)
+
+    engine = downloader.DownloadEngine(api, folder=folder, workers=workers, compression=compression)
+    results = []
+    for chunk_start, chunk_end in date_chunks(start_date, end_date, chunk_days):
+        with profiling.span("list_activities", start=chunk_start, end=chunk_end):
+            activities = api.get_activities_by_date(chunk_start.isoformat(), chunk_end.isoformat())
+        by_id = {activity["activityId"]: activity for activity in activities}
+
+        missing = []
+        for activity in activities:
+            if manifest.has(activity["activityId"]):
+                continue
+            path = find_existing(downloader.activity_path(activity, folder))
+            if path:
+                # downloaded before there was a manifest, just record it
+                manifest.add(activity, path, file_sha256(path))
+            else:
+                missing.append(activity)
+
+        def on_result(done, total, result):
+            if result.downloaded:
+                manifest.add(by_id[result.activity_id], result.path, result.sha256)
+            elif result.error:
+                manifest.add_failed(by_id[result.activity_id])
+                if catalog is not None:
+                    try:
+                        catalog.add_file(result.path)
+                    except Exception as err:
+                        logger.error(f"Could not add {result.path} to the catalog: {err}")
+            if progress:
+                progress(done, total, result)
+
+        results.extend(engine.download(missing, progress=on_result))
+        manifest.save()
+
+    return results
@@ -0,0 +1,107 @@
+import logging
+import queue
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+
+logger = logging.getLogger(__name__)
+
+
+class Task():
+    """Handle on a job submitted to a TaskRunner"""
+
+    def __init__(self, runner, on_done=None, on_progress=None, on_error=None):
+        self.runner = runner
+        self.on_done = on_done
+        self.on_progress = on_progress
+        self.on_error = on_error
+        self.cancel_event = threading.Event()
+        self.future = None
+
+    @property
+    def cancelled(self):
+        return self.cancel_event.is_set()
+
+    def cancel(self):
+        """Ask the job to stop, a job that hasn't started yet never runs and no callback is called"""
+        self.cancel_event.set()
+        if self.future is not None:
+            self.future.cancel()
+
+    def progress(self, *args):
+        """Called from the job, on_progress(*args) is then called on the Tk thread"""
+        self.runner.queue.put((self, "progress", args))
+
+
+class TaskRunner():
+    """
+    Runs slow jobs (logins, downloads, parsing, statistics) on a thread pool so the Tk
+    main loop keeps running
+    Jobs never touch widgets, they hand progress and results to a queue that is polled
+    with after(), so every callback runs on the Tk thread
+    """
+
+    def __init__(self, root, workers=2, interval=50):
+        self.root = root
+        self.interval = interval
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="tcx-task")
+        self.queue = queue.Queue()
+        self.active = set()
+        self.polling = False
+
+    def submit(self, func, *args, on_done=None, on_progress=None, on_error=None):
+        """
+        Run func(task, *args) on a worker thread, func can call task.progress(...) and should
+        check task.cancelled now and then
+        on_done(result), on_progress(*args) and on_error(exception) are called on the Tk thread
+        Callbacks of a cancelled task are dropped
+        """
+        task = Task(self, on_done, on_progress, on_error)
+        self.active.add(task)
+        task.future = self.executor.submit(self._run, task, func, args)
+        if not self.polling:
+            self.polling = True
+            self.root.after(self.interval, self.poll)
+        return task
+
+    def _run(self, task, func, args):
+        try:
+            result = func(task, *args)
+        except Exception as err:
+            self.queue.put((task, "error", err))
+        else:
+            self.queue.put((task, "done", result))
+
+    def poll(self):
+        while True:
+            try:
+                task, kind, value = self.queue.get_nowait()
+            except queue.Empty:
+                break
+            if kind != "progress":
+                self.active.discard(task)
+            if task.cancelled:
+                continue
+            callback = {"progress": task.on_progress, "done": task.on_done, "error": task.on_error}[kind]
+            try:
+                if kind == "progress" and callback:
+                    callback(*value)
+                elif callback:
+                    callback(value)
+                elif kind == "error":
+                    logger.error(f"Background task failed: {value}")
+            except Exception:
+                # e.g. the page the callback updates was closed, keep serving the other tasks
+                logger.exception("Task callback failed")
+
+        # tasks cancelled before they started never report back
+        self.active = {task for task in self.active if not task.future.cancelled()}
+        if self.active or not self.queue.empty():
+            self.root.after(self.interval, self.poll)
+        else:
+            self.polling = False
+
+    def shutdown(self):
+        for task in list(self.active):
+            task.cancel()
+        self.executor.shutdown(wait=False, cancel_futures=True)
@@ -1,13 +1,16 @@
 import datetime
-from errno import ETIME
+import math
+import os
 import lxml.etree
-import dateutil.parser as dp
-import pandas as pd
-import matplotlib.pyplot as plt
-from mpl_toolkits.mplot3d import Axes3D
-from matplotlib.colors import Normalize
-from matplotlib import cm
-from dataclasses import dataclass
+import numpy as np
+from dataclasses import dataclass, asdict
+from functools import cached_property
+
+import profiling
+from compressed import open_tcx
+from downsample import axes_pixel_width, downsample
+from timestamps import parse_time
+from track import COLUMN_TYPES, TRACK_COLUMNS, TimeIndex, TrackBuilder, column_types, register_column
 
 NAMESPACES = {
     'ns': 'http://www.garmin.com/xmlschemas/TrainingCenterDatabase/v2',
@@ -17,6 +20,90 @@ NAMESPACES = {
     'ns5': 'http://www.garmin.com/xmlschemas/ActivityGoals/v1'
 }
 
+ACTIVITY_TAG = '{%s}Activity' % NAMESPACES['ns']
+ID_TAG = '{%s}Id' % NAMESPACES['ns']
+LAP_TAG = '{%s}Lap' % NAMESPACES['ns']
+TRACKPOINT_TAG = '{%s}Trackpoint' % NAMESPACES['ns']
+
+
+def _tag(prefix, name):
+    return '{%s}%s' % (NAMESPACES[prefix], name)
+
+
+@dataclass
+class PointField:
+    """Where a Trackpoint field lives and how it is returned by get_all_data_points"""
+    tags: tuple
+    key: str
+    integer: bool = False
+
+
+def _path(path):
+    """'ns:Extensions/ns3:TPX/ns3:Watts' -> tuple of Clark notation tags"""
+    return tuple(_tag(*step.split(':')) for step in path.split('/'))
+
+
+# Trackpoint fields by Track column name, paths are relative to the Trackpoint element
+POINT_FIELDS = {
+    'time': PointField(_path('ns:Time'), 'time'),
+    'distance': PointField(_path('ns:DistanceMeters'), 'distance'),
+    'heartrate': PointField(_path('ns:HeartRateBpm/ns:Value'), 'heart_rate', integer=True),
+    'speed': PointField(_path('ns:Extensions/ns3:TPX/ns3:Speed'), 'speed'),
+    'altitude': PointField(_path('ns:AltitudeMeters'), 'elevation'),
+    'latitude': PointField(_path('ns:Position/ns:LatitudeDegrees'), 'latitude'),
+    'longitude': PointField(_path('ns:Position/ns:LongitudeDegrees'), 'longitude'),
+    'cadence': PointField(_path('ns:Cadence'), 'cadence', integer=True),
+}
+
+# the columns get_all_data_points returns when none are asked for
+DICT_COLUMNS = ('time', 'altitude', 'heartrate', 'cadence', 'speed', 'distance')
+# the columns Activity.plot and Activity.graph_map draw
+PLOT_COLUMNS = ('time', 'speed', 'heartrate', 'altitude')
+MAP_COLUMNS = ('longitude', 'latitude', 'altitude', 'speed')
+
+_field_trees = {}
+
+
+def register_field(name, path, key=None, integer=False):
+    """
+    Make another Trackpoint field available as a Track column, e.g.
+        register_field('power', 'ns:Extensions/ns3:TPX/ns3:Watts', integer=True)
+    path uses the prefixes in NAMESPACES, key is the name used by get_all_data_points
+    Registered fields are only parsed when asked for with columns=, register them at import
+    time so the ingest worker processes know them too
+    """
+    POINT_FIELDS[name] = PointField(_path(path), key or name, integer)
+    register_column(name)
+    _field_trees.clear()
+
+
+register_field('run_cadence', 'ns:Extensions/ns3:TPX/ns3:RunCadence', integer=True)
+register_field('watts', 'ns:Extensions/ns3:TPX/ns3:Watts', integer=True)
+
+
+def field_tree(columns=None):
+    """
+    The fields for columns as nested {tag: column name or subtree}, the form extract_point
+    walks. A point's children are matched against it once instead of running a find() per
+    field, and elements no column needs are never descended into
+    None means the default TRACK_COLUMNS. time is always in the tree, even when it isn't
+    one of the columns, since Trackpoints without a Time are skipped
+    """
+    key = tuple(columns) if columns is not None else None
+    tree = _field_trees.get(key)
+    if tree is None:
+        tree = {}
+        for name in ['time'] + list(column_types(columns)):
+            if name == 'lap':
+                continue
+            node = tree
+            *parents, leaf = POINT_FIELDS[name].tags
+            for tag in parents:
+                node = node.setdefault(tag, {})
+            node[leaf] = name
+        _field_trees[key] = tree
+    return tree
+
 @dataclass
 class TotalStats:
     total_time: float
@@ -46,166 +133,194 @@ class PointStats:
     latitude: float
     longitude: float
 
+@dataclass
+class ActivitySummary:
+    sport: str
+    start_time: datetime.datetime
+    laps: list
+    totals: TotalStats
+
 
 class Activity():
+    """
+    A parsed TCX activity
+    Nothing is read until one of the properties is first accessed and every
+    property is only computed once
+    columns limits the Track to those columns (see read_track)
+    """
 
-    def __init__(self, fname):
-        tree = lxml.etree.parse(fname)
-        root = tree.getroot()
-        activity = root.find('ns:Activities', NAMESPACES)[0]
-        laps = []
-        self.points = []
-        lap_num = 0
-        for lap in activity.findall('ns:Lap', NAMESPACES):
-            
-            # set stats for lap
-            total_time = lap.find('ns:TotalTimeSeconds', NAMESPACES).text
-            distance = lap.find('ns:DistanceMeters', NAMESPACES).text
-            max_speed = lap.find('ns:MaximumSpeed', NAMESPACES).text
-            average_heartrate = lap.find('ns:AverageHeartRateBpm', NAMESPACES).find('ns:Value', NAMESPACES).text
-            max_heartrate = lap.find('ns:MaximumHeartRateBpm', NAMESPACES).find('ns:Value', NAMESPACES).text
-            calories = lap.find('ns:Calories', NAMESPACES).text
-
-
-            lap_stats = LapStats(total_time=float(total_time),
-                          distance=float(distance),
-                          max_speed=float(max_speed),
-                          average_heartrate=int(average_heartrate),
-                          max_heartrate=int(max_heartrate),
-                          calories=int(calories))
-
-            laps.append(lap_stats)
-
-            # set stats for points in lap
-            track = lap.find('ns:Track', NAMESPACES) 
-            for point in track.findall('ns:Trackpoint', NAMESPACES):
-                time =  dp.parse(point.find('ns:Time', NAMESPACES).text)
-                distance = point.find('ns:DistanceMeters', NAMESPACES).text
-                heartrate = point.find('ns:HeartRateBpm', NAMESPACES).find('ns:Value', NAMESPACES).text
-                speed = point.find('ns:Extensions', NAMESPACES).find('ns3:TPX', NAMESPACES).find('ns3:Speed', NAMESPACES).text
-                altitude = point.find('ns:AltitudeMeters', NAMESPACES).text
-                latitude = point.find('ns:Position', NAMESPACES).find('ns:LatitudeDegrees', NAMESPACES).text
-                longitude = point.find('ns:Position', NAMESPACES).find('ns:LongitudeDegrees', NAMESPACES).text
-                point_stats = PointStats(lap=lap_num,
-                                         time=time,
-                                         distance=float(distance),
-                                         heartrate=int(heartrate),
-                                         speed=float(speed),
-                                         altitude=float(altitude),
-                                         latitude=float(latitude),
-                                         longitude=float(longitude))
-                self.points.append(point_stats)
-    
-            lap_num += 1
-        
+    def __init__(self, fname, cache=None, columns=None):
+        self.fname = fname
+        self.cache = cache
+        self.columns = columns
+
+    @cached_property
+    def track(self):
+        return read_track(self.fname, cache=self.cache, columns=self.columns)
+
+    @property
+    def laps(self):
+        return self.track.laps
+
+    @cached_property
+    def points(self):
+        return self.track.to_points()
+
+    @cached_property
+    def totals(self):
+        return self.get_total_stats(self.laps)
+
+    # pandas and matplotlib are only imported when a DataFrame or a plot is asked for,
+    # so parsing and syncing don't pay for them at startup
+
+    @cached_property
+    def laps_df(self):
+        import pandas as pd
+        return pd.DataFrame([asdict(lap) for lap in self.laps], columns=list(LapStats.__dataclass_fields__))
+
+    @cached_property
+    def points_df(self):
+        return self.track.to_dataframe()[[name for name in PointStats.__dataclass_fields__ if name in self.track]]
+
+    @cached_property
+    def total_df(self):
+        import pandas as pd
+        return pd.DataFrame([asdict(self.totals)])
+
+    def to_excel(self, folder="."):
+        """Write laps.xlsx, points.xlsx and total.xlsx to folder"""
+        self._require_columns(('time',), "to_excel")
+        points_df_excel = self.points_df.assign(time=self.points_df['time'].dt.strftime('%Y-%m-%d %H:%M:%S'))
+
+        with profiling.span("excel_write", file="laps.xlsx"):
+            self.laps_df.to_excel(os.path.join(folder, "laps.xlsx"))
+        with profiling.span("excel_write", file="points.xlsx"):
+            points_df_excel.to_excel(os.path.join(folder, "points.xlsx"))
+        with profiling.span("excel_write", file="total.xlsx"):
+            self.total_df.to_excel(os.path.join(folder, "total.xlsx"))
+
+    def _require_columns(self, names, method):
+        """ValueError before anything is parsed if the Activity was read without names"""
+        if self.columns is None:
+            return
+        missing = [name for name in names if name not in self.columns]
+        if missing:
+            raise ValueError(f"{method} needs the {missing} columns, the Activity was read with "
+                             f"columns={list(self.columns)}")
+
+    def plot(self, show=True, full_resolution=False):
+        """
+        Plot speed, heart rate and altitude over time
+        Each series is reduced to about two points per pixel of its subplot with
+        min/max bucketing so peaks stay visible, unless full_resolution is set
+        """
+        self._require_columns(PLOT_COLUMNS, "plot")
+        import matplotlib.pyplot as plt
 
-        total_stats = self.get_total_stats(laps)
-
-        # create dataframes
-        laps_data = [{field.name: getattr(lap, field.name) for field in LapStats.__dataclass_fields__.values()} for lap in laps]
-        total_data = [{field.name: getattr(total_stats, field.name) for field in TotalStats.__dataclass_fields__.values()}]
-        #points_data = [{field.name: getattr(point, field.name) for field in PointStats.__dataclass_fields__.values()} for point in points]
-        points_data_excel = [{**{field.name: getattr(point, field.name) for field in PointStats.__dataclass_fields__.values()}, 'time': point.time.strftime('%Y-%m-%d %H:%M:%S')} for point in self.points]
-        points_data = [{field.name: getattr(point, field.name) for field in PointStats.__dataclass_fields__.values()} for point in self.points]
-        laps_df = pd.DataFrame(laps_data)
-        points_df = pd.DataFrame(points_data)
-        points_df_excel = pd.DataFrame(points_data_excel)
-        total_df = pd.DataFrame(total_data)
-        #total_df.index = ['Totals']
-       # laps_df = laps_df.append(total_df)  # Append total_df to laps_df
-        #laps_df.index.name = None
-
-
-        laps_df.to_excel("laps.xlsx")
-        points_df_excel.to_excel("points.xlsx")
-        total_df.to_excel("total.xlsx")
-
-        time = points_df['time']
-        speed = points_df['speed']
-        heartrate = points_df['heartrate']
-        altitude = points_df['altitude']
-
-        # Step 2: Create a figure and axis objects
         fig, axs = plt.subplots(3, 1, figsize=(10, 8))
 
-        # Step 3: Plot the data
-        axs[0].fill_between(time, speed, color="skyblue", alpha=0.4)
-        axs[0].plot(time, speed, color="Slateblue", alpha=0.6)
+        time = self.track.time
+        series = []
+        for ax, name in zip(axs, ('speed', 'heartrate', 'altitude')):
+            values = self.track[name]
+            if not full_resolution:
+                time_ds, values = downsample(time, values, 2 * axes_pixel_width(ax))
+            else:
+                time_ds = time
+            series.append((time_ds, values))
+        (speed_time, speed), (heartrate_time, heartrate), (altitude_time, altitude) = series
+
+        axs[0].fill_between(speed_time, speed, color="skyblue", alpha=0.4)
+        axs[0].plot(speed_time, speed, color="Slateblue", alpha=0.6)
         axs[0].set_title('Speed')
         axs[0].set_xlabel('Time')
         axs[0].set_ylabel('Speed')
 
-        axs[1].fill_between(time, heartrate, color="lightgreen", alpha=0.4)
-        axs[1].plot(time, heartrate, color="forestgreen", alpha=0.6)
+        axs[1].fill_between(heartrate_time, heartrate, color="lightgreen", alpha=0.4)
+        axs[1].plot(heartrate_time, heartrate, color="forestgreen", alpha=0.6)
         axs[1].set_title('Heart Rate')
         axs[1].set_xlabel('Time')
         axs[1].set_ylabel('Heart Rate')
 
-        axs[2].fill_between(time, altitude, color="lightcoral", alpha=0.4)
-        axs[2].plot(time, altitude, color="maroon", alpha=0.6)
+        axs[2].fill_between(altitude_time, altitude, color="lightcoral", alpha=0.4)
+        axs[2].plot(altitude_time, altitude, color="maroon", alpha=0.6)
         axs[2].set_title('Altitude')
         axs[2].set_xlabel('Time')
         axs[2].set_ylabel('Altitude')
 
-        # Step 4: Show the plot
         plt.tight_layout()
-        plt.show()
-
-        #plt.plot(points_df['time'], points_df['heartrate'])
-
-        #plt.show()
-
-
-    def graph_map(self):
-        xyz = []
-        for p in self.points:
-            xyz.append([p.longitude, p.latitude, p.altitude, p.speed])
-        
-        # Extracting x, y, z coordinates
-        x_coords, y_coords, z_coords, speeds = zip(*xyz)
+        if show:
+            plt.show()
+        return fig
+
+    def graph_map(self, max_points=None, show=True):
+        """
+        3D plot of the route colored by speed
+        max_points keeps only every n-th point of very long tracks
+        """
+        self._require_columns(MAP_COLUMNS, "graph_map")
+        import matplotlib.pyplot as plt
+        from matplotlib import cm
+        from matplotlib.colors import Normalize
+        from mpl_toolkits.mplot3d.art3d import Line3DCollection
+
+        track = self.track
+        has_position = ~(np.isnan(track.longitude) | np.isnan(track.latitude) | np.isnan(track.altitude))
+        if not has_position.any():
+            # indoor and treadmill activities are recorded without GPS
+            raise ValueError(f"{self.fname} has no points with a position to map")
+        x_coords = track.longitude[has_position]
+        y_coords = track.latitude[has_position]
+        z_coords = track.altitude[has_position]
+        speeds = track.speed[has_position]
+
+        if max_points and len(x_coords) > max_points:
+            step = math.ceil(len(x_coords) / max_points)
+            keep = np.append(np.arange(0, len(x_coords) - 1, step), len(x_coords) - 1)
+            x_coords, y_coords, z_coords, speeds = x_coords[keep], y_coords[keep], z_coords[keep], speeds[keep]
 
         # Plotting
         fig = plt.figure()
         ax = fig.add_subplot(111, projection='3d')
 
-        # Plot each point with varying colors based on speed
-        norm = Normalize(vmin=min(speeds), vmax=max(speeds))
+        # All points in one scatter colored by speed
+        norm = Normalize(vmin=np.nanmin(speeds), vmax=np.nanmax(speeds))
         cmap = cm.plasma
-        for x, y, z, speed in zip(x_coords, y_coords, z_coords, speeds):
-            color = cmap(norm(speed))
-            ax.scatter(x, y, z, color=color)
-
-        # Connecting points with lines with varying colors based on speed
-        for i in range(len(xyz) - 1):
-            start_point = xyz[i]
-            end_point = xyz[i+1]
-            speed = start_point[3]
-            color = cmap(norm(speed))
-            ax.plot([start_point[0], end_point[0]], 
-                    [start_point[1], end_point[1]], 
-                    [start_point[2], end_point[2]], 
-                    color=color)
+        ax.scatter(x_coords, y_coords, z_coords, c=speeds, cmap=cmap, norm=norm, depthshade=False)
+
+        # One collection for every segment, each colored by the speed at its start
+        xyz = np.column_stack((x_coords, y_coords, z_coords))
+        segments = np.stack((xyz[:-1], xyz[1:]), axis=1)
+        lines = Line3DCollection(segments, colors=cmap(norm(speeds[:-1])))
+        ax.add_collection3d(lines)
 
         # Adding labels
         ax.set_xlabel('X Label')
         ax.set_ylabel('Y Label')
         ax.set_zlabel('Z Label')
 
-        z_min = min(z_coords)
-        z_max = max(z_coords)
+        z_min = np.min(z_coords)
+        z_max = np.max(z_coords)
         ax.set_zlim(z_min - 50, z_max + 50)
 
         ax.view_init(elev=90, azim=0)
-        plt.show()
-
-    def get_total_stats(self, laps):
+        if show:
+            plt.show()
+        return fig
+
+    @staticmethod
+    def get_total_stats(laps):
+        """
+        Totals over the laps, the average heart rate is weighted by lap time and laps
+        without a heart rate are left out of it, it is NaN if no lap has one
+        """
         total_time = 0
         distance = 0
         calories = 0
         max_speed = 0
-        max_heartrate = 0
+        max_heartrate = math.nan
+        heartrate_time = 0
         total_heartrate = 0
-        average_heartrate = 0
         
         for lap in laps:
             total_time += lap.total_time
@@ -213,12 +328,13 @@ class Activity():
             calories += lap.calories
             if(lap.max_speed > max_speed): 
                 max_speed = lap.max_speed
-            if(lap.max_heartrate > max_heartrate):
+            if not math.isnan(lap.max_heartrate) and (math.isnan(max_heartrate) or lap.max_heartrate > max_heartrate):
                 max_heartrate = lap.max_heartrate
-        
-            total_heartrate += (lap.average_heartrate * lap.total_time)
+            if not math.isnan(lap.average_heartrate):
+                heartrate_time += lap.total_time
+                total_heartrate += (lap.average_heartrate * lap.total_time)
 
-        average_heartrate = total_heartrate / total_time
+        average_heartrate = total_heartrate / heartrate_time if heartrate_time else math.nan
 
         total_stats = TotalStats(total_time=total_time,
                                     distance=distance,
@@ -236,70 +352,246 @@ class Activity():
 
 
 def get_average_heartrate(fname: str):
-    tree = lxml.etree.parse(fname)
-    root = tree.getroot()
-    activity = root.find('ns:Activities', NAMESPACES)[0]
-    for lap in activity.findall('ns:Lap', NAMESPACES):
-        hr = lap.find('ns:AverageHeartRateBpm', NAMESPACES)
-        hr2 = hr.find('ns:Value', NAMESPACES)
-    return hr2.text
+    """Average heart rate of the last Lap as text, None if it has no heart rate"""
+    heartrate = None
+    # Trackpoints are streamed too, only so they are freed as they go
+    for elem in iter_elements(fname):
+        if elem.tag == LAP_TAG:
+            heartrate = elem.findtext('ns:AverageHeartRateBpm/ns:Value', None, NAMESPACES)
+    return heartrate
 
 
 
-def get_tcx_point_data(point: lxml.etree._Element):
+def get_tcx_point_data(point: lxml.etree._Element, columns=DICT_COLUMNS):
     """
     Get data from a Trackpoint XML element
-    Return it as a dictionary
+    Return it as a dictionary, fields the point doesn't have are left out
+    Returns None for a point without a Time
     """
-    
+    values = extract_point(point, field_tree(columns))
+    if 'time' not in values:
+        return None
     data = {}
-    
-    time_str = point.find('ns:Time', NAMESPACES).text
-    data['time'] = dp.parse(time_str)
-        
-    elevation_elem = point.find('ns:AltitudeMeters', NAMESPACES)
-    if elevation_elem is not None:
-        data['elevation'] = float(elevation_elem.text)
-    
-    hr_elem = point.find('ns:HeartRateBpm', NAMESPACES)
-    if hr_elem is not None:
-        data['heart_rate'] = int(hr_elem.find('ns:Value', NAMESPACES).text)
-        
-    cad_elem = point.find('ns:Cadence', NAMESPACES)
-    if cad_elem is not None:
-        data['cadence'] = int(cad_elem.text)
-    
-    speed_elem = point.find('.//ns3:Speed', NAMESPACES)
-    if speed_elem is not None:
-        data['speed'] = float(speed_elem.text)
-
-    distance_elem = point.find('ns:DistanceMeters', NAMESPACES)
-    if distance_elem is not None:
-        data['distance'] = float(distance_elem.text)
-    
+    for name, text in values.items():
+        if name == 'time':
+            if 'time' in columns:
+                data['time'] = parse_time(text)
+        else:
+            field = POINT_FIELDS[name]
+            data[field.key] = int(text) if field.integer else float(text)
     return data
-    
 
-def get_all_data_points(fname: str):
+
+def extract_point(point: lxml.etree._Element, fields=None, values=None):
+    """
+    Text of the fields of a Trackpoint in a single walk over its children
+    Each child's tag is looked up in fields (a field_tree, by default of every TRACK_COLUMNS
+    field), containers such as Position are descended into and everything else is skipped
+    without being looked at
+    Returns {column name: text}, fields the point doesn't have are not in it
+    """
+    if fields is None:
+        fields = field_tree()
+    if values is None:
+        values = {}
+    for child in point:
+        entry = fields.get(child.tag)
+        if entry is None:
+            continue
+        if isinstance(entry, dict):
+            extract_point(child, entry, values)
+        elif child.text is not None:
+            values[entry] = child.text
+    return values
+
+
+def get_all_data_points(fname: str, cache=None, columns=None):
     """
     Takes a string of the path to a TCX file and returns a list of dictionaries
     Where each dictionary is a Trackpoint
+    columns limits the fields to those Track columns, by default DICT_COLUMNS
+    If an ActivityCache is given the points are built from the cached Track
     """  
-    tree = lxml.etree.parse(fname)
-    root = tree.getroot()
-    activity = root.find('ns:Activities', NAMESPACES)[0]
-    points_data = []
+    if cache is not None:
+        return read_track(fname, cache=cache, columns=columns or DICT_COLUMNS).to_dicts(columns)
+    return list(iter_trackpoints(fname, columns))
+
+
+def iter_elements(fname, tags=(LAP_TAG, TRACKPOINT_TAG)):
+    """
+    Stream the first Activity of a TCX file with iterparse and yield each
+    element in tags once it has been fully read. Elements are cleared after
+    they are handed out, along with anything before them, so memory use stays
+    flat no matter how big the file is
+    .tcx.gz and .tcx.zst files are decompressed on the fly
+    """
+    source = open_tcx(fname)
+    try:
+        context = lxml.etree.iterparse(source, events=('end',), tag=tags + (ACTIVITY_TAG,), huge_tree=True)
+        for _, elem in context:
+            if elem.tag == ACTIVITY_TAG:
+                # only the first Activity is read, same as the tree based parsers
+                return
+            yield elem
+            elem.clear(keep_tail=True)
+            while elem.getprevious() is not None:
+                del elem.getparent()[0]
+    finally:
+        if source is not fname:
+            source.close()
+
+
+def iter_trackpoints(fname: str, columns=None):
+    """
+    Streaming version of get_all_data_points
+    Yields the same Trackpoint dictionaries one at a time
+    """
+    columns = columns or DICT_COLUMNS
+    # fail on unknown columns before the file is opened
+    field_tree(columns)
     lap_no = 1
-    for lap in activity.findall('ns:Lap', NAMESPACES):
-        track = lap.find('ns:Track', NAMESPACES) 
-        for point in track.findall('ns:Trackpoint', NAMESPACES):
-            single_point_data = get_tcx_point_data(point)
-            if single_point_data:
-                single_point_data['lap'] = lap_no
-                points_data.append(single_point_data)
-        lap_no += 1
-    
-    return points_data
+    for elem in iter_elements(fname):
+        if elem.tag == LAP_TAG:
+            lap_no += 1
+            continue
+        single_point_data = get_tcx_point_data(elem, columns)
+        if single_point_data:
+            single_point_data['lap'] = lap_no
+            yield single_point_data
+
+
+def iter_activity(fname: str):
+    """
+    Streams a TCX file and yields a PointStats for every Trackpoint with a Time
+    followed by a LapStats once the Lap holding them has been read
+    """
+    lap_num = 0
+    for elem in iter_elements(fname):
+        if elem.tag == LAP_TAG:
+            yield get_lap_stats(elem)
+            lap_num += 1
+        else:
+            point = get_point_stats(elem, lap_num)
+            if point is not None:
+                yield point
+
+
+def read_track(fname: str, cache=None, columns=None):
+    """
+    Parse a TCX file straight into a columnar Track in a single streaming pass
+    The lap summaries are kept on the Track as a list of LapStats
+    columns limits the Track to those columns plus lap, the elements of the other fields
+    are skipped without being decoded. None means TRACK_COLUMNS, registered fields such
+    as run_cadence and watts are only read when asked for
+    If an ActivityCache is given only the columns asked for are loaded from it. Files are
+    always cached with at least TRACK_COLUMNS, so one narrow read doesn't leave an entry
+    other callers have to parse again, and an entry missing a registered column is
+    parsed again with the columns of both
+    """
+    if cache is not None:
+        wanted = list(columns) if columns is not None else list(TRACK_COLUMNS)
+        track = cache.get(fname, wanted)
+        if track is None or not all(name in track for name in wanted):
+            cached = track.column_names if track is not None else TRACK_COLUMNS
+            track = read_track(fname, columns=[name for name in COLUMN_TYPES
+                                               if name in wanted or name in cached or name in TRACK_COLUMNS])
+            cache.put(fname, track)
+        return track.select(wanted)
+
+    types = column_types(columns)
+    fields = field_tree(columns)
+    with profiling.span("parse", file=fname):
+        builder = TrackBuilder(types)
+        laps = []
+        for elem in iter_elements(fname):
+            if elem.tag == LAP_TAG:
+                laps.append(get_lap_stats(elem))
+            else:
+                values = get_point_columns(elem, len(laps), fields)
+                if values is not None:
+                    builder.append(**values)
+        track = builder.build(laps)
+    if profiling.is_enabled():
+        profiling.count("points_parsed", len(track))
+        if isinstance(fname, (str, os.PathLike)):
+            profiling.count("bytes_parsed", os.path.getsize(fname))
+    return track
+
+
+def get_point_columns(point: lxml.etree._Element, lap_num: int, fields=None):
+    """
+    Get the Track column values from a Trackpoint XML element
+    fields is the field_tree of the columns to read, by default TRACK_COLUMNS
+    Missing values are left out, the TrackBuilder stores them as NaN
+    Returns None for a point without a Time
+    """
+    values = extract_point(point, fields)
+    if 'time' not in values:
+        return None
+    for name, text in values.items():
+        if name != 'time':
+            values[name] = float(text)
+    values['lap'] = lap_num
+    return values
+
+
+def read_summary(fname: str):
+    """
+    Read only what is needed to summarize an activity: sport, start time and laps
+    Trackpoints are not decoded, so this is much cheaper than read_track
+    """
+    sport = None
+    start_time = None
+    laps = []
+    with profiling.span("summarize", file=fname):
+        # Trackpoints are asked for only so iter_elements frees them as they stream
+        for elem in iter_elements(fname, tags=(ID_TAG, LAP_TAG, TRACKPOINT_TAG)):
+            if elem.tag == TRACKPOINT_TAG:
+                continue
+            if elem.tag == LAP_TAG:
+                laps.append(get_lap_stats(elem))
+            elif start_time is None:
+                sport = elem.getparent().get('Sport')
+                start_time = parse_time(elem.text)
+
+    totals = Activity.get_total_stats(laps) if laps else None
+    return ActivitySummary(sport=sport, start_time=start_time, laps=laps, totals=totals)
+
+
+def get_lap_stats(lap: lxml.etree._Element):
+    """Get the summary stats from a Lap XML element"""
+    total_time = lap.find('ns:TotalTimeSeconds', NAMESPACES).text
+    distance = lap.find('ns:DistanceMeters', NAMESPACES).text
+    max_speed = lap.find('ns:MaximumSpeed', NAMESPACES).text
+    # laps recorded without a heart rate monitor have no heart rate, it is NaN then
+    average_heartrate = lap.findtext('ns:AverageHeartRateBpm/ns:Value', None, NAMESPACES)
+    max_heartrate = lap.findtext('ns:MaximumHeartRateBpm/ns:Value', None, NAMESPACES)
+    calories = lap.find('ns:Calories', NAMESPACES).text
+
+    return LapStats(total_time=float(total_time),
+                    distance=float(distance),
+                    max_speed=float(max_speed),
+                    average_heartrate=int(average_heartrate) if average_heartrate is not None else math.nan,
+                    max_heartrate=int(max_heartrate) if max_heartrate is not None else math.nan,
+                    calories=int(calories))
+
+
+def get_point_stats(point: lxml.etree._Element, lap_num: int):
+    """
+    Get the PointStats from a Trackpoint XML element, missing values are NaN
+    Returns None for a point without a Time
+    """
+    fields = extract_point(point)
+    if 'time' not in fields:
+        return None
+    return PointStats(lap=lap_num,
+                      time=parse_time(fields['time']),
+                      distance=float(fields.get('distance', math.nan)),
+                      heartrate=int(fields['heartrate']) if 'heartrate' in fields else math.nan,
+                      speed=float(fields.get('speed', math.nan)),
+                      altitude=float(fields.get('altitude', math.nan)),
+                      latitude=float(fields.get('latitude', math.nan)),
+                      longitude=float(fields.get('longitude', math.nan)))
 
 
 def get_total_time(points_data):
@@ -316,16 +608,21 @@ def create_list_of_point_times(points_data):
     return times
 
 
-def search_point_time(points_data):
-    times = create_list_of_point_times(points_data) #datetime.time(12, 29, 22), datetime.time(12, 29, 24)
-    #print(times)
-    search_closest_time(times, datetime.time(21, 55, 29))
-    #print(times[6])
-    #print(times[7])
-
-    #print(get_time_difference(times[6], times[7]))
-
-    #print(times[6] - times[7])
+def search_point_time(points_data, to_find=datetime.time(21, 55, 29)):
+    """
+    Find the point closest to to_find, which can be a datetime or a time of day
+    A time of day is looked up on the day the activity started, or the day
+    after if that is before the start, so activities past midnight work
+    Returns (index, offset in seconds)
+    """
+    index = TimeIndex([point["time"] for point in points_data])
+    if isinstance(to_find, datetime.time):
+        start = points_data[0]["time"]
+        candidate = datetime.datetime.combine(start.date(), to_find, tzinfo=start.tzinfo)
+        if candidate < start:
+            candidate += datetime.timedelta(days=1)
+        to_find = candidate
+    return index.nearest(to_find)
 
 
 def get_time_difference(time1, time2):
@@ -336,28 +633,11 @@ def get_time_difference(time1, time2):
 
 
 def search_closest_time(v, to_find):
-    lo = 0
-    hi = len(v) - 1
-    closest = 9999#get_time_difference(v[mid], to_find)
-    closestIndex = None
-    #closestIndex = mid
- 
-    # This below check covers all cases , so need to check
-    # for mid=lo-(hi-lo)/2
-    while hi - lo > 0:
-        mid = (hi + lo) // 2
-        difference = get_time_difference(v[mid], to_find)
-        if difference < closest:
-            closest = difference
-            closestIndex = mid
-        if v[mid] < to_find:
-            lo = mid + 1
-        else:
-            hi = mid
- 
-    if v[lo] == to_find:
-        print("Found At Index", lo)
-    elif v[hi] == to_find:
-        print("Found At Index", hi)
-    else:
-        print("Not Found. Closest Index", closestIndex, closest)
+    """
+    Find the datetime.time in the sorted list v closest to to_find
+    Returns (index, difference in seconds)
+    """
+    seconds = np.array([t.hour * 3600 + t.minute * 60 + t.second + t.microsecond / 1e6 for t in v])
+    target = to_find.hour * 3600 + to_find.minute * 60 + to_find.second + to_find.microsecond / 1e6
+    index, offset = TimeIndex((seconds * 1e9).astype('int64')).nearest(int(target * 1e9))
+    return index, abs(offset)
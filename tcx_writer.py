@@ -0,0 +1,363 @@
+"""
+Streaming TCX writer to trim an activity to a time range, split it in two at a time or a
+lap and merge consecutive recordings into one activity
+
+    tcx_writer.trim_activity("run.tcx", "run_trimmed.tcx", start="2024-01-05T21:55:00Z")
+    tcx_writer.split_activity("run.tcx", "run_1.tcx", "run_2.tcx", lap=3)
+    tcx_writer.merge_activities(["part1.tcx", "part2.tcx"], "run.tcx")
+
+Every input is streamed twice with iterparse. The first pass works out which Trackpoints
+are kept and the lap totals, which come before the points in a Lap, the second copies the
+kept points to an lxml.etree.xmlfile as they are read. Neither pass holds more than one
+Trackpoint, so files of hundreds of MB never have to be in memory
+Laps kept whole are copied unchanged, laps that lose points get their time, distance,
+speed, heart rate and calories recomputed. Distances start from 0 in the output and carry
+on across merged recordings
+"""
+import copy
+import math
+from contextlib import ExitStack
+from dataclasses import dataclass, field
+
+import lxml.etree
+
+from compressed import write_tcx
+from tcx_parser import ACTIVITY_TAG, ID_TAG, LAP_TAG, NAMESPACES, TRACKPOINT_TAG, extract_point, field_tree, iter_elements
+from timestamps import time_ns
+from track import to_ns
+
+
+XSI = 'http://www.w3.org/2001/XMLSchema-instance'
+SCHEMA_LOCATION = ('http://www.garmin.com/xmlschemas/TrainingCenterDatabase/v2 '
+                   'http://www.garmin.com/xmlschemas/TrainingCenterDatabasev2.xsd')
+NSMAP = {None: NAMESPACES['ns'], 'ns2': NAMESPACES['ns2'], 'ns3': NAMESPACES['ns3'],
+         'ns4': NAMESPACES['ns4'], 'ns5': NAMESPACES['ns5'], 'xsi': XSI}
+
+DATABASE_TAG = '{%s}TrainingCenterDatabase' % NAMESPACES['ns']
+ACTIVITIES_TAG = '{%s}Activities' % NAMESPACES['ns']
+TRACK_TAG = '{%s}Track' % NAMESPACES['ns']
+CREATOR_TAG = '{%s}Creator' % NAMESPACES['ns']
+DISTANCE_TAG = '{%s}DistanceMeters' % NAMESPACES['ns']
+
+# the Trackpoint fields the lap totals are worked out from
+TOTAL_FIELDS = field_tree(('time', 'distance', 'heartrate', 'speed'))
+
+
+@dataclass
+class Segment:
+    """
+    The part of a TCX file to write: the points from start (inclusive) to end (exclusive)
+    in the laps from first_lap to end_lap (exclusive, counted from 0)
+    Times are nanoseconds since the epoch, None means no limit
+    """
+    path: str
+    start: int = None
+    end: int = None
+    first_lap: int = 0
+    end_lap: int = None
+
+    def keeps(self, lap_num, time):
+        return (lap_num >= self.first_lap and (self.end_lap is None or lap_num < self.end_lap)
+                and (self.start is None or time >= self.start) and (self.end is None or time < self.end))
+
+
+@dataclass
+class LapPlan:
+    """One Lap of the input with points to write, as found by the first pass"""
+    index: int
+    points: int = 0
+    kept: int = 0
+    start_time: str = None
+    first_time: str = None
+    # the time and distance the lap starts from: the point before its first kept one, or
+    # the start of the recording, so the parts of a split lap add up to the whole
+    base_ns: int = None
+    last_ns: int = None
+    base_distance: float = 0.0
+    last_distance: float = math.nan
+    max_speed: float = math.nan
+    heartrate_sum: int = 0
+    heartrate_count: int = 0
+    max_heartrate: int = 0
+    # copies of the Lap's children before and after its Track
+    summary: list = field(default_factory=list)
+    trailer: list = field(default_factory=list)
+
+    @property
+    def whole(self):
+        return self.kept == self.points
+
+
+@dataclass
+class SegmentPlan:
+    """What the second pass writes for a Segment"""
+    segment: Segment
+    sport: str = None
+    activity_id: str = None
+    creator: lxml.etree._Element = None
+    laps: list = field(default_factory=list)
+    points: int = 0
+    # whether points before the first kept one were dropped
+    cut_start: bool = False
+    # distance of the last point before the first kept one (0 at the start of the
+    # recording), the output's distances start from it
+    base_distance: float = 0.0
+    last_distance: float = math.nan
+
+    @property
+    def first_time(self):
+        return self.laps[0].first_time if self.laps else None
+
+
+def scan(segment):
+    """First pass over a file, returns the SegmentPlan of what write_activity writes for it"""
+    plan = SegmentPlan(segment)
+    lap = LapPlan(0)
+    seen = 0
+    previous_ns = None
+    previous_distance = 0.0
+    for elem in iter_elements(segment.path, tags=(ID_TAG, LAP_TAG, TRACKPOINT_TAG, CREATOR_TAG)):
+        if elem.tag == TRACKPOINT_TAG:
+            values = extract_point(elem, TOTAL_FIELDS)
+            if 'time' not in values:
+                # skipped like the parser does, there is no time to place them at
+                continue
+            time = time_ns(values['time'])
+            distance = float(values.get('distance', math.nan))
+            if previous_ns is None:
+                # the recording starts at the first Lap's StartTime, the Trackpoint's Lap
+                start_time = elem.getparent().getparent().get('StartTime')
+                previous_ns = time_ns(start_time) if start_time else time
+            lap.points += 1
+            if segment.keeps(lap.index, time):
+                if plan.points == 0:
+                    plan.cut_start = seen > 0
+                    plan.base_distance = previous_distance
+                _add_point(lap, values, time, distance, previous_ns, previous_distance)
+                plan.points += 1
+                if not math.isnan(distance):
+                    plan.last_distance = distance
+            seen += 1
+            previous_ns = time
+            if not math.isnan(distance):
+                previous_distance = distance
+        elif elem.tag == LAP_TAG:
+            if lap.kept:
+                lap.start_time = elem.get('StartTime')
+                children = lap.summary
+                for child in elem:
+                    if child.tag == TRACK_TAG:
+                        children = lap.trailer
+                    elif isinstance(child.tag, str):
+                        children.append(copy.deepcopy(child))
+                plan.laps.append(lap)
+            lap = LapPlan(lap.index + 1)
+        elif elem.tag == ID_TAG:
+            plan.sport = elem.getparent().get('Sport')
+            plan.activity_id = elem.text
+        else:
+            plan.creator = copy.deepcopy(elem)
+    return plan
+
+
+def _add_point(lap, values, time, distance, previous_ns, previous_distance):
+    if lap.kept == 0:
+        lap.first_time = values['time']
+        lap.base_ns = previous_ns
+        lap.base_distance = previous_distance
+    lap.kept += 1
+    lap.last_ns = time
+    if not math.isnan(distance):
+        lap.last_distance = distance
+    if 'speed' in values:
+        speed = float(values['speed'])
+        if math.isnan(lap.max_speed) or speed > lap.max_speed:
+            lap.max_speed = speed
+    if 'heartrate' in values:
+        heartrate = int(values['heartrate'])
+        lap.heartrate_sum += heartrate
+        lap.heartrate_count += 1
+        lap.max_heartrate = max(lap.max_heartrate, heartrate)
+
+
+def write_activity(plans, out_path):
+    """
+    Second pass, write the planned parts of one or more files as a single activity
+    The sport and creator come from the first file, .gz and .zst outputs are compressed
+    Returns the number of Trackpoints written
+    """
+    plans = [plan for plan in plans if plan.points]
+    if not plans:
+        raise ValueError(f"No Trackpoints to write to {out_path}")
+
+    first = plans[0]
+    activity_id = first.activity_id if not first.cut_start and first.activity_id else first.first_time
+    written = 0
+    # each file's distances are moved to carry on from where the previous one stopped
+    offset = 0.0
+    with write_tcx(out_path) as fb, lxml.etree.xmlfile(fb, encoding='UTF-8') as xf:
+        xf.write_declaration()
+        with xf.element(DATABASE_TAG, {'{%s}schemaLocation' % XSI: SCHEMA_LOCATION}, nsmap=NSMAP):
+            xf.write("\n")
+            with xf.element(ACTIVITIES_TAG), xf.element(ACTIVITY_TAG, Sport=first.sport or 'Other'):
+                xf.write("\n")
+                _write_element(xf, 'Id', activity_id)
+                for plan in plans:
+                    shift = offset - plan.base_distance
+                    written += _write_laps(xf, plan, shift)
+                    if not math.isnan(plan.last_distance):
+                        offset = plan.last_distance + shift
+                if first.creator is not None:
+                    _copy(xf, first.creator)
+                    xf.write("\n")
+    return written
+
+
+def _write_laps(xf, plan, shift):
+    laps = {lap.index: lap for lap in plan.laps}
+    lap_num = 0
+    lap_context = track_context = None
+    written = 0
+    for elem in iter_elements(plan.segment.path):
+        if elem.tag == LAP_TAG:
+            if lap_context is not None:
+                track_context.close()
+                xf.write("\n")
+                for child in laps[lap_num].trailer:
+                    _copy(xf, child)
+                    xf.write("\n")
+                lap_context.close()
+                xf.write("\n")
+                lap_context = None
+            lap_num += 1
+            continue
+
+        lap = laps.get(lap_num)
+        if lap is None:
+            continue
+        time = elem.findtext('ns:Time', None, NAMESPACES)
+        if time is None:
+            continue
+        if not lap.whole and not plan.segment.keeps(lap_num, time_ns(time)):
+            continue
+
+        if lap_context is None:
+            lap_context = ExitStack()
+            lap_context.enter_context(xf.element(LAP_TAG, StartTime=lap.start_time if lap.whole else lap.first_time))
+            xf.write("\n")
+            _write_summary(xf, lap)
+            track_context = ExitStack()
+            track_context.enter_context(xf.element(TRACK_TAG))
+            xf.write("\n")
+
+        if shift:
+            distance = elem.find(DISTANCE_TAG)
+            if distance is not None and distance.text:
+                distance.text = _number(float(distance.text) + shift)
+        _copy(xf, elem)
+        xf.write("\n")
+        written += 1
+    return written
+
+
+def _write_summary(xf, lap):
+    """The Lap's children up to its Track, copied for whole laps and recomputed for the others"""
+    if lap.whole:
+        for child in lap.summary:
+            _copy(xf, child)
+            xf.write("\n")
+        return
+
+    source = {child.tag: child for child in lap.summary}
+
+    def source_value(name, default=0.0):
+        elem = source.get('{%s}%s' % (NAMESPACES['ns'], name))
+        return float(elem.text) if elem is not None and elem.text else default
+
+    seconds = (lap.last_ns - lap.base_ns) / 1e9
+    distance = lap.last_distance - lap.base_distance
+    max_speed = lap.max_speed if not math.isnan(lap.max_speed) else source_value('MaximumSpeed')
+    source_seconds = source_value('TotalTimeSeconds')
+    calories = round(source_value('Calories') * seconds / source_seconds) if source_seconds > 0 else 0
+
+    _write_element(xf, 'TotalTimeSeconds', _number(seconds))
+    _write_element(xf, 'DistanceMeters', _number(distance if not math.isnan(distance) else 0.0))
+    _write_element(xf, 'MaximumSpeed', _number(max_speed))
+    _write_element(xf, 'Calories', str(calories))
+    if lap.heartrate_count:
+        _write_element(xf, 'AverageHeartRateBpm/Value', str(round(lap.heartrate_sum / lap.heartrate_count)))
+        _write_element(xf, 'MaximumHeartRateBpm/Value', str(lap.max_heartrate))
+    for name, default in (('Intensity', 'Active'), ('TriggerMethod', 'Manual')):
+        elem = source.get('{%s}%s' % (NAMESPACES['ns'], name))
+        _write_element(xf, name, elem.text if elem is not None else default)
+
+
+def _write_element(xf, path, text):
+    """Write text in nested TCX elements, path is 'Name' or 'Outer/Inner'"""
+    name, _, rest = path.partition('/')
+    with xf.element('{%s}%s' % (NAMESPACES['ns'], name)):
+        if rest:
+            _write_element(xf, rest, text)
+        else:
+            xf.write(text)
+    if not rest:
+        xf.write("\n")
+
+
+def _copy(xf, elem):
+    """
+    Write an element read from another file
+    xf.write(elem) would repeat every namespace declaration of the source on each element,
+    rebuilding it with xf.element reuses the prefixes declared on the root instead
+    """
+    with xf.element(elem.tag, elem.attrib):
+        if len(elem):
+            for child in elem:
+                if isinstance(child.tag, str):
+                    _copy(xf, child)
+        elif elem.text:
+            xf.write(elem.text)
+
+
+def _number(value):
+    return f"{value:.3f}".rstrip('0').rstrip('.') or '0'
+
+
+def _time(value):
+    """A datetime, TCX time string or nanoseconds since the epoch as nanoseconds, None stays None"""
+    return None if value is None else int(to_ns([value])[0])
+
+
+def trim_activity(fname, out_path, start=None, end=None):
+    """
+    Write the points of an activity from start (inclusive) to end (exclusive) to out_path
+    start and end can be datetimes, TCX time strings or nanoseconds, naive times are UTC
+    Returns the number of Trackpoints written
+    """
+    return write_activity([scan(Segment(fname, start=_time(start), end=_time(end)))], out_path)
+
+
+def split_activity(fname, first_path, second_path, time=None, lap=None):
+    """
+    Split an activity in two, either at time, which goes to the second part, or after the
+    first lap laps
+    Returns the number of Trackpoints written to each part
+    """
+    if (time is None) == (lap is None):
+        raise ValueError("Split at either a time or a lap")
+    if time is not None:
+        first, second = Segment(fname, end=_time(time)), Segment(fname, start=_time(time))
+    else:
+        first, second = Segment(fname, end_lap=lap), Segment(fname, first_lap=lap)
+    return write_activity([scan(first)], first_path), write_activity([scan(second)], second_path)
+
+
+def merge_activities(fnames, out_path):
+    """
+    Merge recordings of the same activity into one, e.g. after a watch was stopped halfway
+    Every file's laps are kept and the files are put in order of their first point
+    Returns the number of Trackpoints written
+    """
+    plans = [scan(Segment(fname)) for fname in fnames]
+    plans.sort(key=lambda plan: time_ns(plan.first_time) if plan.first_time else 0)
+    return write_activity(plans, out_path)
@@ -0,0 +1,18 @@
+import os
+import sys
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.join(ROOT, "benchmarks"))
+
+from generate_tcx import generate_tcx
+
+
+@pytest.fixture
+def tcx_file(tmp_path):
+    """A generated 3 lap activity of 300 points"""
+    path = str(tmp_path / "activity.tcx")
+    generate_tcx(path, laps=3, points_per_lap=100)
+    return path
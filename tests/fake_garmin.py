@@ -0,0 +1,46 @@
+import threading
+
+
+class TransientError(Exception):
+    """Stands in for the rate limit and connection errors of garminconnect"""
+
+
+class ActivityDownloadFormat:
+    TCX = "tcx"
+
+
+class FakeGarmin():
+    """
+    Local stand-in for garminconnect.Garmin with the calls the downloader uses
+    download_activity fails failures times for every activity before it succeeds, and
+    always fails for the ids in broken
+    """
+    ActivityDownloadFormat = ActivityDownloadFormat
+
+    def __init__(self, activities, data, failures=0, broken=()):
+        self.activities = activities
+        self.data = data
+        self.failures = failures
+        self.broken = set(broken)
+        self.calls = {}
+        self.lock = threading.Lock()
+
+    def get_activities_by_date(self, start_date, end_date, activity_type=None):
+        start, end = str(start_date), str(end_date)
+        return [activity for activity in self.activities
+                if start <= activity["startTimeLocal"].split(" ")[0] <= end]
+
+    def download_activity(self, activity_id, dl_fmt=None):
+        with self.lock:
+            self.calls[activity_id] = self.calls.get(activity_id, 0) + 1
+            attempt = self.calls[activity_id]
+        if activity_id in self.broken:
+            raise ValueError(f"activity {activity_id} is not available")
+        if attempt <= self.failures:
+            raise TransientError(f"429 on attempt {attempt}")
+        return self.data
+
+
+def fake_activities(count, month=1):
+    return [{"activityId": 1000 + i, "startTimeLocal": f"2024-{month:02d}-{i + 1:02d} 07:00:00"}
+            for i in range(count)]
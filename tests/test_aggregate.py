@@ -0,0 +1,75 @@
+import datetime
+import math
+
+import pytest
+
+import aggregate
+
+
+def row(date, duration=3600.0, distance=10000.0, average_heartrate=150.0, max_heartrate=170, calories=600,
+        max_speed=4.0):
+    return {"date": date, "duration": duration, "distance": distance, "calories": calories,
+            "average_heartrate": average_heartrate, "max_heartrate": max_heartrate, "max_speed": max_speed}
+
+
+@pytest.mark.parametrize("date, label, start", [
+    ("2024-12-30", "2025-W01", datetime.date(2024, 12, 30)),
+    ("2025-01-05", "2025-W01", datetime.date(2024, 12, 30)),
+    ("2021-01-03", "2020-W53", datetime.date(2020, 12, 28)),
+    ("2024-01-01", "2024-W01", datetime.date(2024, 1, 1)),
+])
+def test_iso_weeks(date, label, start):
+    assert aggregate.period_key(datetime.date.fromisoformat(date), "week") == (label, start)
+
+
+def test_weeks_across_the_new_year():
+    rows = [row("2024-12-29"), row("2024-12-30"), row("2025-01-05"), row("2025-01-06")]
+    stats = aggregate.aggregate(rows, "week")
+    assert [(s.period, s.activities) for s in stats] == [("2024-W52", 1), ("2025-W01", 2), ("2025-W02", 1)]
+    months = aggregate.aggregate(rows, "month")
+    assert [(s.period, s.activities) for s in months] == [("2024-12", 2), ("2025-01", 2)]
+    assert [s.period for s in aggregate.aggregate(rows, "year")] == ["2024", "2025"]
+
+
+def test_totals():
+    rows = [row("2024-03-01", duration=1800.0, distance=5000.0, calories=300, max_speed=5.0, max_heartrate=180),
+            row(datetime.date(2024, 3, 9), duration=3600.0, distance=12000.0, calories=700)]
+    total = aggregate.totals(rows)
+    assert total.period == "all" and total.start is None
+    assert total.activities == 2
+    assert total.total_time == 5400.0
+    assert total.distance == 17000.0
+    assert total.calories == 1000
+    assert total.max_speed == 5.0
+    assert total.max_heartrate == 180
+    assert aggregate.totals([]) is None
+
+
+def test_average_heartrate_is_weighted_by_duration():
+    rows = [row("2024-03-01", duration=1000.0, average_heartrate=120.0),
+            row("2024-03-02", duration=3000.0, average_heartrate=160.0)]
+    assert aggregate.totals(rows).average_heartrate == pytest.approx(150.0)
+
+
+@pytest.mark.parametrize("missing", [None, math.nan])
+def test_activities_without_heart_rate_are_left_out_of_the_average(missing):
+    rows = [row("2024-03-01", duration=1000.0, average_heartrate=120.0),
+            row("2024-03-02", duration=5000.0, average_heartrate=missing, max_heartrate=None),
+            row("2024-03-03", duration=3000.0, average_heartrate=160.0)]
+    total = aggregate.totals(rows)
+    assert total.average_heartrate == pytest.approx(150.0)
+    assert total.total_time == 9000.0
+    assert total.max_heartrate == 170
+    only_missing = aggregate.totals(rows[1:2])
+    assert only_missing.average_heartrate is None
+    assert aggregate.format_stats(only_missing) == "1 activities, 10.0 km, 1:23:20, 600 kcal"
+
+
+def test_null_values_count_as_zero():
+    total = aggregate.totals([row("2024-03-01", duration=None, distance=None, calories=None, max_speed=None)])
+    assert (total.total_time, total.distance, total.calories, total.max_speed) == (0.0, 0.0, 0, 0.0)
+
+
+def test_unknown_period():
+    with pytest.raises(ValueError):
+        aggregate.aggregate([row("2024-03-01")], "fortnight")
@@ -0,0 +1,55 @@
+import os
+
+import numpy as np
+
+import best_efforts
+import tcx_parser
+from generate_tcx import generate_tcx
+
+
+def brute_force(track, distances, durations):
+    """Every pair of points, the quadratic search the sweeps replace"""
+    times, seconds, distance, indices = best_efforts._clean_columns(track)
+    fastest, furthest = {}, {}
+    for start in range(len(seconds)):
+        for end in range(start, len(seconds)):
+            covered = distance[end] - distance[start]
+            took = seconds[end] - seconds[start]
+            for target in distances:
+                if covered >= target and took < fastest.get(target, np.inf):
+                    fastest[target] = took
+            for target in durations:
+                if seconds[-1] >= target and took <= target and covered > furthest.get(target, -1):
+                    furthest[target] = covered
+    return fastest, furthest
+
+
+def test_sweeps_match_brute_force(tmp_path):
+    path = str(tmp_path / "run.tcx")
+    generate_tcx(path, laps=2, points_per_lap=150)
+    track = tcx_parser.read_track(path, columns=best_efforts.COLUMNS)
+    distances, durations = (100, 250, 500, 10 ** 6), (10, 45, 120, 10 ** 6)
+    fastest, furthest = brute_force(track, distances, durations)
+    efforts = best_efforts.best_distance_efforts(track, distances)
+    assert {target: effort.duration for target, effort in efforts.items()} == fastest
+    efforts = best_efforts.best_duration_efforts(track, durations)
+    assert {target: effort.distance for target, effort in efforts.items()} == furthest
+    assert set(fastest) == set(distances[:-1]) and set(furthest) == set(durations[:-1])
+
+
+def test_update_drops_records_of_deleted_files(tmp_path):
+    fast, slow = str(tmp_path / "fast.tcx"), str(tmp_path / "slow.tcx")
+    generate_tcx(fast, laps=1, points_per_lap=400, seed=1)
+    generate_tcx(slow, laps=1, points_per_lap=400, seed=2)
+    book_path = str(tmp_path / "records.json")
+    book = best_efforts.RecordBook(book_path, distances=(1000,), durations=(60,))
+    book.update([fast, slow], workers=1)
+    holder = book.distance_records[1000.0].path
+    other = slow if holder == fast else fast
+    os.remove(holder)
+
+    book = best_efforts.RecordBook(book_path, distances=(1000,), durations=(60,))
+    book.update([], workers=1)
+    assert book.distance_records[1000.0].path == other
+    assert book.duration_records[60.0].path == other
+    assert list(book.processed) == [other]
@@ -0,0 +1,78 @@
+import os
+
+import numpy as np
+
+import ingest
+import tcx_parser
+from cache import ActivityCache
+from generate_tcx import generate_tcx
+
+
+def make_files(tmp_path, count):
+    paths = []
+    for i in range(count):
+        path = str(tmp_path / f"activity{i}.tcx")
+        generate_tcx(path, laps=1, points_per_lap=50, seed=i)
+        paths.append(path)
+    return paths
+
+
+def test_cache_round_trip(tmp_path, tcx_file):
+    cache = ActivityCache(str(tmp_path / "cache"))
+    parsed = tcx_parser.read_track(tcx_file, cache=cache)
+    cached = cache.get(tcx_file)
+    assert cached.column_names == parsed.column_names
+    for name in parsed.column_names:
+        assert np.array_equal(cached[name], parsed[name], equal_nan=True)
+    assert cached.laps == parsed.laps
+
+
+def test_eviction_keeps_running_total(tmp_path):
+    paths = make_files(tmp_path, 4)
+    folder = str(tmp_path / "cache")
+    cache = ActivityCache(folder)
+    for path in paths:
+        tcx_parser.read_track(path, cache=cache)
+    entry = os.path.getsize(cache.entry_path(paths[0]))
+    assert cache.total_bytes == sum(os.path.getsize(cache.entry_path(path)) for path in paths)
+
+    cache.max_bytes = entry * 2
+    cache.evict()
+    assert len(os.listdir(folder)) == 2
+    assert cache.total_bytes <= cache.max_bytes
+
+
+def test_parallel_ingest_evicts_once_in_parent(tmp_path):
+    paths = make_files(tmp_path, 6)
+    folder = str(tmp_path / "cache")
+    cache = ActivityCache(folder, max_bytes=1)
+    results = ingest.load_archive(paths, workers=2, cache=cache)
+    assert not any(result.error for result in results)
+    # every entry is over budget, so the parent evicts all of them after the batch
+    assert [name for name in os.listdir(folder) if name.endswith(".npz")] == []
+
+
+def test_evict_skips_entries_removed_meanwhile(tmp_path, monkeypatch):
+    paths = make_files(tmp_path, 2)
+    cache = ActivityCache(str(tmp_path / "cache"))
+    for path in paths:
+        tcx_parser.read_track(path, cache=cache)
+
+    gone = cache.entry_path(paths[0])
+    real_scandir = os.scandir
+
+    def scandir(folder):
+        entries = list(real_scandir(folder))
+        os.remove(gone)
+
+        class Entries(list):
+            def __enter__(self):
+                return self
+
+            def __exit__(self, *exc):
+                return False
+        return Entries(entries)
+
+    monkeypatch.setattr(os, "scandir", scandir)
+    cache.evict()
+    assert cache.total_bytes == os.path.getsize(cache.entry_path(paths[1]))
@@ -0,0 +1,33 @@
+import datetime
+import os
+
+from catalog import ActivityCatalog
+from generate_tcx import generate_tcx
+
+
+def write_activity(folder, day, activity_id):
+    path = os.path.join(folder, "2024", "January", f"{day:02d}-{activity_id}.tcx")
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    generate_tcx(path, laps=1, points_per_lap=10,
+                 start_time=datetime.datetime(2024, 1, day, 8, tzinfo=datetime.timezone.utc))
+    return path
+
+
+def test_rescan_backfills_a_partial_catalog(tmp_path):
+    folder = str(tmp_path / "activities")
+    first = write_activity(folder, 3, 1)
+    catalog = ActivityCatalog(str(tmp_path / "catalog.db"))
+    catalog.add_file(first)
+
+    # downloaded behind the catalog's back
+    second = write_activity(folder, 5, 2)
+    assert catalog.rescan(folder) == 1
+    rows = catalog.find(datetime.date(2024, 1, 1), datetime.date(2024, 1, 31))
+    assert [row["path"] for row in rows] == [first, second]
+
+    # nothing changed, nothing is summarized again
+    assert catalog.rescan(folder) == 0
+    os.remove(first)
+    catalog.rescan(folder)
+    assert len(catalog) == 1
+    catalog.close()
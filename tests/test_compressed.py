@@ -0,0 +1,41 @@
+import gc
+import warnings
+
+import numpy as np
+import pytest
+
+import compressed
+import tcx_parser
+
+
+@pytest.mark.parametrize("compression", compressed.COMPRESSIONS)
+def test_compressed_files_parse_the_same_and_close(tcx_file, compression):
+    with open(tcx_file, "rb") as fb:
+        data = fb.read()
+    path = f"{tcx_file}.{compression}"
+    with open(path, "wb") as fb:
+        fb.write(compressed.compress_bytes(data, compression))
+
+    expected = tcx_parser.read_track(tcx_file)
+    with warnings.catch_warnings(record=True) as caught:
+        warnings.simplefilter("always", ResourceWarning)
+        track = tcx_parser.read_track(path)
+        gc.collect()
+    assert not [w for w in caught if issubclass(w.category, ResourceWarning)]
+    for name in expected.column_names:
+        assert np.array_equal(track[name], expected[name], equal_nan=True)
+
+
+def test_open_tcx_closes_the_file_when_setup_fails(tmp_path, monkeypatch):
+    path = tmp_path / "broken.tcx.zst"
+    path.write_bytes(compressed.ZSTD_MAGIC + b"not really zstd")
+
+    def missing():
+        raise ImportError("no zstandard")
+    monkeypatch.setattr(compressed, "_zstandard", missing)
+    with warnings.catch_warnings(record=True) as caught:
+        warnings.simplefilter("always", ResourceWarning)
+        with pytest.raises(ImportError):
+            compressed.open_tcx(str(path))
+        gc.collect()
+    assert not [w for w in caught if issubclass(w.category, ResourceWarning)]
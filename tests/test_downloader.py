@@ -0,0 +1,138 @@
+import datetime
+import os
+import threading
+
+import pytest
+
+import downloader
+import sync
+from fake_garmin import FakeGarmin, TransientError, fake_activities
+
+
+@pytest.fixture
+def tcx_bytes(tcx_file):
+    with open(tcx_file, "rb") as fb:
+        return fb.read()
+
+
+def engine(api, folder, workers=2, **kwargs):
+    return downloader.DownloadEngine(api, folder=folder, workers=workers, retry_errors=(TransientError,),
+                                     backoff=downloader.Backoff(initial=0.001, maximum=0.01), **kwargs)
+
+
+def test_retries_transient_failures(tmp_path, tcx_bytes):
+    api = FakeGarmin(fake_activities(3), tcx_bytes, failures=2)
+    results = engine(api, str(tmp_path)).download(api.activities)
+    assert all(result.downloaded and result.error is None for result in results)
+    assert all(result.attempts == 3 for result in results)
+    for result in results:
+        with open(result.path, "rb") as fb:
+            assert fb.read() == tcx_bytes
+
+
+def test_gives_up_after_retries(tmp_path, tcx_bytes):
+    api = FakeGarmin(fake_activities(1), tcx_bytes, failures=10)
+    [result] = engine(api, str(tmp_path), retries=2).download(api.activities)
+    assert not result.downloaded
+    assert "TransientError" in result.error
+    assert result.attempts == 3
+    assert not os.path.exists(result.path)
+
+
+def test_backoff_doubles_and_recovers():
+    backoff = downloader.Backoff(initial=1.0, maximum=4.0)
+    assert [backoff.failure() for _ in range(4)] == [1.0, 2.0, 4.0, 4.0]
+    backoff.success()
+    assert backoff.delay == 2.0
+    backoff.success()
+    backoff.success()
+    assert backoff.delay == 0.0
+
+
+def test_skips_existing_files(tmp_path, tcx_bytes):
+    api = FakeGarmin(fake_activities(2), tcx_bytes)
+    existing = downloader.activity_path(api.activities[0], str(tmp_path))
+    downloader.write_atomic(existing, b"already here")
+
+    results = {result.activity_id: result for result in engine(api, str(tmp_path)).download(api.activities)}
+    assert not results[1000].downloaded and results[1000].path == existing
+    assert results[1001].downloaded
+    assert api.calls == {1001: 1}
+
+
+def test_sync_manifest_round_trip(tmp_path, tcx_bytes):
+    folder = str(tmp_path)
+    api = FakeGarmin(fake_activities(3), tcx_bytes)
+    start, end = datetime.date(2024, 1, 1), datetime.date(2024, 1, 31)
+
+    results = sync.synchronize(api, start, end, folder=folder, workers=2, chunk_days=10)
+    assert sorted(result.activity_id for result in results) == [1000, 1001, 1002]
+
+    manifest = sync.SyncManifest(os.path.join(folder, "sync_manifest.json"))
+    assert sorted(manifest.files) == ["1000", "1001", "1002"]
+    assert manifest.last_activity_id == 1002
+    assert manifest.last_timestamp == "2024-01-03 07:00:00"
+    assert manifest.verify() == []
+
+    # a second run only downloads what is new
+    api.activities += [{"activityId": 2000, "startTimeLocal": "2024-01-20 07:00:00"}]
+    results = sync.synchronize(api, start, end, folder=folder, workers=2)
+    assert [result.activity_id for result in results] == [2000]
+    assert api.calls[1000] == 1
+
+    # a changed file no longer verifies
+    downloader.write_atomic(manifest.files["1000"]["path"], b"changed")
+    assert sync.SyncManifest(os.path.join(folder, "sync_manifest.json")).verify() == ["1000"]
+
+
+def test_sync_retries_failed_downloads(tmp_path, tcx_bytes):
+    folder = str(tmp_path)
+    api = FakeGarmin(fake_activities(5), tcx_bytes, broken={1001})
+    start, end = datetime.date(2024, 1, 1), datetime.date(2024, 1, 31)
+
+    results = sync.synchronize(api, start, end, folder=folder, workers=2)
+    assert [result.activity_id for result in results if result.error] == [1001]
+    manifest = sync.SyncManifest(os.path.join(folder, "sync_manifest.json"))
+    assert not manifest.has(1001)
+    assert manifest.pending == {"1001": "2024-01-02 07:00:00"}
+
+    # the next sync without a start date goes back far enough to pick it up
+    api.broken.clear()
+    results = sync.synchronize(api, end_date=end, folder=folder, workers=2)
+    assert [result.activity_id for result in results] == [1001]
+    manifest = sync.SyncManifest(os.path.join(folder, "sync_manifest.json"))
+    assert manifest.has(1001)
+    assert manifest.pending == {}
+    assert manifest.resume_date() == datetime.date(2024, 1, 5)
+
+
+def test_cancel_stops_queued_downloads(tmp_path, tcx_bytes):
+    cancel = threading.Event()
+
+    class CancellingGarmin(FakeGarmin):
+        def download_activity(self, activity_id, dl_fmt=None):
+            cancel.set()
+            return super().download_activity(activity_id, dl_fmt)
+
+    api = CancellingGarmin(fake_activities(5), tcx_bytes)
+    seen = []
+    results = engine(api, str(tmp_path), workers=1).download(api.activities, progress=lambda *args: seen.append(args),
+                                                             cancel=cancel)
+    # the download that was running finishes and is reported, none of the queued ones start
+    assert sum(api.calls.values()) == 1
+    assert [result.downloaded for result in results] == [True]
+    assert len(seen) == 1
+
+
+def test_process_downloads_updates_records_and_training_load(tmp_path, tcx_bytes):
+    folder = str(tmp_path)
+    api = FakeGarmin(fake_activities(2), tcx_bytes)
+    results = sync.synchronize(api, datetime.date(2024, 1, 1), datetime.date(2024, 1, 31), folder=folder, workers=2)
+    paths = [result.path for result in results]
+
+    improved, days = sync.process_downloads(paths, folder, workers=1)
+    assert improved and all(effort.path in paths for effort in improved)
+    assert days == ["2024-01-05"]
+    assert os.path.isfile(os.path.join(folder, "records.json"))
+    assert os.path.isfile(os.path.join(folder, "training.json"))
+    assert sync.process_downloads([], folder) == ([], [])
@@ -0,0 +1,75 @@
+import numpy as np
+import pytest
+
+from downsample import downsample, lttb_indices, minmax_indices
+
+
+def series(n=100_000, seed=0):
+    rng = np.random.default_rng(seed)
+    return 140 + 10 * np.sin(np.arange(n) / 5000) + rng.normal(0, 1, n)
+
+
+@pytest.mark.parametrize("spike", [0, 1234, 56_789, 99_999])
+def test_minmax_keeps_single_sample_spikes(spike):
+    x = np.arange(100_000)
+    heartrate = series()
+    heartrate[spike] = 220
+    speed = series(seed=1)
+    speed[spike] = 0
+
+    x_ds, heartrate_ds = downsample(x, heartrate, 1000, method='minmax')
+    assert len(x_ds) <= 1002
+    assert heartrate_ds.max() == 220 and spike in x_ds
+    x_ds, speed_ds = downsample(x, speed, 1000, method='minmax')
+    assert speed_ds.min() == 0 and spike in x_ds
+
+
+def test_minmax_indices_with_nan_buckets():
+    y = series(1000)
+    y[100:300] = np.nan
+    y[500] = np.nan
+    indices = minmax_indices(y, 10)
+    assert np.all(np.diff(indices) > 0)
+    assert indices[0] == 0 and indices[-1] == 999
+    kept = y[indices]
+    # the all-NaN buckets give up a single index each, the others their real extremes
+    assert np.isnan(kept).sum() == 2
+    assert np.nanmax(kept) == np.nanmax(y) and np.nanmin(kept) == np.nanmin(y)
+
+
+def test_short_series_are_returned_unchanged():
+    y = series(50)
+    assert np.array_equal(minmax_indices(y, 25), np.arange(50))
+    assert np.array_equal(lttb_indices(np.arange(50), y, 60), np.arange(50))
+    x_ds, y_ds = downsample(np.arange(50), y, 100)
+    assert len(y_ds) == 50
+
+
+def test_lttb_keeps_the_ends_and_the_spike():
+    x = np.arange(10_000, dtype='float64')
+    y = series(10_000)
+    y[4321] = 250
+    y[7000:7100] = np.nan
+    indices = lttb_indices(x, y, 200)
+    assert len(indices) == 200
+    assert indices[0] == 0 and indices[-1] == 9999
+    assert np.all(np.diff(indices) > 0)
+    assert 4321 in indices
+
+
+@pytest.mark.parametrize("method", ['minmax', 'lttb'])
+def test_datetime_x(method):
+    start = np.datetime64('2024-01-05T23:59:50', 'ns')
+    x = start + np.arange(20_000).astype('timedelta64[s]')
+    y = series(20_000)
+    y[15_000] = 300
+    x_ds, y_ds = downsample(x, y, 500, method=method)
+    assert x_ds.dtype == x.dtype
+    assert x_ds[0] == x[0] and x_ds[-1] == x[-1]
+    assert np.all(np.diff(x_ds) > np.timedelta64(0))
+    assert y_ds.max() == 300
+
+
+def test_unknown_method():
+    with pytest.raises(ValueError):
+        downsample(np.arange(100), series(100), 10, method='every_nth')
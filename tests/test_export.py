@@ -0,0 +1,26 @@
+import csv
+
+import pytest
+
+import export
+import tcx_parser
+
+
+def test_csv_export_has_a_row_per_point(tmp_path, tcx_file):
+    out = str(tmp_path / "export.csv")
+    assert export.export_activities([tcx_file], out, "csv") == 1
+    with open(out, newline="") as f:
+        rows = list(csv.DictReader(f))
+    assert len(rows) == 300
+    assert rows[0]["activity"] == tcx_file
+    assert set(tcx_parser.read_track(tcx_file).column_names) <= set(rows[0])
+
+
+def test_parquet_export_matches_the_track(tmp_path, tcx_file):
+    pq = pytest.importorskip("pyarrow.parquet")
+    out = str(tmp_path / "export.parquet")
+    export.export_activities([tcx_file, tcx_file], out, "parquet", columns=("time", "heartrate"))
+    table = pq.read_table(out)
+    assert table.num_rows == 600
+    assert table.column_names == ["activity", "time", "lap", "heartrate"]
+    assert table.column("heartrate").to_pylist()[:300] == tcx_parser.read_track(tcx_file).heartrate.tolist()
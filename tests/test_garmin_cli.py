@@ -0,0 +1,37 @@
+import datetime
+import sys
+
+import garmin
+
+
+def test_download_and_synchronize_without_start_date(monkeypatch):
+    calls = {}
+    monkeypatch.setattr(sys, "argv", ["garmin.py", "--download_activities", "--synchronize"])
+    monkeypatch.setattr(garmin, "init_api", lambda *args: object())
+    monkeypatch.setattr(garmin, "ActivityCatalog", lambda *args: None)
+    monkeypatch.setattr(garmin, "download_activities",
+                        lambda api, start_date, end_date, *args: calls.setdefault("download", start_date))
+    monkeypatch.setattr(garmin, "synchronize_activities",
+                        lambda api, start_date, end_date, *args: calls.setdefault("synchronize", start_date))
+
+    garmin.run(garmin.get_args())
+
+    expected = datetime.date.today() - datetime.timedelta(days=14)
+    assert calls["download"] == expected.isoformat()
+    # synchronize picks its own start from the manifest
+    assert calls["synchronize"] is None
+
+
+def test_profile_parses_in_process(monkeypatch, tmp_path, capsys):
+    seen = {}
+    monkeypatch.setattr(sys, "argv", ["garmin.py", "--ingest", "--profile", str(tmp_path / "profile.json")])
+    monkeypatch.setattr(garmin, "run", lambda args: seen.setdefault("workers", args.workers))
+    garmin.main()
+    assert seen["workers"] == 1
+    assert (tmp_path / "profile.json").exists()
+
+    monkeypatch.setattr(sys, "argv", ["garmin.py", "--ingest", "--workers", "4", "--profile", str(tmp_path / "profile.json")])
+    seen.clear()
+    garmin.main()
+    assert seen["workers"] == 4
+    assert "not profiled" in capsys.readouterr().out
@@ -0,0 +1,67 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import ingest
+from generate_tcx import generate_tcx
+
+
+class CountingExecutor(ThreadPoolExecutor):
+    submitted = 0
+
+    def __init__(self, max_workers):
+        super().__init__(max_workers=max_workers)
+
+    def submit(self, *args, **kwargs):
+        CountingExecutor.submitted += 1
+        return super().submit(*args, **kwargs)
+
+
+def make_files(tmp_path, count):
+    paths = []
+    for i in range(count):
+        path = str(tmp_path / f"{i:02d}-{i}.tcx")
+        generate_tcx(path, laps=1, points_per_lap=5, seed=i)
+        paths.append(path)
+    return paths
+
+
+def test_iter_archive_keeps_a_bounded_window(tmp_path, monkeypatch):
+    paths = make_files(tmp_path, 40)
+    CountingExecutor.submitted = 0
+    monkeypatch.setattr(ingest, "ProcessPoolExecutor", CountingExecutor)
+    monkeypatch.setattr(ingest, "MAX_BATCH", 1)
+
+    results = ingest.iter_archive(paths, workers=2)
+    first = next(results)
+    assert first.path == paths[0] and first.error is None
+    # the window plus the batch handed out when the first one was taken
+    assert CountingExecutor.submitted == 2 * ingest.BATCHES_PER_WORKER + 1
+
+    rest = list(results)
+    assert [result.path for result in rest] == paths[1:]
+    assert CountingExecutor.submitted == len(paths)
+
+
+def test_closing_iter_archive_cancels_queued_batches(tmp_path, monkeypatch):
+    paths = make_files(tmp_path, 10)
+    parsed = []
+    parse = ingest.parse_activity_files
+
+    def slow_parse(batch, cache=None, columns=None):
+        # everything after the first file is still running when the consumer stops
+        if batch[0] != paths[0]:
+            threading.Event().wait(0.2)
+        parsed.extend(batch)
+        return parse(batch, cache, columns)
+
+    CountingExecutor.submitted = 0
+    monkeypatch.setattr(ingest, "ProcessPoolExecutor", CountingExecutor)
+    monkeypatch.setattr(ingest, "MAX_BATCH", 1)
+    monkeypatch.setattr(ingest, "parse_activity_files", slow_parse)
+
+    results = ingest.iter_archive(paths, workers=2)
+    assert next(results).path == paths[0]
+    results.close()
+    assert CountingExecutor.submitted == 2 * ingest.BATCHES_PER_WORKER + 1
+    # only the batches a worker had already started were parsed
+    assert len(parsed) <= 3
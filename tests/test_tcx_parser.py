@@ -0,0 +1,145 @@
+import math
+
+import lxml.etree
+import pytest
+from dateutil import parser as dp
+
+import tcx_parser
+from tcx_parser import NAMESPACES
+
+
+def tree_data_points(fname):
+    """The dictionaries of the original tree based get_all_data_points"""
+    root = lxml.etree.parse(fname).getroot()
+    activity = root.find('ns:Activities', NAMESPACES)[0]
+    points = []
+    for lap_no, lap in enumerate(activity.findall('ns:Lap', NAMESPACES), start=1):
+        for point in lap.find('ns:Track', NAMESPACES).findall('ns:Trackpoint', NAMESPACES):
+            data = {'time': dp.parse(point.find('ns:Time', NAMESPACES).text)}
+            if point.find('ns:AltitudeMeters', NAMESPACES) is not None:
+                data['elevation'] = float(point.find('ns:AltitudeMeters', NAMESPACES).text)
+            if point.find('ns:HeartRateBpm', NAMESPACES) is not None:
+                data['heart_rate'] = int(point.find('ns:HeartRateBpm/ns:Value', NAMESPACES).text)
+            if point.find('ns:Cadence', NAMESPACES) is not None:
+                data['cadence'] = int(point.find('ns:Cadence', NAMESPACES).text)
+            if point.find('.//ns3:Speed', NAMESPACES) is not None:
+                data['speed'] = float(point.find('.//ns3:Speed', NAMESPACES).text)
+            if point.find('ns:DistanceMeters', NAMESPACES) is not None:
+                data['distance'] = float(point.find('ns:DistanceMeters', NAMESPACES).text)
+            data['lap'] = lap_no
+            points.append(data)
+    return points
+
+
+def test_streaming_matches_tree_parser(tcx_file):
+    expected = tree_data_points(tcx_file)
+    assert len(expected) == 300
+    assert tcx_parser.get_all_data_points(tcx_file) == expected
+    assert list(tcx_parser.iter_trackpoints(tcx_file)) == expected
+    assert tcx_parser.read_track(tcx_file).to_dicts() == expected
+
+
+def test_points_match_iter_activity(tcx_file):
+    streamed = [item for item in tcx_parser.iter_activity(tcx_file) if isinstance(item, tcx_parser.PointStats)]
+    points = tcx_parser.Activity(tcx_file).points
+    assert len(points) == len(streamed) == 300
+    for point, expected in zip(points, streamed):
+        assert point.time == expected.time
+        assert point.lap == expected.lap
+        assert point.heartrate == expected.heartrate
+        for name in ('distance', 'speed', 'altitude', 'latitude', 'longitude'):
+            assert math.isclose(getattr(point, name), getattr(expected, name))
+    assert [point.lap for point in points[::100]] == [0, 1, 2]
+
+
+def test_summary_and_average_heartrate(tcx_file):
+    summary = tcx_parser.read_summary(tcx_file)
+    assert summary.sport == "Running"
+    assert summary.laps == tcx_parser.read_track(tcx_file).laps
+    assert len(summary.laps) == 3
+    assert tcx_parser.get_average_heartrate(tcx_file) == str(summary.laps[-1].average_heartrate)
+
+
+def test_average_heartrate_without_heart_rate(tmp_path):
+    from generate_tcx import generate_tcx
+    path = str(tmp_path / "no_hr.tcx")
+    generate_tcx(path, laps=2, points_per_lap=10, heartrate=False)
+    assert tcx_parser.get_average_heartrate(path) is None
+
+
+def test_laps_without_heart_rate_are_left_out_of_the_average(tmp_path, tcx_file):
+    from cache import ActivityCache
+    tree = lxml.etree.parse(tcx_file)
+    first_lap = tree.getroot().find('ns:Activities/ns:Activity/ns:Lap', NAMESPACES)
+    for tag in ('ns:AverageHeartRateBpm', 'ns:MaximumHeartRateBpm'):
+        first_lap.remove(first_lap.find(tag, NAMESPACES))
+    path = str(tmp_path / "mixed.tcx")
+    tree.write(path, xml_declaration=True, encoding="UTF-8")
+
+    laps = tcx_parser.read_summary(path).laps
+    assert math.isnan(laps[0].average_heartrate) and math.isnan(laps[0].max_heartrate)
+    totals = tcx_parser.Activity.get_total_stats(laps)
+    expected = sum(lap.average_heartrate * lap.total_time for lap in laps[1:]) / sum(lap.total_time for lap in laps[1:])
+    assert math.isclose(totals.average_heartrate, expected)
+    assert totals.max_heartrate == max(lap.max_heartrate for lap in laps[1:])
+
+    cache = ActivityCache(str(tmp_path / "cache"))
+    tcx_parser.read_track(path, cache=cache)
+    cached = cache.get(path).laps
+    assert math.isnan(cached[0].average_heartrate)
+    assert cached[1:] == laps[1:]
+    assert all(type(lap.average_heartrate) is int for lap in cached[1:])
+
+    no_heartrate = tcx_parser.Activity.get_total_stats(laps[:1])
+    assert math.isnan(no_heartrate.average_heartrate) and math.isnan(no_heartrate.max_heartrate)
+
+
+def test_trackpoints_without_time_are_skipped(tmp_path, tcx_file):
+    import tcx_writer
+    tree = lxml.etree.parse(tcx_file)
+    points = tree.getroot().findall('.//ns:Trackpoint', NAMESPACES)
+    # one in a whole lap and one in the part of the last lap a trim keeps
+    for point in (points[10], points[250]):
+        point.remove(point.find('ns:Time', NAMESPACES))
+    path = str(tmp_path / "timeless.tcx")
+    tree.write(path, xml_declaration=True, encoding="UTF-8")
+
+    track = tcx_parser.read_track(path)
+    assert len(track) == 298
+    assert len(tcx_parser.read_track(path, columns=('distance',))) == 298
+    assert tcx_parser.get_all_data_points(path) == track.to_dicts()
+    streamed = [item for item in tcx_parser.iter_activity(path) if isinstance(item, tcx_parser.PointStats)]
+    assert len(streamed) == 298
+
+    out = str(tmp_path / "trimmed.tcx")
+    assert tcx_writer.trim_activity(path, out, start=tcx_parser.read_track(tcx_file).to_dicts()[5]['time']) == 293
+    assert len(tcx_parser.read_track(out)) == 293
+
+
+def test_plots_need_their_columns(tcx_file):
+    activity = tcx_parser.Activity(tcx_file, columns=('time', 'heartrate'))
+    with pytest.raises(ValueError, match="speed"):
+        activity.plot(show=False)
+    with pytest.raises(ValueError, match="longitude"):
+        activity.graph_map(show=False)
+    with pytest.raises(ValueError, match="time"):
+        tcx_parser.Activity(tcx_file, columns=('heartrate',)).to_excel()
+
+
+def test_graph_map(tmp_path, tcx_file):
+    matplotlib = pytest.importorskip("matplotlib")
+    matplotlib.use("Agg")
+    import matplotlib.pyplot as plt
+    from generate_tcx import generate_tcx
+
+    fig = tcx_parser.Activity(tcx_file).graph_map(max_points=50, show=False)
+    ax = fig.axes[0]
+    assert len(ax.collections) == 2
+    fig.canvas.draw()
+    assert len(ax.collections[1].get_segments()) == 50
+    plt.close(fig)
+
+    indoor = str(tmp_path / "indoor.tcx")
+    generate_tcx(indoor, laps=1, points_per_lap=20, gps=False)
+    with pytest.raises(ValueError, match="no points with a position"):
+        tcx_parser.Activity(indoor).graph_map(show=False)
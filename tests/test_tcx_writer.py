@@ -0,0 +1,57 @@
+import gzip
+
+import numpy as np
+
+import tcx_parser
+import tcx_writer
+
+
+def assert_same_points(path, expected, laps=True):
+    """Same points as expected, lap numbers are only compared with laps"""
+    track = tcx_parser.read_track(path)
+    assert track.column_names == expected.column_names
+    for name in expected.column_names:
+        if name == 'lap' and not laps:
+            continue
+        if expected[name].dtype.kind == 'f':
+            assert np.allclose(track[name], expected[name], equal_nan=True), name
+        else:
+            assert np.array_equal(track[name], expected[name]), name
+
+
+def test_trim_without_bounds_keeps_everything(tmp_path, tcx_file):
+    out = str(tmp_path / "copy.tcx")
+    assert tcx_writer.trim_activity(tcx_file, out) == 300
+    assert_same_points(out, tcx_parser.read_track(tcx_file))
+    original, copy = tcx_parser.read_summary(tcx_file), tcx_parser.read_summary(out)
+    assert copy.sport == original.sport
+    assert copy.start_time == original.start_time
+    assert copy.laps == original.laps
+
+
+def test_split_then_merge_round_trips(tmp_path, tcx_file):
+    expected = tcx_parser.read_track(tcx_file)
+    first, second, merged = (str(tmp_path / name) for name in ("first.tcx", "second.tcx", "merged.tcx"))
+
+    assert tcx_writer.split_activity(tcx_file, first, second, lap=1) == (100, 200)
+    assert tcx_writer.merge_activities([second, first], merged) == 300
+    assert_same_points(merged, expected)
+    assert tcx_parser.read_summary(merged).laps == tcx_parser.read_summary(tcx_file).laps
+
+    middle = expected.to_dicts()[150]['time']
+    assert tcx_writer.split_activity(tcx_file, first, second, time=middle) == (150, 150)
+    assert tcx_parser.read_track(second).to_dicts()[0]['time'] == middle
+    assert tcx_writer.merge_activities([first, second], merged) == 300
+    # the lap that was cut in two stays two laps
+    assert_same_points(merged, expected, laps=False)
+    assert len(tcx_parser.read_summary(merged).laps) == 4
+
+
+def test_compressed_output(tmp_path, tcx_file):
+    out = str(tmp_path / "copy.tcx.gz")
+    tcx_writer.trim_activity(tcx_file, out)
+    with open(out, "rb") as fb:
+        assert fb.read(2) == b"\x1f\x8b"
+    with gzip.open(out) as fb:
+        assert b"<Trackpoint>" in fb.read()
+    assert_same_points(out, tcx_parser.read_track(tcx_file))
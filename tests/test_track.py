@@ -0,0 +1,53 @@
+import datetime
+
+import numpy as np
+import pytest
+
+from track import TimeIndex, to_ns
+
+
+def times(*seconds):
+    start = datetime.datetime(2024, 1, 5, 23, 59, 50, tzinfo=datetime.timezone.utc)
+    return [start + datetime.timedelta(seconds=s) for s in seconds]
+
+
+def test_nearest_ties_go_to_the_earlier_point():
+    index = TimeIndex(times(0, 10, 20))
+    assert index.nearest(times(5)[0]) == (0, -5.0)
+    assert index.nearest(times(15)[0]) == (1, -5.0)
+    assert index.nearest(times(16)[0]) == (2, 4.0)
+
+
+def test_nearest_clamps_to_the_ends_and_crosses_midnight():
+    index = TimeIndex(times(0, 10, 20))
+    assert index.nearest(times(-100)[0]) == (0, 100.0)
+    # 20 seconds after the start is past midnight, comparing times of day would get this wrong
+    assert index.nearest(times(30)[0]) == (2, -10.0)
+
+
+def test_unsorted_times_return_original_indices():
+    index = TimeIndex(times(20, 0, 10, 10))
+    indices, offsets = index.nearest_many(times(1, 9, 19))
+    assert indices.tolist() == [1, 2, 0]
+    assert offsets.tolist() == [-1.0, 1.0, 1.0]
+
+
+def test_time_formats_agree():
+    values = times(0, 1)
+    expected = to_ns(values)
+    assert np.array_equal(to_ns(np.array(expected).astype("datetime64[ns]")), expected)
+    assert np.array_equal(to_ns(["2024-01-05T23:59:50Z", "2024-01-05T23:59:51.000Z"]), expected)
+
+
+def test_empty_index_is_rejected():
+    with pytest.raises(ValueError):
+        TimeIndex([])
+
+
+def test_register_column(monkeypatch):
+    import track
+    monkeypatch.setattr(track, "COLUMN_TYPES", dict(track.COLUMN_TYPES))
+    with pytest.raises(ValueError):
+        track.column_types(['power'])
+    track.register_column('power')
+    assert track.column_types(['power']) == {'lap': ('i', 'int32'), 'power': ('d', 'float64')}
@@ -0,0 +1,94 @@
+import datetime
+import os
+
+import numpy as np
+import pytest
+
+import garmin
+import tcx_parser
+import training_load
+from generate_tcx import START_TIME, generate_tcx
+
+
+def make_activity(folder, day, seed=0):
+    start = START_TIME + datetime.timedelta(days=day)
+    path = os.path.join(folder, f"{start.day:02d}-{1000 + seed}.tcx")
+    generate_tcx(path, laps=1, points_per_lap=300, seed=seed, start_time=start)
+    return path
+
+
+def test_trimp_and_zones(tcx_file):
+    track = tcx_parser.read_track(tcx_file, columns=training_load.COLUMNS)
+    load = training_load.activity_load(track)
+    assert load.date == "2024-01-05"
+    assert load.duration == 299.0
+    assert load.trimp > 0
+    # every interval of the one second recording is in some zone
+    assert sum(load.zones) == pytest.approx(299.0)
+    assert training_load.trimp(track, max_heartrate=400) < load.trimp
+
+
+def test_rolling_loads_carry_on_from_a_start():
+    trimps = [50.0, 0.0, 80.0, 20.0, 0.0, 0.0, 100.0]
+    atl, ctl = training_load.rolling_loads(trimps)
+    tail_atl, tail_ctl = training_load.rolling_loads(trimps[3:], atl[2], ctl[2])
+    assert np.allclose(tail_atl, atl[3:]) and np.allclose(tail_ctl, ctl[3:])
+    assert np.all(atl >= ctl)
+
+
+def test_incremental_update_matches_a_full_one(tmp_path):
+    folder = str(tmp_path)
+    paths = [make_activity(folder, day, seed) for seed, day in enumerate((0, 3, 3, 10, 20))]
+
+    incremental = training_load.TrainingLog(str(tmp_path / "incremental.json"))
+    assert incremental.update(paths[:2], workers=1) == ["2024-01-05", "2024-01-08"]
+    assert incremental.update(paths[3:], workers=1) == ["2024-01-15", "2024-01-25"]
+    # a day in the middle changes the loads after it too
+    assert incremental.update(paths, workers=1) == ["2024-01-08"]
+
+    full = training_load.TrainingLog(str(tmp_path / "full.json"))
+    full.update(paths, workers=1)
+    assert [d.date for d in incremental.daily()] == [d.date for d in full.daily()]
+    for a, b in zip(incremental.daily(), full.daily()):
+        assert (a.trimp, a.atl, a.ctl) == pytest.approx((b.trimp, b.atl, b.ctl))
+    assert len(full.daily()) == 21
+
+    reloaded = training_load.TrainingLog(str(tmp_path / "full.json"))
+    assert reloaded.daily() == full.daily()
+    assert reloaded.update(paths, workers=1) == []
+
+
+def test_deleted_files_are_dropped(tmp_path):
+    folder = str(tmp_path)
+    paths = [make_activity(folder, day, seed) for seed, day in enumerate((0, 1, 2))]
+    log = training_load.TrainingLog(str(tmp_path / "training.json"))
+    log.update(paths, workers=1)
+    before = {d.date: d.trimp for d in log.daily()}
+
+    os.remove(paths[1])
+    assert log.update([], workers=1) == ["2024-01-06"]
+    after = {d.date: d.trimp for d in log.daily()}
+    assert after["2024-01-06"] == 0.0
+    assert after["2024-01-05"] == before["2024-01-05"]
+    assert paths[1] not in log.activities
+
+    os.remove(paths[2])
+    log.update([], workers=1)
+    assert [d.date for d in log.daily()] == ["2024-01-05"]
+
+
+def test_compressing_keeps_the_log(tmp_path):
+    folder = str(tmp_path)
+    path = make_activity(folder, 0)
+    garmin.update_training_load(folder, [path], workers=1)
+    garmin.update_records(folder, [path], workers=1)
+    trimp = training_load.TrainingLog(str(tmp_path / "training.json")).daily()[0].trimp
+
+    garmin.compress_activities(folder, "gz")
+    log = training_load.TrainingLog(str(tmp_path / "training.json"))
+    assert list(log.activities) == [path + ".gz"]
+    assert log.update([path + ".gz"], workers=1) == []
+    assert log.daily()[0].trimp == trimp
+    records = garmin.best_efforts.RecordBook(str(tmp_path / "records.json"))
+    assert list(records.processed) == [path + ".gz"]
+    assert all(effort.path == path + ".gz" for effort in records.duration_records.values())
@@ -0,0 +1,45 @@
+import datetime
+import numpy as np
+
+
+EPOCH = datetime.datetime(1970, 1, 1, tzinfo=datetime.timezone.utc)
+
+
+def parse_time(time_str: str):
+    """
+    Parse a single TCX time string into a datetime
+    Handles the ISO-8601 forms Garmin writes directly and falls back to dateutil
+    """
+    try:
+        # datetime.fromisoformat only understands the Z suffix from Python 3.11
+        if time_str.endswith('Z'):
+            return datetime.datetime.fromisoformat(time_str[:-1] + '+00:00')
+        return datetime.datetime.fromisoformat(time_str)
+    except ValueError:
+        import dateutil.parser
+        return dateutil.parser.parse(time_str)
+
+
+def time_ns(time_str: str):
+    """Returns a TCX time string as nanoseconds since the epoch, naive times are taken as UTC"""
+    time = parse_time(time_str)
+    if time.tzinfo is None:
+        time = time.replace(tzinfo=datetime.timezone.utc)
+    return (time - EPOCH) // datetime.timedelta(microseconds=1) * 1000
+
+
+def parse_times(time_strs):
+    """
+    Parse a whole column of TCX time strings at once
+    Returns a UTC datetime64[ns] array, naive times are taken as UTC
+    """
+    time_strs = list(time_strs)
+    if all(time_str[10:11] == 'T' and time_str.endswith('Z') for time_str in time_strs):
+        # Zulu times are decoded in bulk by NumPy, which has no timezone to apply
+        try:
+            return np.array([time_str[:-1] for time_str in time_strs], dtype='datetime64[ns]')
+        except ValueError:
+            pass
+
+    times = np.fromiter((time_ns(time_str) for time_str in time_strs), dtype='int64', count=len(time_strs))
+    return times.view('datetime64[ns]')
@@ -0,0 +1,275 @@
+import array
+import math
+import datetime
+import numpy as np
+
+from timestamps import EPOCH, parse_times, time_ns
+
+
+# column name -> (array.array typecode used while building, numpy dtype)
+TRACK_COLUMNS = {
+    'time': ('q', 'datetime64[ns]'),
+    'lap': ('i', 'int32'),
+    'distance': ('d', 'float64'),
+    'heartrate': ('d', 'float64'),
+    'speed': ('d', 'float64'),
+    'altitude': ('d', 'float64'),
+    'latitude': ('d', 'float64'),
+    'longitude': ('d', 'float64'),
+    'cadence': ('d', 'float64'),
+}
+
+# every column a Track can have, extension fields registered with the parser are added here
+COLUMN_TYPES = dict(TRACK_COLUMNS)
+
+
+def register_column(name, typecode='d', dtype='float64'):
+    """Add a column Tracks can have, missing values are NaN so it has to be a float type"""
+    COLUMN_TYPES[name] = (typecode, dtype)
+
+
+def column_types(names=None):
+    """
+    {name: (typecode, dtype)} for a projection of the columns, in the order of COLUMN_TYPES
+    lap is always included since it comes for free, None means the default TRACK_COLUMNS
+    """
+    if names is None:
+        return TRACK_COLUMNS
+    unknown = set(names) - set(COLUMN_TYPES)
+    if unknown:
+        raise ValueError(f"Unknown track columns {sorted(unknown)}, expected some of {list(COLUMN_TYPES)}")
+    return {name: types for name, types in COLUMN_TYPES.items() if name in names or name == 'lap'}
+
+
+class TrackBuilder():
+    """
+    Collects Trackpoint values column by column in compact typed buffers
+    so a Track can be built in a single pass over the file
+    """
+
+    # time strings are decoded this many at a time
+    TIME_CHUNK = 4096
+
+    def __init__(self, columns=TRACK_COLUMNS):
+        self.columns = columns
+        self.buffers = {name: array.array(typecode) for name, (typecode, _) in columns.items()}
+        self.pending_times = []
+
+    def __len__(self):
+        return len(self.buffers['lap'])
+
+    def append(self, **values):
+        """
+        Add one point, values missing for a column are stored as NaN
+        time can be given as nanoseconds since the epoch or as a TCX time string
+        values for columns the builder doesn't have are ignored
+        """
+        if 'time' in self.buffers:
+            time = values['time']
+            if isinstance(time, str):
+                self.pending_times.append(time)
+                if len(self.pending_times) >= self.TIME_CHUNK:
+                    self.flush_times()
+            else:
+                self.flush_times()
+                self.buffers['time'].append(time)
+
+        for name, buffer in self.buffers.items():
+            if name != 'time':
+                buffer.append(values.get(name, math.nan))
+
+    def flush_times(self):
+        if self.pending_times:
+            self.buffers['time'].frombytes(parse_times(self.pending_times).tobytes())
+            self.pending_times = []
+
+    def build(self, laps=None):
+        self.flush_times()
+        # np.frombuffer shares memory with the array.array, no copy is made
+        columns = {name: np.frombuffer(self.buffers[name], dtype=dtype)
+                   for name, (_, dtype) in self.columns.items()}
+        return Track(columns, laps)
+
+
+class Track():
+    """
+    Columnar container for the Trackpoints of an activity
+    Every column is a typed NumPy array, missing values are NaN
+    Times are stored as UTC datetime64[ns]
+    """
+
+    def __init__(self, columns, laps=None):
+        lengths = {len(values) for values in columns.values()}
+        if len(lengths) > 1:
+            raise ValueError(f"Track columns have different lengths: {lengths}")
+        self._columns = columns
+        self._time_index = None
+        self.laps = laps if laps is not None else []
+
+    def __len__(self):
+        return len(next(iter(self._columns.values()), ()))
+
+    def __contains__(self, name):
+        return name in self._columns
+
+    def __getitem__(self, name):
+        """Zero-copy read only view of a column"""
+        view = self._columns[name].view()
+        view.flags.writeable = False
+        return view
+
+    def __getattr__(self, name):
+        if name.startswith('_') or name not in self._columns:
+            raise AttributeError(name)
+        return self[name]
+
+    @property
+    def column_names(self):
+        return list(self._columns)
+
+    def select(self, names):
+        """Track with only the given columns (and lap), the arrays are shared rather than copied"""
+        missing = [name for name in names if name not in self._columns]
+        if missing:
+            raise KeyError(f"Track has no {missing} columns")
+        columns = {name: values for name, values in self._columns.items() if name in names or name == 'lap'}
+        return Track(columns, self.laps)
+
+    def time_ns(self):
+        """Times as int64 nanoseconds since the epoch"""
+        return self['time'].view('int64')
+
+    def time_index(self):
+        """TimeIndex over the point times, built on first use"""
+        if self._time_index is None:
+            self._time_index = TimeIndex(self.time_ns())
+        return self._time_index
+
+    def to_dataframe(self):
+        import pandas as pd
+        data = {name: self[name] for name in self._columns}
+        if 'time' in data:
+            data['time'] = pd.DatetimeIndex(data['time']).tz_localize('UTC')
+        return pd.DataFrame(data, copy=False)
+
+    def to_points(self):
+        """
+        Convert back to a list of PointStats
+        Columns the Track doesn't have are NaN, or None for the time
+        """
+        from tcx_parser import PointStats
+        nan = [math.nan] * len(self)
+        times = self.time_ns().tolist() if 'time' in self._columns else [None] * len(self)
+        columns = {name: self._columns[name].tolist() if name in self._columns else nan
+                   for name in TRACK_COLUMNS if name != 'time'}
+        points = []
+        for i, time in enumerate(times):
+            heartrate = columns['heartrate'][i]
+            points.append(PointStats(lap=columns['lap'][i],
+                                     time=_to_datetime(time) if time is not None else None,
+                                     distance=columns['distance'][i],
+                                     heartrate=heartrate if math.isnan(heartrate) else int(heartrate),
+                                     speed=columns['speed'][i],
+                                     altitude=columns['altitude'][i],
+                                     latitude=columns['latitude'][i],
+                                     longitude=columns['longitude'][i]))
+        return points
+
+    def to_dicts(self, columns=None):
+        """
+        Convert to the list of dictionaries returned by get_all_data_points
+        Missing values are left out of the dictionary and laps start at 1
+        Only the given columns are included, by default the ones get_all_data_points returns
+        """
+        from tcx_parser import DICT_COLUMNS, POINT_FIELDS
+        columns = [name for name in (columns or DICT_COLUMNS) if name in self._columns]
+        names = [name for name in columns if name != 'time']
+        keys = [POINT_FIELDS[name].key for name in names]
+        ints = [POINT_FIELDS[name].integer for name in names]
+        values_by_column = [self._columns[name].tolist() for name in names]
+        times = self.time_ns().tolist() if 'time' in columns else None
+        laps = self._columns['lap'].tolist()
+        points = []
+        for i, lap in enumerate(laps):
+            data = {'time': _to_datetime(times[i])} if times is not None else {}
+            for key, integer, values in zip(keys, ints, values_by_column):
+                value = values[i]
+                if not math.isnan(value):
+                    data[key] = int(value) if integer else value
+            data['lap'] = lap + 1
+            points.append(data)
+        return points
+
+
+class TimeIndex():
+    """
+    Nearest time lookups over a set of timestamps using sorted-array search
+    Works on absolute UTC times, so unlike comparing times of day it is
+    correct for activities that run past midnight
+    """
+
+    def __init__(self, times):
+        times = to_ns(times)
+        if len(times) == 0:
+            raise ValueError("Can't index an empty set of times")
+        self.order = None
+        if np.any(times[1:] < times[:-1]):
+            self.order = np.argsort(times, kind='stable')
+            times = times[self.order]
+        self.times = times
+
+    def __len__(self):
+        return len(self.times)
+
+    def nearest_many(self, times):
+        """
+        Find the closest indexed time for every time in times
+        Returns (indices, offsets) where offsets are the indexed time minus the
+        query time in seconds, ties go to the earlier point
+        """
+        queries = to_ns(times)
+        right = np.searchsorted(self.times, queries).clip(0, len(self.times) - 1)
+        left = (right - 1).clip(0)
+        right_closer = np.abs(self.times[right] - queries) < np.abs(self.times[left] - queries)
+        positions = np.where(right_closer, right, left)
+
+        offsets = (self.times[positions] - queries) / 1e9
+        indices = positions if self.order is None else self.order[positions]
+        return indices, offsets
+
+    def nearest(self, time):
+        """Returns (index, offset in seconds) of the closest indexed time"""
+        indices, offsets = self.nearest_many([time])
+        return int(indices[0]), float(offsets[0])
+
+
+def to_ns(times):
+    """
+    Convert times to an int64 array of nanoseconds since the epoch
+    Accepts datetime64 arrays, int64 nanoseconds, datetimes and TCX time strings
+    Naive datetimes are taken as UTC
+    """
+    if isinstance(times, np.ndarray):
+        if times.dtype.kind == 'M':
+            return times.astype('datetime64[ns]').view('int64')
+        return times.astype('int64', copy=False)
+
+    values = []
+    for time in times:
+        if isinstance(time, datetime.datetime):
+            if time.tzinfo is None:
+                time = time.replace(tzinfo=datetime.timezone.utc)
+            values.append((time - EPOCH) // datetime.timedelta(microseconds=1) * 1000)
+        elif isinstance(time, str):
+            values.append(time_ns(time))
+        elif isinstance(time, np.datetime64):
+            values.append(int(time.astype('datetime64[ns]').astype('int64')))
+        else:
+            values.append(int(time))
+    return np.array(values, dtype='int64')
+
+
+def _to_datetime(time_ns):
+    seconds, nanoseconds = divmod(time_ns, 1_000_000_000)
+    return (datetime.datetime.fromtimestamp(seconds, datetime.timezone.utc)
+            + datetime.timedelta(microseconds=nanoseconds // 1000))
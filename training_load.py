@@ -0,0 +1,221 @@
+import json
+import os
+from dataclasses import dataclass, asdict, field
+
+import numpy as np
+
+import ingest
+from cache import file_fingerprint
+from downloader import write_atomic
+
+
+TRAINING_PATH = os.path.join(ingest.ACTIVITIES_FOLDER, "training.json")
+MAX_HEARTRATE = 190
+REST_HEARTRATE = 60
+# zone lower bounds as a fraction of max heart rate, zone 0 is everything below the first
+ZONE_BOUNDS = (0.5, 0.6, 0.7, 0.8, 0.9)
+# a gap longer than this between two points is a pause and is not counted
+MAX_GAP = 30.0
+ACUTE_DAYS = 7
+CHRONIC_DAYS = 42
+# the only Track columns the loads need, nothing else is parsed
+COLUMNS = ('time', 'heartrate')
+
+
+@dataclass
+class ActivityLoad:
+    date: str
+    duration: float
+    trimp: float
+    zones: list = field(default_factory=list)
+
+
+@dataclass
+class DailyLoad:
+    date: str
+    trimp: float
+    atl: float
+    ctl: float
+
+    @property
+    def tsb(self):
+        """Training stress balance, positive when fresh"""
+        return self.ctl - self.atl
+
+
+def _heartrate_intervals(track, max_gap=MAX_GAP):
+    """
+    Heart rate and length in seconds of every interval between two points
+    Each interval takes the heart rate of the point it starts at, intervals without a
+    heart rate or longer than max_gap are dropped
+    """
+    times = track.time_ns()
+    heartrate = track.heartrate
+    if len(times) < 2:
+        return heartrate[:0], np.zeros(0)
+    seconds = np.diff(times) / 1e9
+    heartrate = heartrate[:-1]
+    keep = ~np.isnan(heartrate) & (seconds > 0) & (seconds <= max_gap)
+    return heartrate[keep], seconds[keep]
+
+
+def time_in_zones(track, max_heartrate=MAX_HEARTRATE, bounds=ZONE_BOUNDS, max_gap=MAX_GAP):
+    """Seconds spent in each heart rate zone, returns len(bounds) + 1 values starting with zone 0"""
+    heartrate, seconds = _heartrate_intervals(track, max_gap)
+    zones = np.digitize(heartrate, np.asarray(bounds) * max_heartrate)
+    return np.bincount(zones, weights=seconds, minlength=len(bounds) + 1)
+
+
+def trimp(track, max_heartrate=MAX_HEARTRATE, rest_heartrate=REST_HEARTRATE, female=False, max_gap=MAX_GAP):
+    """
+    Banister TRIMP: minutes weighted by exp(b * heart rate reserve) over every interval
+    """
+    heartrate, seconds = _heartrate_intervals(track, max_gap)
+    a, b = (0.86, 1.67) if female else (0.64, 1.92)
+    reserve = np.clip((heartrate - rest_heartrate) / (max_heartrate - rest_heartrate), 0.0, 1.0)
+    return float(np.sum(seconds / 60 * reserve * a * np.exp(b * reserve)))
+
+
+def activity_load(track, **settings):
+    """ActivityLoad for one track, dated by its first point in UTC"""
+    times = track.time_ns()
+    date = str(times[0].astype('datetime64[ns]').astype('datetime64[D]')) if len(times) else None
+    duration = float((times[-1] - times[0]) / 1e9) if len(times) else 0.0
+    zone_settings = {k: v for k, v in settings.items() if k in ("max_heartrate", "max_gap")}
+    return ActivityLoad(date=date, duration=duration, trimp=trimp(track, **settings),
+                        zones=time_in_zones(track, **zone_settings).tolist())
+
+
+def rolling_loads(trimps, start_atl=0.0, start_ctl=0.0):
+    """
+    Acute (7 day) and chronic (42 day) training load as exponentially weighted averages
+    trimps is the load of consecutive days, returns (atl, ctl) arrays
+    """
+    trimps = np.asarray(trimps, dtype='float64')
+    atl = np.empty(len(trimps))
+    ctl = np.empty(len(trimps))
+    acute = 1 - np.exp(-1 / ACUTE_DAYS)
+    chronic = 1 - np.exp(-1 / CHRONIC_DAYS)
+    for i, load in enumerate(trimps):
+        start_atl += (load - start_atl) * acute
+        start_ctl += (load - start_ctl) * chronic
+        atl[i] = start_atl
+        ctl[i] = start_ctl
+    return atl, ctl
+
+
+class TrainingLog():
+    """
+    TRIMP and time in zone per activity and ATL/CTL per day, kept in activities/training.json
+    Every file's fingerprint is remembered so update only parses new or changed files,
+    only the days those files fall on are re-summed and the rolling loads are only
+    recomputed from the first of those days on. Files that were deleted are dropped
+    """
+
+    def __init__(self, path=TRAINING_PATH, max_heartrate=None, rest_heartrate=None, female=None):
+        """Heart rate settings left as None are taken from the saved log or the defaults"""
+        self.path = path
+        self.activities = {}
+        self.days = {}
+        data = {}
+        if os.path.isfile(path):
+            with open(path) as f:
+                data = json.load(f)
+        saved = data.get("settings", {})
+        self.settings = {"max_heartrate": max_heartrate or saved.get("max_heartrate", MAX_HEARTRATE),
+                         "rest_heartrate": rest_heartrate or saved.get("rest_heartrate", REST_HEARTRATE),
+                         "female": saved.get("female", False) if female is None else female}
+        # loads computed with other heart rate settings can't be reused
+        if saved == self.settings:
+            self.activities = {k: (v["fingerprint"], ActivityLoad(**v["load"]))
+                               for k, v in data.get("activities", {}).items()}
+            self.days = {d.date: d for d in (DailyLoad(**v) for v in data.get("days", []))}
+
+    def is_current(self, path):
+        entry = self.activities.get(path)
+        return entry is not None and entry[0] == list(file_fingerprint(path))
+
+    def update(self, paths, cache=None, workers=None):
+        """
+        Add every new or changed file in paths, files no longer in paths are kept as long
+        as they still exist
+        Returns the sorted dates that were recomputed
+        """
+        affected = set()
+        for path in [path for path in self.activities if not os.path.isfile(path)]:
+            affected.add(self.activities.pop(path)[1].date)
+        pending = [path for path in paths if not self.is_current(path)]
+        for result in ingest.iter_archive(pending, workers=workers, cache=cache, columns=COLUMNS):
+            if result.error:
+                continue
+            old = self.activities.get(result.path)
+            if old is not None:
+                affected.add(old[1].date)
+            load = activity_load(result.track, **self.settings)
+            if load.date is None:
+                continue
+            self.activities[result.path] = (list(file_fingerprint(result.path)), load)
+            affected.add(load.date)
+        if affected:
+            self.recompute(min(affected), affected)
+        self.save()
+        return sorted(affected)
+
+    def rename(self, old_path, new_path):
+        """Keep the load of old_path under new_path, e.g. after the file was compressed"""
+        entry = self.activities.pop(old_path, None)
+        if entry is not None:
+            self.activities[new_path] = (list(file_fingerprint(new_path)), entry[1])
+
+    def remove(self, path):
+        entry = self.activities.pop(path, None)
+        if entry is not None:
+            self.recompute(entry[1].date, {entry[1].date})
+
+    def recompute(self, first, affected=()):
+        """Re-sum the affected days and roll ATL/CTL forward from first to the last activity"""
+        if not self.activities:
+            self.days = {}
+            return
+        totals = {}
+        for fingerprint, load in self.activities.values():
+            if load.date in affected:
+                totals[load.date] = totals.get(load.date, 0.0) + load.trimp
+        # days after the last activity, e.g. of one that was removed, are dropped
+        last = max(load.date for fingerprint, load in self.activities.values())
+        if first > last:
+            self.days = {d: self.days[d] for d in sorted(self.days) if d <= last}
+            return
+
+        dates = np.arange(np.datetime64(first), np.datetime64(last) + 1).astype(str).tolist()
+        trimps = [totals.get(d, 0.0) if d in affected else (self.days[d].trimp if d in self.days else 0.0)
+                  for d in dates]
+        previous = self.days.get(str(np.datetime64(first) - 1))
+        atl, ctl = rolling_loads(trimps, previous.atl if previous else 0.0, previous.ctl if previous else 0.0)
+        for i, date in enumerate(dates):
+            self.days[date] = DailyLoad(date=date, trimp=trimps[i], atl=float(atl[i]), ctl=float(ctl[i]))
+        self.days = {d: self.days[d] for d in sorted(self.days) if d <= last}
+
+    def daily(self, start=None, end=None):
+        """DailyLoad for every day from start to end (date or ISO strings)"""
+        start = str(start) if start else None
+        end = str(end) if end else None
+        return [d for date, d in sorted(self.days.items())
+                if (start is None or date >= start) and (end is None or date <= end)]
+
+    def zone_totals(self, start=None, end=None):
+        """Seconds in each zone summed over the activities between start and end"""
+        start = str(start) if start else None
+        end = str(end) if end else None
+        zones = [load.zones for fingerprint, load in self.activities.values()
+                 if (start is None or load.date >= start) and (end is None or load.date <= end)]
+        if not zones:
+            return np.zeros(len(ZONE_BOUNDS) + 1)
+        return np.sum(zones, axis=0)
+
+    def save(self):
+        data = {"settings": self.settings,
+                "activities": {k: {"fingerprint": fp, "load": asdict(load)}
+                               for k, (fp, load) in sorted(self.activities.items())},
+                "days": [asdict(d) for date, d in sorted(self.days.items())]}
+        write_atomic(self.path, json.dumps(data, indent=1).encode("utf-8"))